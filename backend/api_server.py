@@ -1,156 +1,434 @@
-import viser
-import torch
+import time
+
+# Timed so container cold starts can be broken down. Heavy modules (torch,
+# worldgen, viser) are imported lazily, during warm-up or the first generation.
+_import_start = time.perf_counter()
+
+import asyncio
+import math
 import os
-import numpy as np
-from PIL import Image
 from typing import Optional
-import time
-from pathlib import Path
-from worldgen.utils.splat_utils import SplatFile
-from worldgen import WorldGen
+from contextlib import asynccontextmanager, contextmanager
 import threading
-import signal
-import sys
-from fastapi import FastAPI, HTTPException
+import json
+import tempfile
+import uuid
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
 import uvicorn
-from scipy.spatial.transform import Rotation as R
+from jobs import ClientLimitError, JobQueue, QueueFullError
+from rate_limit import RateLimiter
+from viewer_pool import PORT_POLL_INTERVAL, PORT_RELEASE_TIMEOUT, ViewerPool, port_available
+from splat_cache import SplatCache, cache_key
+from backends import create_backend, generation_mode
+from generation_workers import create_worker_pool
+from dream_library import DreamLibrary
+from mesh_export import MeshCache, load_glb, mesh_summary, to_trimesh
+from image_cache import ImageCache, panorama_key
+from scene_summary import summarize_scene
+from splat_compress import Compression
+from splat_format import SplatArrays, save_splat
+from metrics import (
+    REGISTRY,
+    gpu_allocated_bytes,
+    gpu_peak_bytes,
+    gpu_total_bytes,
+    observe_span,
+    record_gpu_peak,
+    record_gpu_total,
+    reset_gpu_peak,
+    span,
+)
+
+startup_timings = {"import_api_server": time.perf_counter() - _import_start}
+
+
+VIEWER_PORT = 8080
+# Where clients reach this API; viewer URLs are scene-scoped routes under it
+PUBLIC_URL = os.environ.get("DREAM_PUBLIC_URL", "http://localhost:8888")
+# Job workers; 0 runs as many as the backend can generate at once (one per device)
+NUM_WORKERS = int(os.environ.get("DREAM_NUM_WORKERS", "0"))
+MAX_QUEUE_SIZE = int(os.environ.get("DREAM_MAX_QUEUE_SIZE", "64"))
+# Per-client admission control; 0 disables a limit. Clients are told when to retry (Retry-After)
+RATE_LIMIT_PER_MIN = float(os.environ.get("DREAM_RATE_LIMIT_PER_MIN", "10"))
+RATE_LIMIT_BURST = int(os.environ.get("DREAM_RATE_LIMIT_BURST", "5"))
+MAX_CLIENT_QUEUED = int(os.environ.get("DREAM_MAX_CLIENT_QUEUED", "8"))
+MAX_CLIENT_RUNNING = int(os.environ.get("DREAM_MAX_CLIENT_RUNNING", "0"))
+# Refuse new jobs that would wait longer than this many seconds to start
+MAX_QUEUE_WAIT = float(os.environ.get("DREAM_MAX_QUEUE_WAIT", "600"))
+# Header identifying the client (e.g. X-API-Key set by an auth proxy); empty uses the client address
+CLIENT_KEY_HEADER = os.environ.get("DREAM_CLIENT_KEY_HEADER", "")
+# Live scenes are served on consecutive ports starting at VIEWER_PORT
+MAX_LIVE_SCENES = int(os.environ.get("DREAM_MAX_LIVE_SCENES", "4"))
+VIEWER_MEMORY_BUDGET_MB = int(os.environ.get("DREAM_VIEWER_MEMORY_BUDGET_MB", "4096"))
+# Splats are streamed to viewers as a coarse preview, then the chosen level in chunks
+LOD_LEVELS = int(os.environ.get("DREAM_LOD_LEVELS", "3"))
+STREAM_CHUNK_SPLATS = int(os.environ.get("DREAM_STREAM_CHUNK_SPLATS", "250000"))
+# Threads that convert and validate splats before serving; 0 uses every core
+CONVERT_WORKERS = int(os.environ.get("DREAM_CONVERT_WORKERS", "0"))
+CACHE_DIR = os.environ.get("DREAM_CACHE_DIR", "~/.cache/dream-storage/splats")
+CACHE_MAX_MB = int(os.environ.get("DREAM_CACHE_MAX_MB", "20480"))
+# Every generated dream is kept here; set to an empty string to disable the library
+LIBRARY_DIR = os.environ.get("DREAM_LIBRARY_DIR", "~/.local/share/dream-storage/library")
+# GLBs of generated meshes, served at /meshes/<key>.glb
+MESH_CACHE_DIR = os.environ.get("DREAM_MESH_CACHE_DIR", "~/.cache/dream-storage/meshes")
+MESH_CACHE_MAX_MB = int(os.environ.get("DREAM_MESH_CACHE_MAX_MB", "4096"))
+# Panoramas, reused when a prompt is regenerated with other settings
+PANORAMA_CACHE_DIR = os.environ.get("DREAM_PANORAMA_CACHE_DIR", "~/.cache/dream-storage/panoramas")
+PANORAMA_CACHE_MAX_MB = int(os.environ.get("DREAM_PANORAMA_CACHE_MAX_MB", "2048"))
+# Images uploaded with POST /images for image-to-scene and panorama requests
+UPLOAD_DIR = os.environ.get("DREAM_UPLOAD_DIR", "~/.cache/dream-storage/uploads")
+UPLOAD_DIR_MAX_MB = int(os.environ.get("DREAM_UPLOAD_DIR_MAX_MB", "1024"))
+MAX_UPLOAD_MB = int(os.environ.get("DREAM_MAX_UPLOAD_MB", "32"))
+# Store scenes quantized (see splat_compress.py); colors use a k-means palette if DREAM_PALETTE_SIZE > 0
+CACHE_COMPRESSION = os.environ.get("DREAM_CACHE_COMPRESSION", "0") == "1"
+LIBRARY_COMPRESSION = os.environ.get("DREAM_LIBRARY_COMPRESSION", "0") == "1"
+COMPRESSION = Compression(palette_size=int(os.environ.get("DREAM_PALETTE_SIZE", "0")))
+
+# Load the model (and optionally run one throwaway generation) at startup
+EAGER_WARMUP = os.environ.get("DREAM_EAGER_WARMUP", "1") == "1"
+WARMUP_GENERATION = os.environ.get("DREAM_WARMUP_GENERATION", "0") == "1"
+WARMUP_PROMPT = "a quiet empty room"
+
+# "worldgen" for the real model, or "synthetic" for CPU-only CI and load tests
+BACKEND = os.environ.get("DREAM_BACKEND", "worldgen")
+SYNTHETIC_SPLATS = int(os.environ.get("DREAM_SYNTHETIC_SPLATS", "500000"))
+SYNTHETIC_LATENCY = float(os.environ.get("DREAM_SYNTHETIC_LATENCY", "0"))
+# Generate in one worker process per device: "cuda:0,cuda:1", "auto" for every GPU, or a
+# number of CPU workers (for the synthetic backend); empty generates in the server process
+DEVICES = os.environ.get("DREAM_DEVICES", "")
+
+# Generation settings; part of the cache key so changing them invalidates old entries
+WORLDGEN_CONFIG = {"inpaint_bg": False, "resolution": 1600}
 
 
 class GenerateRequest(BaseModel):
-    prompt: str
+    prompt: str = ""
+    # Images from POST /images: condition on an image (image-to-scene), or lift a panorama directly
+    image_id: Optional[str] = None
+    pano_image_id: Optional[str] = None
+    priority: int = 0
+    seed: Optional[int] = None
+    use_cache: bool = True
+    # Generate a textured mesh instead of gaussian splats, optionally decimated
+    return_mesh: bool = False
+    target_faces: Optional[int] = None
+    # Answer once the job has finished instead of right away; it is cancelled if the client disconnects
+    wait: bool = False
 
 
 class GenerateResponse(BaseModel):
     status: str
-    viewer_url: str
+    job_id: str
+    queue_position: Optional[int] = None
+    eta_seconds: Optional[float] = None
+    # True when attached to an identical request that was already in flight
+    coalesced: bool = False
+
+
+@contextmanager
+def timed(name: str):
+    """Record how long a startup phase takes, log it and export it as a span"""
+    start = time.perf_counter()
+    yield
+    startup_timings[name] = time.perf_counter() - start
+    observe_span(name, startup_timings[name])
+    print(f"[startup] {name}: {startup_timings[name]:.2f}s")
+
+
+def create_generation_backend():
+    """Build the generation backend selected by DREAM_BACKEND, in worker processes if DREAM_DEVICES is set"""
+    if BACKEND == "synthetic":
+        options = {"num_splats": SYNTHETIC_SPLATS, "latency": SYNTHETIC_LATENCY}
+    else:
+        options = dict(WORLDGEN_CONFIG)
+    if DEVICES:
+        return create_worker_pool(BACKEND, DEVICES, **options)
+    return create_backend(BACKEND, **options)
 
 
 class ViserServerManager:
-    """Manages the Viser server lifecycle for API usage"""
-
-    def __init__(self):
-        self.server = None
-        self.server_thread = None
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.worldgen = None
-        self.is_running = False
-
-    def stop_server(self):
-        """Stop the current Viser server if running"""
-        if self.server is not None:
-            print("Stopping existing Viser server...")
-            try:
-                # Properly close the Viser server to release the port
-                self.server.stop()
-            except Exception as e:
-                print(f"Error stopping server: {e}")
-
-            self.is_running = False
-            self.server = None
-            self.server_thread = None
-            # Give the port time to be released
-            time.sleep(2)
-
-    def generate_and_serve(self, prompt: str, port: int = 8080):
-        """Generate world and start Viser server"""
-        # Stop any existing server
-        self.stop_server()
-
-        # Initialize WorldGen if needed
-        if self.worldgen is None:
-            print("Initializing WorldGen...")
-            self.worldgen = WorldGen(
-                mode="t2s",
-                inpaint_bg=False,
-                resolution=1600,
-                device=self.device,
-                low_vram=torch.cuda.get_device_properties(0).total_memory / (1024 ** 3) < 24
-            )
-
-        # Generate the world
-        print(f"Generating world for prompt: '{prompt}'")
-        scene = self.worldgen.generate_world(prompt, return_mesh=False)
-
-        # Create new Viser server
-        print(f"Starting Viser server on port {port}...")
-        self.server = viser.ViserServer(port=port)
-        self.server.scene.set_up_direction("-y")
-        self.server.scene.enable_default_lights(False)
-
-        # Add the generated scene
-        self._add_gs(scene)
-        self._set_bg(scene)
-        self._add_original_camera()
-
-        print(f"✨ World successfully generated and served at http://localhost:{port}")
-        self.is_running = True
-
-        # Set up client connection handlers
-        @self.server.on_client_connect
-        def connect(client: viser.ClientHandle) -> None:
-            self._create_ui(client)
-
-        return f"http://localhost:{port}"
-
-    def _add_gs(self, splat: SplatFile):
-        """Add gaussian splats to the scene"""
-        # Convert to float32 to avoid BFloat16 errors
-        centers = np.asarray(splat.centers, dtype=np.float32)
-        rgbs = np.asarray(splat.rgbs, dtype=np.float32)
-        opacities = np.asarray(splat.opacities, dtype=np.float32)
-        covariances = np.asarray(splat.covariances, dtype=np.float32)
-
-        self.scene_gs_handle = self.server.scene.add_gaussian_splats(
-            "/scene_gs",
-            centers=centers,
-            rgbs=rgbs,
-            opacities=opacities,
-            covariances=covariances,
+    """Manages the generation backend and the pool of Viser servers for API usage"""
+
+    def __init__(self, backend=None, viewer_pool=None, splat_cache=None, library=None, mesh_cache=None,
+                 panorama_cache=None, uploads=None):
+        self.backend = backend or create_generation_backend()
+        self.viewer_pool = viewer_pool or ViewerPool(
+            base_port=VIEWER_PORT,
+            max_scenes=MAX_LIVE_SCENES,
+            memory_budget_bytes=VIEWER_MEMORY_BUDGET_MB * 1024 ** 2,
+            lod_levels=LOD_LEVELS,
+            chunk_size=STREAM_CHUNK_SPLATS,
+            convert_workers=CONVERT_WORKERS or None,
+            public_url=PUBLIC_URL,
         )
-
-    def _set_bg(self, splat: SplatFile):
-        """Set background color based on farthest splat points"""
-        position = np.linalg.norm(splat.centers, axis=1)
-        indices = np.argsort(position)[-5:]
-        farthest_point_color = splat.rgbs[indices]
-        farthest_point_color = np.mean(farthest_point_color, axis=0)
-        bg_img = np.ones((1, 1, 3)) * farthest_point_color
-        self.server.scene.set_background_image(bg_img)
-
-    def _add_original_camera(self):
-        """Add the original camera frustum"""
-        h, w = 1080, 1920
-        fov = np.deg2rad(90)
-        aspect = w / h
-        self.original_camera = self.server.scene.add_camera_frustum(
-            "original_camera", fov, aspect
+        self.splat_cache = splat_cache or SplatCache(
+            CACHE_DIR, max_bytes=CACHE_MAX_MB * 1024 ** 2, compression=COMPRESSION if CACHE_COMPRESSION else None
         )
-        self.original_camera.visible = False
-
-    def _create_ui(self, client):
-        """Create minimal UI for the viewer"""
-        initial_fov_rad = self.original_camera.fov
-        client.camera.position = (0, 0, 0)
-        client.camera.wxyz = (1, 0, 0, 0)
-        client.camera.fov = initial_fov_rad
-        client.camera.far = 10000
-        client.camera.near = 0.01
-
-        # Disable the scene tree only, keep other GUI elements
-        client.scene.show_scene_tree = False
+        if library is None and LIBRARY_DIR:
+            library = DreamLibrary(LIBRARY_DIR, compression=COMPRESSION if LIBRARY_COMPRESSION else None)
+        self.library = library
+        self.mesh_cache = mesh_cache or MeshCache(MESH_CACHE_DIR, max_bytes=MESH_CACHE_MAX_MB * 1024 ** 2)
+        self.panorama_cache = panorama_cache or ImageCache(
+            PANORAMA_CACHE_DIR, max_bytes=PANORAMA_CACHE_MAX_MB * 1024 ** 2
+        )
+        self.uploads = uploads or ImageCache(UPLOAD_DIR, max_bytes=UPLOAD_DIR_MAX_MB * 1024 ** 2, suffix=".img")
+        # Cleared if the backend turns out not to generate panoramas on their own
+        self.split_panoramas = self.backend.supports_panoramas
+        # Generations the backend can run at once: one, or one per worker device
+        self.lock = threading.Semaphore(self.backend.concurrency)
+        self.load_lock = threading.Lock()
+
+    @property
+    def device_name(self) -> str:
+        """Device without importing torch, for cheap health checks"""
+        return self.backend.device_name
+
+    @property
+    def is_running(self):
+        return self.viewer_pool.scene_count() > 0
 
-        @self.original_camera.on_click
-        def _(_):
-            with client.atomic():
-                client.camera.wxyz = self.original_camera.wxyz
-                client.camera.position = self.original_camera.position
-                client.camera.fov = self.original_camera.fov
+    def stop_server(self):
+        """Stop all Viser servers"""
+        self.viewer_pool.shutdown()
+
+    def warm_up(self, dummy_generation: bool = False):
+        """Import heavy modules, load the model and start a viewer ahead of the first request"""
+        with timed("import_viser"):
+            import viser  # noqa: F401
+        with self.lock:
+            self._load_backend(lambda stage: None)
+            if dummy_generation:
+                # Compiles and autotunes kernels; the result is thrown away
+                with timed("warmup_generation"):
+                    self._generate(WARMUP_PROMPT)
+        with timed("start_viewer"):
+            self.viewer_pool.warm_up()
+
+    def _load_backend(self, set_stage, timings=None):
+        """Load the backend's model on first use, once even with several generations waiting"""
+        with self.load_lock:
+            if self.backend.is_loaded():
+                return
+            set_stage("loading_model")
+            print(f"Initializing {self.backend.name} backend...")
+            with timed("load_model"):
+                self.backend.load()
+            startup_timings.update(self.backend.timings)
+            if not self.backend.reports_gpu_peak:
+                # Worker pools report their own devices
+                for device, total in gpu_total_bytes().items():
+                    record_gpu_total(total, device)
+            if timings is not None:
+                timings["load_model"] = startup_timings["load_model"]
+
+    def _generate(self, prompt: str, timings=None, **options):
+        """Run the backend, recording generation time and peak GPU memory"""
+        if self.backend.reports_gpu_peak:
+            with span("generation", timings, backend=self.backend.name):
+                return self.backend.generate(prompt, **options)
+        reset_gpu_peak()
+        with span("generation", timings, backend=self.backend.name):
+            scene = self.backend.generate(prompt, **options)
+        peak = gpu_peak_bytes()
+        if peak is not None:
+            record_gpu_peak(peak, low_vram=bool(getattr(self.backend, "low_vram", None)))
+        return scene
+
+    def scene_key(self, prompt: str, seed: Optional[int] = None, image_id: Optional[str] = None,
+                  pano_image_id: Optional[str] = None, **extra) -> str:
+        """Cache key of a generated scene; image ids are the digests `file_digest` gives the demo"""
+        if pano_image_id is not None:
+            extra["pano_image"] = pano_image_id
+        if image_id is not None:
+            extra["image"] = image_id
+        return cache_key(prompt, seed=seed, **self.backend.cache_params(generation_mode(image_id)), **extra)
+
+    def panorama_key(self, prompt: str, seed: Optional[int] = None, image_id: Optional[str] = None) -> Optional[str]:
+        """Key of the panorama a request starts from, or None if the backend can't generate one separately"""
+        if not self.split_panoramas:
+            return None
+        return panorama_key(prompt, seed=seed, image=image_id,
+                            **self.backend.panorama_params(generation_mode(image_id)))
+
+    def uploaded_image(self, image_id: Optional[str]):
+        """An image from POST /images, or None without an id"""
+        if image_id is None:
+            return None
+        image = self.uploads.get(image_id)
+        if image is None:
+            raise ValueError(f"Image {image_id} not found; upload it again")
+        return image
+
+    def _generate_scene(self, prompt: str, set_stage, timings, seed=None, image_id=None, pano_image_id=None,
+                        use_cache: bool = True, return_mesh: bool = False):
+        """Run the backend, starting from a cached panorama when there is one
+
+        Without an uploaded panorama, the panorama is generated on its own first
+        and cached, so a later request with other lifting settings skips it.
+        """
+        image = self.uploaded_image(image_id)
+        pano_image = self.uploaded_image(pano_image_id)
+        pano_key = self.panorama_key(prompt, seed, image_id) if pano_image is None else None
+        if pano_key is not None and use_cache:
+            pano_image = self.panorama_cache.get(pano_key)
+            if pano_image is not None:
+                print(f"Reusing the cached panorama for prompt '{prompt}'")
+
+        with self.lock:
+            self._load_backend(set_stage, timings)
+            if pano_image is None and pano_key is not None:
+                set_stage("generating_panorama")
+                try:
+                    with span("panorama", timings):
+                        pano_image = self.backend.generate_panorama(prompt, image=image, seed=seed)
+                except NotImplementedError as e:
+                    print(f"Generating without caching panoramas: {e}")
+                    self.split_panoramas = False
+                else:
+                    self.panorama_cache.put(pano_key, pano_image)
+            set_stage("generating")
+            return self._generate(prompt, timings, image=image, pano_image=pano_image, seed=seed,
+                                  return_mesh=return_mesh)
+
+    def generate_and_serve(
+        self,
+        prompt: str,
+        scene_id: Optional[str] = None,
+        seed: Optional[int] = None,
+        use_cache: bool = True,
+        set_stage=None,
+        image_id: Optional[str] = None,
+        pano_image_id: Optional[str] = None,
+    ):
+        """Generate world (or load it from the cache) and serve it from the viewer pool
+
+        `set_stage` is an optional progress callback used by the job queue.
+        """
+        scene_id = scene_id or uuid.uuid4().hex
+        set_stage = set_stage or (lambda stage: None)
+        key = self.scene_key(prompt, seed=seed, image_id=image_id, pano_image_id=pano_image_id)
+        timings = {}
+
+        scene = None
+        summary = None
+        validated = False
+        if use_cache:
+            set_stage("checking_cache")
+            with span("cache_get", timings):
+                scene = self.splat_cache.get(key)
+            if scene is not None:
+                summary = self.splat_cache.summary(key)
+                print(f"Loaded world for prompt '{prompt}' from cache")
+
+        if scene is None:
+            print(f"Generating world for prompt: '{prompt}'")
+            scene = self._generate_scene(prompt, set_stage, timings, seed=seed, image_id=image_id,
+                                         pano_image_id=pano_image_id, use_cache=use_cache)
+            # Invalid splats are dropped before anything is derived from or stored with the scene
+            scene = self.viewer_pool.validate(scene_id, scene)
+            with span("cache_put", timings):
+                scene = self.splat_cache.put(key, scene)
+            validated = True
+
+        if summary is None:
+            with span("summary", timings):
+                summary = summarize_scene(scene)
+            self.splat_cache.set_summary(key, summary)
+
+        if self.library is not None:
+            set_stage("saving")
+            # Hard-links the cache entry when there is one
+            with span("library_add", timings):
+                self.library.add(
+                    scene_id, prompt, scene, seed=seed, timings=timings,
+                    source_path=self.splat_cache.path(key), summary=summary,
+                )
+
+        set_stage("serving")
+        viewer_url = self.viewer_pool.serve(scene_id, scene, summary, validated=validated)
+        print(f"✨ World successfully generated and served at {viewer_url}")
+        return viewer_url
+
+    def generate_mesh_and_serve(
+        self,
+        prompt: str,
+        scene_id: Optional[str] = None,
+        seed: Optional[int] = None,
+        use_cache: bool = True,
+        target_faces: Optional[int] = None,
+        set_stage=None,
+        image_id: Optional[str] = None,
+        pano_image_id: Optional[str] = None,
+    ):
+        """Generate a mesh (or load its GLB from the cache), serve it and return (viewer URL, mesh key)
+
+        The mesh is converted to a trimesh once; the same object is exported as
+        the cached GLB and displayed. Meshes are not added to the dream library.
+        """
+        scene_id = scene_id or uuid.uuid4().hex
+        set_stage = set_stage or (lambda stage: None)
+        key = self.scene_key(prompt, seed=seed, image_id=image_id, pano_image_id=pano_image_id,
+                             return_mesh=True, target_faces=target_faces)
+        timings = {}
+
+        mesh = None
+        if use_cache:
+            set_stage("checking_cache")
+            with span("cache_get", timings):
+                path = self.mesh_cache.get(key)
+                try:
+                    mesh = load_glb(path) if path is not None else None
+                except (OSError, ValueError) as e:
+                    # Evicted or partially written meanwhile
+                    print(f"Ignoring unreadable cached mesh {key}: {e}")
+            if mesh is not None:
+                print(f"Loaded mesh for prompt '{prompt}' from cache")
+
+        if mesh is None:
+            if getattr(self.backend, "inpaint_bg", False):
+                raise ValueError("inpaint_bg is not supported when return_mesh is True")
+            print(f"Generating mesh for prompt: '{prompt}'")
+            o3d_mesh = self._generate_scene(prompt, set_stage, timings, seed=seed, image_id=image_id,
+                                            pano_image_id=pano_image_id, use_cache=use_cache, return_mesh=True)
+            set_stage("converting")
+            with span("mesh_conversion", timings):
+                mesh = to_trimesh(o3d_mesh, target_faces)
+            with span("mesh_export", timings):
+                self.mesh_cache.put(key, mesh)
+
+        set_stage("serving")
+        viewer_url = self.viewer_pool.serve_mesh(scene_id, mesh, mesh_summary(mesh))
+        print(f"✨ Mesh ({len(mesh.faces)} faces) successfully generated and served at {viewer_url}")
+        return viewer_url, key
+
+    def serve_dream(self, dream_id: str) -> Optional[str]:
+        """Serve a dream from the library, reusing its viewer if it is still live"""
+        viewer_url = self.viewer_pool.get_url(dream_id)
+        if viewer_url is None:
+            scene = self.library.load(dream_id)
+            if scene is None:
+                return None
+            viewer_url = self.viewer_pool.serve(dream_id, scene, self.library.summary(dream_id))
+        self.library.mark_served(dream_id)
+        return viewer_url
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the job workers (and warm-up) before serving requests, stop everything after"""
+    create_services()
+    start_up()
+    yield
+    await shut_down()
 
 
 # Initialize FastAPI app and ViserServerManager
-app = FastAPI(title="WorldGen API", version="1.0.0")
+app = FastAPI(title="WorldGen API", version="1.0.0", lifespan=lifespan)
 
 # Add CORS middleware to allow requests from any origin
 app.add_middleware(
@@ -161,44 +439,460 @@ app.add_middleware(
     allow_headers=["*"],  # Allow all headers
 )
 
-viser_manager = ViserServerManager()
+# Created by create_services in the lifespan rather than on import: spawned
+# generation workers import this module again and must not build their own
+viser_manager: Optional[ViserServerManager] = None
+job_queue: Optional[JobQueue] = None
+
+
+def run_generation_job(job, set_stage):
+    """Job queue runner: generate the job's world and report where to view it"""
+    params = dict(job.params)
+    if params.pop("return_mesh", False):
+        viewer_url, key = viser_manager.generate_mesh_and_serve(
+            job.prompt, scene_id=job.id, set_stage=set_stage, **params
+        )
+        result = {"scene_id": job.id, "viewer_url": viewer_url, "mesh_url": f"/meshes/{key}.glb"}
+    else:
+        params.pop("target_faces", None)
+        viewer_url = viser_manager.generate_and_serve(
+            job.prompt, scene_id=job.id, set_stage=set_stage, **params
+        )
+        result = {"scene_id": job.id, "viewer_url": viewer_url}
+    if params.get("pano_image_id") is None:
+        pano_key = viser_manager.panorama_key(job.prompt, params.get("seed"), params.get("image_id"))
+        if pano_key is not None and pano_key in viser_manager.panorama_cache:
+            result["panorama_url"] = f"/panoramas/{pano_key}.png"
+    return result
+
+
+def record_job_metrics(job):
+    """Count finished jobs and record how long they waited and ran"""
+    REGISTRY.counter("jobs_total", "Generation jobs by final status").inc(status=job.status)
+    if job.started_at is not None:
+        observe_span("job_wait", job.started_at - job.created_at)
+        observe_span("job", job.finished_at - job.started_at, status=job.status)
+
+
+rate_limiter = RateLimiter(rate=RATE_LIMIT_PER_MIN / 60, burst=RATE_LIMIT_BURST)
+
+
+def create_services():
+    """Build the server manager and job queue, and the gauges that read them"""
+    global viser_manager, job_queue
+    with timed("create_services"):
+        viser_manager = ViserServerManager()
+        job_queue = JobQueue(
+            run_generation_job,
+            num_workers=NUM_WORKERS or viser_manager.backend.concurrency,
+            max_queue_size=MAX_QUEUE_SIZE,
+            on_finish=record_job_metrics,
+            max_client_queued=MAX_CLIENT_QUEUED,
+            max_client_running=MAX_CLIENT_RUNNING,
+            max_wait=MAX_QUEUE_WAIT,
+        )
+
+    # Gauges read on each /metrics scrape
+    REGISTRY.gauge("queue_depth", "Generation jobs waiting in the queue", job_queue.queue_depth)
+    REGISTRY.gauge("running_jobs", "Generation jobs currently running", job_queue.running_count)
+    REGISTRY.gauge("live_scenes", "Scenes currently served by the viewer pool", viser_manager.viewer_pool.scene_count)
+    REGISTRY.gauge("viewer_memory_bytes", "Memory held by live scenes", viser_manager.viewer_pool.memory_used)
+    REGISTRY.gauge("viewer_clients", "Connected viewer clients", viser_manager.viewer_pool.client_count)
+    REGISTRY.gauge("cache_entries", "Scenes in the splat cache", lambda: viser_manager.splat_cache.stats()["entries"])
+    REGISTRY.counter("cache_hits_total", "Splat cache hits", lambda: viser_manager.splat_cache.hits)
+    REGISTRY.counter("cache_misses_total", "Splat cache misses", lambda: viser_manager.splat_cache.misses)
+    REGISTRY.gauge("gpu_memory_allocated_bytes", "GPU memory currently allocated by torch", gpu_allocated_bytes)
+
+
+def client_key(request: Request) -> str:
+    """Who a request comes from, for rate limits and fair sharing"""
+    if CLIENT_KEY_HEADER:
+        key = request.headers.get(CLIENT_KEY_HEADER)
+        if key:
+            return key
+    return request.client.host if request.client is not None else "unknown"
+
+
+def reject(status_code: int, detail: str, retry_after: float, reason: str):
+    """Refuse a generation request, telling the client when to try again"""
+    REGISTRY.counter("jobs_rejected_total", "Generation requests refused by admission control").inc(reason=reason)
+    raise HTTPException(status_code=status_code, detail=detail,
+                        headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+def parse_vector(value: str, name: str):
+    """An "x,y,z" query parameter as three floats"""
+    try:
+        vector = tuple(float(component) for component in value.split(","))
+    except ValueError:
+        vector = ()
+    if len(vector) != 3 or not all(math.isfinite(component) for component in vector):
+        raise HTTPException(status_code=400, detail=f"{name} must be three comma-separated numbers, got {value!r}")
+    return vector
+
+
+def get_job_or_404(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+# Readiness, separate from liveness: the API is up before the model is loaded
+startup_state = {"ready": False, "stage": "starting", "error": None}
+
+
+def warm_up():
+    """Load everything the first generation needs, then mark the API ready"""
+    startup_state["stage"] = "warming_up"
+    try:
+        with timed("warm_up"):
+            viser_manager.warm_up(dummy_generation=WARMUP_GENERATION)
+    except Exception as e:
+        print(f"Warm-up failed: {e}")
+        startup_state.update(stage="failed", error=str(e))
+        return
+    startup_state.update(ready=True, stage="ready")
+    breakdown = ", ".join(f"{name}={seconds:.2f}s" for name, seconds in startup_timings.items())
+    print(f"✅ Ready to generate ({breakdown})")
+
+
+def start_up():
+    """Start the generation workers and, optionally, warm up the model"""
+    with timed("start_workers"):
+        job_queue.start()
+    if EAGER_WARMUP:
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    else:
+        startup_state.update(ready=True, stage="ready")
+
+
+async def wait_for_ports(ports, timeout: float = PORT_RELEASE_TIMEOUT):
+    """Poll until the viewer ports are released, without blocking the event loop"""
+    deadline = time.monotonic() + timeout
+    busy = [port for port in ports if not port_available(port)]
+    while busy and time.monotonic() < deadline:
+        await asyncio.sleep(PORT_POLL_INTERVAL)
+        busy = [port for port in busy if not port_available(port)]
+    if busy:
+        print(f"⚠️ Viewer ports still in use after {timeout:.0f}s: {busy}")
+
+
+async def shut_down():
+    """Clean up on server shutdown"""
+    job_queue.shutdown()
+    ports = viser_manager.viewer_pool.ports()
+    # Stopping viewers and worker processes blocks, so it runs on the threadpool
+    await run_in_threadpool(viser_manager.stop_server)
+    if hasattr(viser_manager.backend, "shutdown"):
+        await run_in_threadpool(viser_manager.backend.shutdown)
+    if viser_manager.library is not None:
+        viser_manager.library.close()
+    # A restarted server can then take the same viewer ports (and URLs)
+    await wait_for_ports(ports)
 
 
 @app.get("/health")
-def health_check():
-    """Health check endpoint"""
+async def health_check():
+    """Liveness check; runs on the event loop and only reads counters without taking
+    any lock, so it answers at once even when every threadpool worker is busy"""
     return {
         "status": "ok",
+        "ready": startup_state["ready"],
         "viewer_running": viser_manager.is_running,
-        "device": str(viser_manager.device)
+        "backend": viser_manager.backend.name,
+        "device": viser_manager.device_name,
+        "live_scenes": viser_manager.viewer_pool.scene_count(),
+        "viewer_memory_mb": round(viser_manager.viewer_pool.memory_used() / 1024 ** 2, 1),
+        "cache": viser_manager.splat_cache.stats(),
+        "queue_depth": job_queue.queue_depth(),
+        "running_jobs": job_queue.running_count(),
+    }
+
+
+@app.get("/ready")
+def readiness_check():
+    """Readiness check; 503 until the model is loaded (when warming up eagerly)"""
+    body = {
+        "ready": startup_state["ready"],
+        "stage": startup_state["stage"],
+        "error": startup_state["error"],
+        "startup_timings": {name: round(seconds, 3) for name, seconds in startup_timings.items()},
     }
+    return JSONResponse(status_code=200 if startup_state["ready"] else 503, content=body)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Stage timings, job counts and resource gauges in the Prometheus text format"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+def admit_job(request: GenerateRequest, client: str):
+    """Validate a generation request and queue it, or refuse it with an HTTPException"""
+    if not request.prompt.strip() and request.image_id is None and request.pano_image_id is None:
+        raise HTTPException(status_code=400, detail="Prompt cannot be empty without an image")
+    for image_id in (request.image_id, request.pano_image_id):
+        if image_id is not None and image_id not in viser_manager.uploads:
+            raise HTTPException(status_code=404, detail=f"Image {image_id} not found; upload it with POST /images")
+    if request.target_faces is not None and request.target_faces < 1:
+        raise HTTPException(status_code=400, detail="target_faces must be positive")
+
+    # Identical requests in flight share one generation and one viewer
+    dedup_key = viser_manager.scene_key(
+        request.prompt,
+        seed=request.seed,
+        image_id=request.image_id,
+        pano_image_id=request.pano_image_id,
+        use_cache=request.use_cache,
+        return_mesh=request.return_mesh,
+        target_faces=request.target_faces,
+    )
+    try:
+        job, coalesced = job_queue.submit(
+            request.prompt,
+            priority=request.priority,
+            dedup_key=dedup_key,
+            client=client,
+            # Only new jobs use up rate limit tokens
+            charge=lambda: rate_limiter.acquire(client),
+            seed=request.seed,
+            use_cache=request.use_cache,
+            return_mesh=request.return_mesh,
+            target_faces=request.target_faces,
+            image_id=request.image_id,
+            pano_image_id=request.pano_image_id,
+        )
+    except ClientLimitError as e:
+        reject(429, str(e), e.retry_after, e.reason)
+    except QueueFullError as e:
+        reject(503, str(e), e.retry_after, e.reason)
+
+    snapshot = job_queue.snapshot(job)
+    if coalesced:
+        REGISTRY.counter("jobs_coalesced_total", "Generation requests attached to an identical job in flight").inc()
+    return job, GenerateResponse(
+        status=snapshot["status"],
+        job_id=job.id,
+        queue_position=snapshot["queue_position"],
+        eta_seconds=snapshot["eta_seconds"],
+        coalesced=coalesced,
+    )
+
+
+@app.post("/generate", response_model=GenerateResponse, status_code=202)
+async def generate_world(request: GenerateRequest, http_request: Request):
+    """Queue generation of a 3D world from a text prompt, an uploaded image or an uploaded panorama
+
+    Answers 429 when the client is over its rate or queued-job limit, and 503
+    when the queue is full or the job would wait too long, with Retry-After.
+    With `wait`, answers with the finished job instead (as `GET /jobs/{id}`).
+    """
+    # Admission takes locks shared with the job workers, so it stays off the event loop
+    job, response = await run_in_threadpool(admit_job, request, client_key(http_request))
+    if not request.wait:
+        return response
+
+    version = -1
+    while not job.finished:
+        version = await job_queue.watch(job, version, timeout=1.0)
+        if not job.finished and await http_request.is_disconnected():
+            # Nobody is left to answer. Only this request's interest is dropped: a job
+            # shared with other requests keeps running for them
+            print(f"Client disconnected while waiting; dropping its request for job {job.id}")
+            REGISTRY.counter("jobs_abandoned_total", "Waiting generation requests whose client disconnected").inc()
+            job_queue.cancel(job.id)
+            return JSONResponse(status_code=499, content={"detail": "Client disconnected"})
+    return JSONResponse(content=job_queue.snapshot(job))
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """Report status, stage, queue position and ETA of a generation job"""
+    return job_queue.snapshot(get_job_or_404(job_id))
+
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    """Cancel a queued or running generation job"""
+    job = get_job_or_404(job_id)
+    if not job_queue.cancel(job_id):
+        raise HTTPException(status_code=409, detail=f"Job {job_id} already {job.status}")
+    return job_queue.snapshot(job)
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Stream job progress as server-sent events until the job finishes"""
+    job = get_job_or_404(job_id)
+
+    # Waits on the event loop, so open streams don't each hold a threadpool worker
+    async def event_stream():
+        version = -1
+        while True:
+            new_version = await job_queue.watch(job, version, timeout=15.0)
+            if new_version == version:
+                # Keep proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+                continue
+            version = new_version
+            snapshot = job_queue.snapshot(job)
+            yield f"event: {snapshot['status']}\ndata: {json.dumps(snapshot)}\n\n"
+            if job.finished:
+                return
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/scenes")
+def list_scenes():
+    """List scenes currently being served, most recently used first"""
+    return {"scenes": viser_manager.viewer_pool.list_scenes()}
+
+
+@app.delete("/scenes/{scene_id}")
+def evict_scene(scene_id: str):
+    """Stop serving a scene and free its viewer"""
+    if not viser_manager.viewer_pool.evict(scene_id):
+        raise HTTPException(status_code=404, detail=f"Scene {scene_id} not found")
+    return {"status": "evicted", "scene_id": scene_id}
+
+
+@app.get("/scenes/{scene_id}/viewer")
+def view_scene(scene_id: str):
+    """Redirect to the viewer showing a live scene"""
+    url = viser_manager.viewer_pool.server_url(scene_id)
+    if url is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Scene {scene_id} has expired; serve it again with POST /dreams/{scene_id}/serve",
+        )
+    return RedirectResponse(url)
 
 
-@app.post("/generate", response_model=GenerateResponse)
-def generate_world(request: GenerateRequest):
-    """Generate a 3D world from a text prompt"""
+@app.get("/scenes/{scene_id}/pick")
+def pick_in_scene(scene_id: str, origin: str, direction: str):
+    """The first opaque splat along a ray, e.g. from a click in a remote viewer"""
+    origin, direction = parse_vector(origin, "origin"), parse_vector(direction, "direction")
+    if not any(direction):
+        raise HTTPException(status_code=400, detail="direction must not be zero")
     try:
-        # Validate prompt
-        if not request.prompt or len(request.prompt.strip()) == 0:
-            raise HTTPException(status_code=400, detail="Prompt cannot be empty")
+        hit = viser_manager.viewer_pool.pick(scene_id, origin, direction)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Scene {scene_id} not found or has no splats")
+    return {"scene_id": scene_id, "hit": hit}
 
-        # Generate and serve
-        viewer_url = viser_manager.generate_and_serve(request.prompt, port=8080)
 
-        return GenerateResponse(
-            status="complete",
-            viewer_url=viewer_url
+@app.get("/scenes/{scene_id}/crop")
+def crop_scene(scene_id: str, lower: str, upper: str, centers_only: bool = False):
+    """Download the splats of a live scene within a box as a `.dsplat` file"""
+    lower, upper = parse_vector(lower, "lower"), parse_vector(upper, "upper")
+    try:
+        arrays = viser_manager.viewer_pool.crop(scene_id, lower, upper, centers_only=centers_only)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Scene {scene_id} not found or has no splats")
+    fd, path = tempfile.mkstemp(suffix=".dsplat")
+    os.close(fd)
+    save_splat(path, SplatArrays(**arrays))
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{scene_id}-crop.dsplat",
+                        background=BackgroundTask(os.unlink, path))
+
+
+@app.get("/meshes/{key}.glb")
+def get_mesh(key: str):
+    """A generated mesh as a binary glTF, straight from the mesh cache"""
+    path = viser_manager.mesh_cache.get(key) if len(key) == 64 and key.isalnum() else None
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Mesh {key} not found")
+    return FileResponse(path, media_type="model/gltf-binary", filename=f"{key}.glb")
+
+
+@app.post("/images", status_code=201)
+async def upload_image(request: Request):
+    """Upload an image (the raw file as the request body) for image-to-scene or panorama requests"""
+    max_bytes = MAX_UPLOAD_MB * 1024 ** 2
+    if int(request.headers.get("content-length") or 0) > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Images are limited to {MAX_UPLOAD_MB}MB")
+    data = await request.body()
+    if not data or len(data) > max_bytes:
+        raise HTTPException(status_code=413 if data else 400,
+                            detail=f"Images are limited to {MAX_UPLOAD_MB}MB" if data else "Empty upload")
+    try:
+        # Decoding and disk I/O stay off the event loop
+        image_id = await run_in_threadpool(viser_manager.uploads.put_bytes, data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"image_id": image_id, "size_bytes": len(data)}
+
+
+@app.get("/panoramas/{key}.png")
+def get_panorama(key: str):
+    """A cached panorama, as reported in a job's `panorama_url`"""
+    path = viser_manager.panorama_cache.path(key) if len(key) == 64 and key.isalnum() else None
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Panorama {key} not found")
+    return FileResponse(path, media_type="image/png", filename=f"{key}.png")
+
+
+def get_library():
+    if viser_manager.library is None:
+        raise HTTPException(status_code=404, detail="The dream library is disabled")
+    return viser_manager.library
+
+
+@app.get("/dreams")
+def list_dreams(
+    q: Optional[str] = None,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    min_splats: Optional[int] = None,
+    max_splats: Optional[int] = None,
+):
+    """Page through past dreams, newest first, optionally searching their prompts"""
+    try:
+        dreams, next_cursor = get_library().list(
+            query=q, limit=limit, cursor=cursor, since=since, until=until,
+            min_splats=min_splats, max_splats=max_splats,
         )
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor {cursor}")
+    return {"dreams": dreams, "next_cursor": next_cursor}
 
-    except Exception as e:
-        print(f"Error during generation: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Generation failed: {str(e)}")
 
+@app.get("/dreams/{dream_id}")
+def get_dream(dream_id: str):
+    """Details of one past dream, with its viewer URL if it is being served"""
+    dream = get_library().get(dream_id)
+    if dream is None:
+        raise HTTPException(status_code=404, detail=f"Dream {dream_id} not found")
+    dream["viewer_url"] = viser_manager.viewer_pool.get_url(dream_id)
+    return dream
+
+
+@app.get("/dreams/{dream_id}/scene")
+def download_dream(dream_id: str):
+    """Download a past dream as a quantized `.dsplat` file, for remote viewers and tools"""
+    with span("compress"):
+        path = get_library().compressed_path(dream_id, COMPRESSION)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Dream {dream_id} not found")
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{dream_id}.dsplat")
 
-@app.on_event("shutdown")
-def shutdown_event():
-    """Clean up on server shutdown"""
-    viser_manager.stop_server()
+
+@app.post("/dreams/{dream_id}/serve")
+def serve_dream(dream_id: str):
+    """Serve a past dream again without regenerating it"""
+    get_library()
+    viewer_url = viser_manager.serve_dream(dream_id)
+    if viewer_url is None:
+        raise HTTPException(status_code=404, detail=f"Dream {dream_id} not found")
+    return {"status": "serving", "scene_id": dream_id, "viewer_url": viewer_url}
 
 
 if __name__ == "__main__":
@@ -206,18 +900,26 @@ if __name__ == "__main__":
     print("🚀 Starting WorldGen API Server on http://localhost:8888")
     print("=" * 70)
     print("\nEndpoints:")
-    print("  POST /generate - Generate a 3D world from a prompt")
-    print("  GET  /health   - Check server health")
-    print("\nViewer will be available at http://localhost:8080")
+    print("  POST   /generate            - Queue a 3D world generation from a prompt")
+    print("  POST   /images              - Upload an image or panorama to generate from")
+    print("  GET    /jobs/{id}           - Check job status, stage and ETA")
+    print("  GET    /jobs/{id}/events    - Stream job progress (server-sent events)")
+    print("  GET    /dreams              - Browse and search past dreams")
+    print("  GET    /dreams/{id}         - Details of a past dream")
+    print("  POST   /dreams/{id}/serve   - Serve a past dream again")
+    print("  DELETE /jobs/{id}           - Cancel a job")
+    print("  GET    /scenes              - List scenes being served")
+    print("  DELETE /scenes/{id}         - Stop serving a scene")
+    print("  GET    /scenes/{id}/viewer  - Open a scene's viewer")
+    print("  GET    /scenes/{id}/pick    - Find the splat along a ray")
+    print("  GET    /scenes/{id}/crop    - Download the splats within a box")
+    print("  GET    /health              - Check server liveness")
+    print("  GET    /ready               - Check the model is loaded and ready")
+    print("  GET    /metrics             - Prometheus metrics")
+    print(
+        f"\nViewers will be available on ports {VIEWER_PORT}-{VIEWER_PORT + MAX_LIVE_SCENES - 1}"
+    )
     print("=" * 70)
 
-    # Handle Ctrl+C gracefully
-    def signal_handler(sig, frame):
-        print("\nShutting down API server...")
-        viser_manager.stop_server()
-        sys.exit(0)
-
-    signal.signal(signal.SIGINT, signal_handler)
-
-    # Run the FastAPI server
+    # Ctrl+C shuts down gracefully through the lifespan's cleanup
     uvicorn.run(app, host="0.0.0.0", port=8888, log_level="info")
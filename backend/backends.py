@@ -0,0 +1,308 @@
+"""Generation backends
+
+Everything that turns a prompt (or an image) into a gaussian splat scene goes
+through a backend, so the API, the demo and the benchmarks can run either the
+real model or a stand-in:
+
+- `WorldGenBackend` wraps `worldgen.WorldGen`, with one model per mode, loaded on first use
+- `SyntheticBackend` builds deterministic random scenes on the CPU, with a
+  configurable splat count and latency, for CI, load tests and capacity planning
+
+Either can run in worker processes, one per device, with
+`generation_workers.WorkerPoolBackend`.
+
+Heavy modules (torch, worldgen) are only imported when a backend loads its model.
+"""
+import hashlib
+import json
+import time
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+import numpy as np
+
+from splat_cache import normalize_prompt
+from splat_format import SplatArrays, scale_rotation_to_covariances
+
+
+# GPUs with less memory than this run WorldGen in low VRAM mode
+LOW_VRAM_GB = 24
+PANORAMA_SIZE = (2048, 1024)
+# Share of a synthetic generation's latency spent on the panorama, as with WorldGen's diffusion stage
+SYNTHETIC_PANORAMA_SHARE = 0.6
+
+
+def detect_low_vram(device=None) -> bool:
+    """Whether the GPU (`device`, or the current one) has less than LOW_VRAM_GB of memory; False without a GPU"""
+    import torch
+
+    if not torch.cuda.is_available():
+        return False
+    if device is not None and torch.device(device).type != "cuda":
+        return False
+    index = torch.device(device).index if device is not None else None
+    if index is None:
+        index = torch.cuda.current_device()
+    return torch.cuda.get_device_properties(index).total_memory / (1024 ** 3) < LOW_VRAM_GB
+
+
+def generation_mode(image=None) -> str:
+    """WorldGen mode for a request: image-to-scene when conditioned on an image"""
+    return "t2s" if image is None else "i2s"
+
+
+class GenerationBackend:
+    """Interface shared by all generation backends"""
+
+    name = "base"
+    # Generations that can run at once; in-process backends run one at a time
+    concurrency = 1
+    # Whether generate_panorama() is available, so panoramas can be cached
+    supports_panoramas = False
+    # Whether generate() records its own peak GPU memory, for backends on other processes
+    reports_gpu_peak = False
+
+    def __init__(self):
+        # Seconds spent in each loading phase, for startup breakdowns
+        self.timings: Dict[str, float] = {}
+
+    @property
+    def device_name(self) -> str:
+        return "cpu"
+
+    def is_loaded(self, mode: str = "t2s") -> bool:
+        return True
+
+    def load(self, mode: str = "t2s"):
+        """Load whatever `mode` needs; generate() calls this itself if needed"""
+
+    def cache_params(self, mode: str = "t2s") -> Dict:
+        """Settings that determine the generated scene, passed to cache_key"""
+        raise NotImplementedError
+
+    def generate(self, prompt: Optional[str] = None, image=None, pano_image=None,
+                 seed: Optional[int] = None, return_mesh: bool = False):
+        """Generate a scene with centers/rgbs/opacities/covariances (or an Open3D mesh)
+
+        `image` and `pano_image` are PIL images. A panorama skips panorama
+        generation and is lifted to 3D directly.
+        """
+        raise NotImplementedError
+
+    def panorama_params(self, mode: str = "t2s") -> Dict:
+        """Settings that determine the panorama, passed to panorama_key"""
+        raise NotImplementedError
+
+    def generate_panorama(self, prompt: Optional[str] = None, image=None, seed: Optional[int] = None):
+        """Only the first stage of generate(): a PANORAMA_SIZE PIL image to pass back as `pano_image`"""
+        raise NotImplementedError
+
+
+class WorldGenBackend(GenerationBackend):
+    """The WorldGen model"""
+
+    name = "worldgen"
+    supports_panoramas = True
+
+    def __init__(self, resolution: int = 1600, inpaint_bg: bool = False, device=None,
+                 low_vram: Optional[bool] = None):
+        super().__init__()
+        self.resolution = resolution
+        self.inpaint_bg = inpaint_bg
+        # Resolved when the first model is loaded, so constructing a backend stays cheap
+        self.device = device
+        self.low_vram = low_vram
+        self.worldgens = {}
+
+    @property
+    def device_name(self) -> str:
+        return str(self.device) if self.device is not None else "pending"
+
+    def is_loaded(self, mode: str = "t2s") -> bool:
+        return mode in self.worldgens
+
+    def load(self, mode: str = "t2s"):
+        if mode in self.worldgens:
+            return
+        start = time.perf_counter()
+        import torch
+        self.timings.setdefault("import_torch", time.perf_counter() - start)
+        start = time.perf_counter()
+        from worldgen import WorldGen
+        self.timings.setdefault("import_worldgen", time.perf_counter() - start)
+
+        if self.device is None:
+            self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        if self.low_vram is None:
+            self.low_vram = detect_low_vram(self.device)
+            if self.low_vram:
+                print(f"Detected GPU VRAM less than {LOW_VRAM_GB}GB, setting low_vram to True")
+
+        start = time.perf_counter()
+        self.worldgens[mode] = WorldGen(mode=mode,
+                                        inpaint_bg=self.inpaint_bg,
+                                        resolution=self.resolution,
+                                        device=self.device,
+                                        low_vram=self.low_vram)
+        self.timings[f"init_worldgen_{mode}"] = time.perf_counter() - start
+
+    def cache_params(self, mode: str = "t2s") -> Dict:
+        return {"mode": mode, "resolution": self.resolution, "inpaint_bg": self.inpaint_bg}
+
+    def panorama_params(self, mode: str = "t2s") -> Dict:
+        return {"mode": mode}
+
+    def generate_panorama(self, prompt=None, image=None, seed=None):
+        mode = generation_mode(image)
+        self.load(mode)
+        worldgen = self.worldgens[mode]
+        if not hasattr(worldgen, "generate_pano"):
+            raise NotImplementedError("This WorldGen version can't generate a panorama on its own")
+        if seed is not None:
+            import torch
+            torch.manual_seed(seed)
+        pano_image = worldgen.generate_pano(prompt, image.convert("RGB") if image is not None else None)
+        return pano_image.convert("RGB").resize(PANORAMA_SIZE)
+
+    def generate(self, prompt=None, image=None, pano_image=None, seed=None, return_mesh=False):
+        mode = generation_mode(image)
+        self.load(mode)
+        worldgen = self.worldgens[mode]
+        if seed is not None:
+            import torch
+            torch.manual_seed(seed)
+        if pano_image is not None:
+            pano_image = pano_image.convert("RGB").resize(PANORAMA_SIZE)
+            return worldgen._generate_world(pano_image, return_mesh=return_mesh)
+        if image is not None:
+            return worldgen.generate_world(prompt, image.convert("RGB"), return_mesh=return_mesh)
+        return worldgen.generate_world(prompt, return_mesh=return_mesh)
+
+
+def synthetic_scene(num_splats: int, rng: np.random.Generator, inner_radius: float = 1.0,
+                    outer_radius: float = 10.0, chunk_size: int = 1_000_000) -> SplatArrays:
+    """Random gaussians on a shell around the origin, shaped like a generated world
+
+    Radii are log-uniform and splat sizes grow with distance, so every shell
+    covers a similar share of the view. Colors vary smoothly with direction.
+    """
+    directions = rng.standard_normal((num_splats, 3), dtype=np.float32)
+    directions /= np.maximum(np.linalg.norm(directions, axis=1, keepdims=True), 1e-6)
+    radii = inner_radius * (outer_radius / inner_radius) ** rng.random(num_splats, dtype=np.float32)
+    centers = directions * radii[:, None]
+
+    frequency = rng.uniform(1.0, 4.0, 3).astype(np.float32)
+    phase = rng.uniform(0.0, 2 * np.pi, 3).astype(np.float32)
+    rgbs = 0.5 + 0.4 * np.sin(directions * frequency + phase)
+    rgbs += rng.normal(0.0, 0.05, rgbs.shape).astype(np.float32)
+    np.clip(rgbs, 0.0, 1.0, out=rgbs)
+    opacities = rng.uniform(0.3, 1.0, (num_splats, 1)).astype(np.float32)
+
+    # Built in chunks to bound the float64 temporaries of the rotation math
+    covariances = np.empty((num_splats, 3, 3), dtype=np.float32)
+    for start in range(0, num_splats, chunk_size):
+        end = min(start + chunk_size, num_splats)
+        scales = 0.01 * radii[start:end, None] * rng.uniform(0.3, 1.5, (end - start, 3))
+        quaternions = rng.standard_normal((end - start, 4))
+        covariances[start:end] = scale_rotation_to_covariances(scales, quaternions)
+
+    return SplatArrays(centers=centers, rgbs=rgbs, opacities=opacities, covariances=covariances)
+
+
+def synthetic_mesh(num_faces: int, rng: np.random.Generator, radius: float = 5.0) -> SimpleNamespace:
+    """A colored UV sphere around the origin with about `num_faces` triangles
+
+    Has the `vertices`/`triangles`/`vertex_colors` arrays of an Open3D TriangleMesh.
+    """
+    rows = max(2, int(np.sqrt(num_faces / 4)))
+    cols = 2 * rows
+    theta = np.linspace(0, np.pi, rows + 1)[:, None]
+    phi = np.linspace(0, 2 * np.pi, cols, endpoint=False)[None, :]
+    directions = np.stack([
+        np.sin(theta) * np.cos(phi), np.cos(theta) * np.ones_like(phi), np.sin(theta) * np.sin(phi),
+    ], axis=-1).reshape(-1, 3)
+    vertices = directions * radius * rng.uniform(0.95, 1.05, (len(directions), 1))
+
+    row, col = np.meshgrid(np.arange(rows), np.arange(cols), indexing="ij")
+    a = row * cols + col
+    b = row * cols + (col + 1) % cols
+    c, d = a + cols, b + cols
+    triangles = np.concatenate([np.stack([a, c, b], -1), np.stack([b, c, d], -1)]).reshape(-1, 3)
+
+    frequency = rng.uniform(1.0, 4.0, 3)
+    colors = np.clip(0.5 + 0.4 * np.sin(directions * frequency), 0.0, 1.0)
+    return SimpleNamespace(vertices=vertices, triangles=triangles.astype(np.int32), vertex_colors=colors)
+
+
+class SyntheticBackend(GenerationBackend):
+    """Deterministic random scenes on the CPU, standing in for WorldGen
+
+    The same prompt, seed and input images always give the same scene.
+    `latency` is the minimum time a generation takes, as if a model were running.
+    Meshes are spheres with about as many faces as scenes have splats.
+    Panoramas are smooth noise, and take SYNTHETIC_PANORAMA_SHARE of the latency.
+    """
+
+    name = "synthetic"
+    supports_panoramas = True
+
+    def __init__(self, num_splats: int = 500_000, latency: float = 0.0):
+        super().__init__()
+        self.num_splats = num_splats
+        self.latency = latency
+
+    def cache_params(self, mode: str = "t2s") -> Dict:
+        return {"mode": f"synthetic-{mode}", "resolution": None, "inpaint_bg": False,
+                "num_splats": self.num_splats}
+
+    def scene_seed(self, prompt=None, image=None, pano_image=None, seed=None) -> int:
+        digest = hashlib.sha256(json.dumps([normalize_prompt(prompt or ""), seed]).encode())
+        for conditioning in (image, pano_image):
+            if conditioning is not None:
+                digest.update(conditioning.tobytes())
+        return int.from_bytes(digest.digest()[:8], "little")
+
+    def panorama_params(self, mode: str = "t2s") -> Dict:
+        return {"mode": f"synthetic-{mode}"}
+
+    def generate_panorama(self, prompt=None, image=None, seed=None):
+        from PIL import Image
+
+        start = time.perf_counter()
+        rng = np.random.default_rng(self.scene_seed(prompt, image, None, seed))
+        coarse = rng.integers(0, 256, (16, 32, 3), dtype=np.uint8)
+        pano_image = Image.fromarray(coarse).resize(PANORAMA_SIZE, Image.BILINEAR)
+        self._wait(start, self.latency * SYNTHETIC_PANORAMA_SHARE)
+        return pano_image
+
+    def generate(self, prompt=None, image=None, pano_image=None, seed=None, return_mesh=False):
+        start = time.perf_counter()
+        rng = np.random.default_rng(self.scene_seed(prompt, image, pano_image, seed))
+        if return_mesh:
+            scene = synthetic_mesh(self.num_splats, rng)
+        else:
+            scene = synthetic_scene(self.num_splats, rng)
+        if pano_image is not None:
+            self._wait(start, self.latency * (1 - SYNTHETIC_PANORAMA_SHARE))
+        else:
+            self._wait(start, self.latency)
+        return scene
+
+    @staticmethod
+    def _wait(start: float, latency: float):
+        remaining = latency - (time.perf_counter() - start)
+        if remaining > 0:
+            time.sleep(remaining)
+
+
+BACKENDS = {
+    WorldGenBackend.name: WorldGenBackend,
+    SyntheticBackend.name: SyntheticBackend,
+}
+
+
+def create_backend(name: str, **options) -> GenerationBackend:
+    """Instantiate a backend by name ("worldgen" or "synthetic")"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown generation backend {name}, expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name](**options)
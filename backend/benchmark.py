@@ -0,0 +1,482 @@
+"""End-to-end benchmarks for the generate/serve pipeline
+
+Everything runs on the CPU with the synthetic backend, so the suite works on
+CI machines without a GPU:
+
+    python benchmark.py --output results.json
+    python benchmark.py --baseline baseline.json          # exits 1 on regressions
+    python benchmark.py --suites http --url http://localhost:8888
+
+Suites:
+- scaling: each stage a scene goes through (generation, cache write, cached
+  load with float32 conversion, validation, scene summary, LOD build, upload to a viser
+  scene), at 1e5 to 1e7 splats
+- queue: concurrent requests through the job queue and ViserServerManager,
+  reporting throughput and p50/p95/p99 latency
+- http: the same against a running API server (start it with
+  DREAM_BACKEND=synthetic and the per-client limits at 0), from POST /generate
+  until the viewer URL answers, and how fast /health answers meanwhile
+- compression: quantized `.dsplat` encode/decode time, bytes per splat and the
+  round-trip error of each attribute, with and without a color palette
+- fairness: how long light clients wait behind one client that floods the
+  job queue, with and without per-client fair sharing
+- index: spatial index build time and memory, and the latency of box,
+  radius, frustum and pick queries, at each of `--sizes`
+- workers: throughput of generation worker pools of growing size, and the time
+  to get a scene back from a worker process instead of generating in-process
+
+Results are written as JSON with a flat {metric: value} map. Metrics ending in
+`_per_s` are higher-is-better; all others are lower-is-better, and are seconds
+when they end in `_s`.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from backends import SyntheticBackend
+from dream_library import DreamLibrary
+from generation_workers import WorkerPoolBackend
+from lod import build_lod
+from scene_summary import summarize_scene
+from splat_cache import SplatCache, cache_key
+from splat_compress import Compression, ErrorBudget, roundtrip_errors
+from splat_convert import convert_splats
+from spatial_index import SplatIndex, frustum_planes
+from splat_format import SplatArrays, load_splat, save_splat
+
+
+DEFAULT_SIZES = (100_000, 1_000_000, 10_000_000)
+PERCENTILES = (50, 95, 99)
+
+
+def measure(fn: Callable, repeats: int) -> float:
+    """Median wall time of `fn()` over `repeats` runs"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def percentiles(name: str, values: List[float]) -> Dict[str, float]:
+    return {f"{name}_p{p}_s": float(np.percentile(values, p)) for p in PERCENTILES}
+
+
+def viser_available() -> bool:
+    try:
+        import viser  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def bench_scaling(sizes, repeats: int, lod_levels: int, viewer_port: int) -> Dict[str, float]:
+    """Per-stage cost of one scene at each splat count"""
+    results = {}
+    server = None
+    if viser_available():
+        import viser
+        server = viser.ViserServer(port=viewer_port)
+    else:
+        print("viser is not installed; skipping upload timings")
+
+    for num_splats in sizes:
+        print(f"[scaling] {num_splats:,} splats")
+        prefix = f"scaling.{num_splats}"
+        backend = SyntheticBackend(num_splats=num_splats)
+        scene = backend.generate("benchmark scene")
+        results[f"{prefix}.generate_s"] = measure(lambda: backend.generate("benchmark scene"), repeats)
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = SplatCache(cache_dir)
+            key = cache_key("benchmark scene", seed=None, **backend.cache_params())
+            results[f"{prefix}.cache_put_s"] = measure(lambda: cache.put(key, scene), repeats)
+            # What serving a cached scene costs before LOD: memmap load, float32 expansion and validation
+            results[f"{prefix}.cache_load_convert_s"] = measure(
+                lambda: convert_splats(cache.get(key)), repeats
+            )
+
+        results[f"{prefix}.convert_s"] = measure(lambda: convert_splats(scene), repeats)
+        arrays, _ = convert_splats(scene)
+        results[f"{prefix}.summary_s"] = measure(lambda: summarize_scene(scene), repeats)
+        results[f"{prefix}.lod_build_s"] = measure(lambda: build_lod(arrays, num_levels=lod_levels), repeats)
+
+        if server is not None:
+            def upload():
+                # Serialization cost of add_gaussian_splats, without a browser on the other end
+                handle = server.scene.add_gaussian_splats(
+                    "/benchmark",
+                    centers=arrays["centers"],
+                    rgbs=arrays["rgbs"],
+                    opacities=arrays["opacities"],
+                    covariances=arrays["covariances"],
+                )
+                handle.remove()
+            results[f"{prefix}.upload_s"] = measure(upload, repeats)
+
+        for name, seconds in results.items():
+            if name.startswith(prefix + "."):
+                print(f"  {name[len(prefix) + 1:]:<22} {seconds:8.3f}s")
+
+    if server is not None:
+        server.stop()
+    return results
+
+
+def bench_compression(sizes, repeats: int, palette_size: int) -> Dict[str, float]:
+    """Size, speed and round-trip error of quantized scene files"""
+    results = {}
+    for num_splats in sizes:
+        print(f"[compression] {num_splats:,} splats")
+        arrays, _ = convert_splats(SyntheticBackend(num_splats=num_splats).generate("benchmark scene"))
+        scene = SplatArrays(**arrays)
+        with tempfile.TemporaryDirectory() as tmp:
+            raw_path = os.path.join(tmp, "raw.dsplat")
+            save_splat(raw_path, scene)
+            raw_bytes = os.path.getsize(raw_path)
+            for name, compression in (("quantized", Compression()),
+                                      # Synthetic colors are uniform noise, the worst case for a palette
+                                      ("palette", Compression(ErrorBudget(color=0.05), palette_size=palette_size))):
+                prefix = f"compression.{num_splats}.{name}"
+                path = os.path.join(tmp, f"{name}.dsplat")
+                results[f"{prefix}.encode_s"] = measure(lambda: save_splat(path, scene, compression=compression), repeats)
+                results[f"{prefix}.decode_s"] = measure(lambda: load_splat(path), repeats)
+                results[f"{prefix}.bytes_per_splat"] = os.path.getsize(path) / num_splats
+                results[f"{prefix}.ratio"] = os.path.getsize(path) / raw_bytes
+                for error, value in roundtrip_errors(scene, load_splat(path)).items():
+                    results[f"{prefix}.{error}"] = value
+                for metric, value in results.items():
+                    if metric.startswith(prefix + "."):
+                        print(f"  {name}.{metric[len(prefix) + 1:]:<24} {value:10.5f}")
+    return results
+
+
+def bench_index(sizes, repeats: int, queries: int = 20) -> Dict[str, float]:
+    """Spatial index build and query latency, over random queries from around the origin"""
+    results = {}
+    rng = np.random.default_rng(0)
+    for num_splats in sizes:
+        print(f"[index] {num_splats:,} splats")
+        prefix = f"index.{num_splats}"
+        arrays, _ = convert_splats(SyntheticBackend(num_splats=num_splats).generate("benchmark scene"))
+        results[f"{prefix}.build_s"] = measure(lambda: SplatIndex.from_arrays(arrays), repeats)
+        index = SplatIndex.from_arrays(arrays)
+        results[f"{prefix}.bytes_per_splat"] = index.nbytes / num_splats
+
+        # Synthetic scenes fill a sphere of radius ~10 around the viewer
+        points = rng.uniform(-5, 5, size=(queries, 3))
+        directions = rng.normal(size=(queries, 3))
+        rotations = rng.normal(size=(queries, 4))
+        rotations /= np.linalg.norm(rotations, axis=1, keepdims=True)
+        planes = [frustum_planes(np.zeros(3), wxyz, 1.0, 16 / 9, 0.01, 100) for wxyz in rotations]
+        timings = {"box": [], "radius": [], "frustum": [], "frustum_leaves": [], "view_order": [], "pick": []}
+        for i in range(queries):
+            for name, query in (
+                ("box", lambda: index.query_box(points[i] - 0.5, points[i] + 0.5)),
+                ("radius", lambda: index.query_radius(points[i], 0.5)),
+                ("frustum", lambda: index.query_frustum(planes[i])),
+                ("frustum_leaves", lambda: index.frustum_leaves(planes[i])),
+                ("view_order", lambda: index.view_order(planes[i], np.zeros(3))),
+                ("pick", lambda: index.pick(np.zeros(3), directions[i], arrays["opacities"])),
+            ):
+                start = time.perf_counter()
+                query()
+                timings[name].append(time.perf_counter() - start)
+        for name, values in timings.items():
+            results[f"{prefix}.{name}_s"] = statistics.median(values)
+        results[f"{prefix}.frustum_fraction"] = statistics.mean(
+            len(index.query_frustum(p)) / num_splats for p in planes[:5]
+        )
+        for metric, value in results.items():
+            if metric.startswith(prefix + "."):
+                print(f"  {metric[len(prefix) + 1:]:<22} {value:10.4f}")
+    return results
+
+
+def bench_queue(num_requests: int, concurrency: int, num_splats: int, latency: float,
+                viewer_port: int) -> Dict[str, float]:
+    """Concurrent generations through the job queue, served from a viewer pool"""
+    if not viser_available():
+        print("viser is not installed; skipping the queue suite")
+        return {}
+    from api_server import ViserServerManager
+    from jobs import COMPLETE, JobQueue
+    from viewer_pool import ViewerPool
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        manager = ViserServerManager(
+            backend=SyntheticBackend(num_splats=num_splats, latency=latency),
+            viewer_pool=ViewerPool(base_port=viewer_port, max_scenes=min(concurrency, 4)),
+            splat_cache=SplatCache(cache_dir),
+            library=DreamLibrary(os.path.join(cache_dir, "library")),
+        )
+
+        def runner(job, set_stage):
+            return {"viewer_url": manager.generate_and_serve(
+                job.prompt, scene_id=job.id, use_cache=False, set_stage=set_stage
+            )}
+
+        queue = JobQueue(runner, num_workers=concurrency, max_queue_size=num_requests)
+        queue.start()
+        try:
+            # Starts the first viewer so it isn't counted against the first request
+            manager.warm_up()
+            start = time.perf_counter()
+            jobs = [queue.submit(f"benchmark scene {i}")[0] for i in range(num_requests)]
+            for job in jobs:
+                version = 0
+                while not job.finished:
+                    version = queue.wait_for_update(job, version, timeout=1.0)
+            wall = time.perf_counter() - start
+        finally:
+            queue.shutdown()
+            manager.stop_server()
+
+    failed = [job for job in jobs if job.status != COMPLETE]
+    if failed:
+        raise RuntimeError(f"{len(failed)} benchmark jobs failed: {failed[0].error}")
+    latencies = [job.finished_at - job.created_at for job in jobs]
+    waits = [job.started_at - job.created_at for job in jobs]
+    results = {
+        "queue.throughput_per_s": num_requests / wall,
+        **percentiles("queue.latency", latencies),
+        **percentiles("queue.wait", waits),
+    }
+    for name, value in results.items():
+        print(f"  {name:<28} {value:8.3f}")
+    return results
+
+
+def bench_workers(max_workers: int, num_requests: int, num_splats: int, latency: float,
+                  repeats: int) -> Dict[str, float]:
+    """Generation throughput with 1 to `max_workers` CPU worker processes"""
+    results = {}
+    in_process = SyntheticBackend(num_splats=num_splats)
+    results["workers.in_process_generate_s"] = measure(lambda: in_process.generate("benchmark scene"), repeats)
+    counts = sorted({1, max_workers} | {n for n in (2, 4, 8) if n < max_workers})
+    for count in counts:
+        print(f"[workers] {count} workers")
+        pool = WorkerPoolBackend("synthetic", ["cpu"] * count, num_splats=num_splats, latency=latency)
+        try:
+            pool.load()
+            # Same scene and no latency difference: the extra time is the round trip through /dev/shm
+            if count == 1:
+                fast = WorkerPoolBackend("synthetic", ["cpu"], num_splats=num_splats)
+                try:
+                    results["workers.pool_generate_s"] = measure(lambda: fast.generate("benchmark scene"), repeats)
+                finally:
+                    fast.shutdown()
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=count) as executor:
+                list(executor.map(lambda i: len(pool.generate(f"benchmark scene {i}")), range(num_requests)))
+            results[f"workers.{count}.throughput_per_s"] = num_requests / (time.perf_counter() - start)
+        finally:
+            pool.shutdown()
+    for name, value in results.items():
+        print(f"  {name:<28} {value:8.3f}")
+    return results
+
+
+def bench_fairness(heavy_jobs: int, light_clients: int, latency: float, concurrency: int) -> Dict[str, float]:
+    """Wait of single-job clients queued behind one client's backlog, with and without fair sharing"""
+    from jobs import JobQueue
+
+    results = {}
+    for mode in ("fifo", "fair"):
+        queue = JobQueue(lambda job, set_stage: time.sleep(latency) or {}, num_workers=concurrency,
+                         max_queue_size=heavy_jobs + light_clients)
+        # Everything is queued before the workers start, so both runs see the same backlog
+        for i in range(heavy_jobs):
+            queue.submit(f"heavy {i}", client="heavy" if mode == "fair" else None)
+        light = [queue.submit(f"light {i}", client=f"light-{i}" if mode == "fair" else None)[0]
+                 for i in range(light_clients)]
+        queue.start()
+        try:
+            for job in light:
+                version = 0
+                while not job.finished:
+                    version = queue.wait_for_update(job, version, timeout=1.0)
+        finally:
+            queue.shutdown()
+        results.update(percentiles(f"fairness.{mode}.light_wait", [job.started_at - job.created_at for job in light]))
+    for name, value in results.items():
+        print(f"  {name:<32} {value:8.3f}")
+    return results
+
+
+def http_json(url: str, body=None) -> dict:
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.loads(response.read())
+
+
+def bench_http(url: str, num_requests: int, concurrency: int, poll_interval: float = 0.05) -> Dict[str, float]:
+    """Requests against a running API server, timed by the client"""
+    url = url.rstrip("/")
+    lock = threading.Lock()
+    completed = []
+
+    def request(i: int):
+        start = time.perf_counter()
+        job = http_json(f"{url}/generate", {"prompt": f"benchmark scene {i}", "use_cache": False})
+        accepted = time.perf_counter() - start
+        while True:
+            state = http_json(f"{url}/jobs/{job['job_id']}")
+            if state["status"] in ("complete", "failed", "cancelled"):
+                break
+            time.sleep(poll_interval)
+        if state["status"] != "complete":
+            raise RuntimeError(f"Job {job['job_id']} {state['status']}: {state.get('error')}")
+        generated = time.perf_counter() - start
+        # First response from the viewer, as a browser connecting would see it
+        with urllib.request.urlopen(state["result"]["viewer_url"], timeout=30) as response:
+            response.read()
+        with lock:
+            completed.append((accepted, generated, time.perf_counter() - start))
+
+    # Liveness checks must stay fast while the server is busy generating
+    health = []
+    done = threading.Event()
+
+    def probe_health():
+        while not done.is_set():
+            start = time.perf_counter()
+            http_json(f"{url}/health")
+            health.append(time.perf_counter() - start)
+            done.wait(0.02)
+
+    prober = threading.Thread(target=probe_health, daemon=True)
+    prober.start()
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(request, range(num_requests)))
+    finally:
+        done.set()
+        prober.join()
+    wall = time.perf_counter() - start
+
+    accepted, generated, viewable = (list(column) for column in zip(*completed))
+    results = {
+        "http.throughput_per_s": num_requests / wall,
+        **percentiles("http.accept", accepted),
+        **percentiles("http.complete", generated),
+        **percentiles("http.viewer", viewable),
+        **percentiles("http.health", health),
+    }
+    for name, value in results.items():
+        print(f"  {name:<28} {value:8.3f}")
+    return results
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], tolerance: float,
+            min_delta: float) -> List[str]:
+    """Metrics that got worse than the baseline by more than `tolerance` (relative)"""
+    regressions = []
+    for name, reference in sorted(baseline.items()):
+        if name not in results or reference <= 0:
+            continue
+        value = results[name]
+        if name.endswith("_per_s"):
+            worse = value < reference * (1 - tolerance)
+        elif name.endswith("_s"):
+            # Ignore tiny absolute changes in fast stages, which are mostly noise
+            worse = value > reference * (1 + tolerance) and value - reference > min_delta
+        else:
+            worse = value > reference * (1 + tolerance)
+        if worse:
+            regressions.append(f"{name}: {value:.4f} vs baseline {reference:.4f} ({value / reference - 1:+.0%})")
+    return regressions
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": time.time(),
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the generate/serve pipeline")
+    parser.add_argument("--suites", nargs="+", default=["scaling", "queue"], choices=["scaling", "queue", "http", "compression", "index", "workers", "fairness"])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="Splat counts for the scaling, compression and index suites")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per scaling measurement; the median is reported")
+    parser.add_argument("--lod_levels", type=int, default=3)
+    parser.add_argument("--palette_size", type=int, default=256, help="Palette size in the compression suite")
+    parser.add_argument("--requests", type=int, default=32, help="Requests in the queue and http suites")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=min(os.cpu_count() or 1, 4),
+                        help="Largest worker pool in the workers suite")
+    parser.add_argument("--splats", type=int, default=500_000, help="Splats per scene in the queue suite")
+    parser.add_argument("--latency", type=float, default=0.5, help="Synthetic generation latency in the queue suite")
+    parser.add_argument("--viewer_port", type=int, default=9080, help="First port for benchmark viewers")
+    parser.add_argument("--url", type=str, default="http://localhost:8888", help="API server for the http suite")
+    parser.add_argument("--output", "-o", type=str, default=None, help="Write results JSON here")
+    parser.add_argument("--baseline", type=str, default=None, help="Results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown before failing")
+    parser.add_argument("--min_delta", type=float, default=0.005, help="Slowdowns smaller than this many seconds are ignored")
+    args = parser.parse_args()
+
+    results = {}
+    if "scaling" in args.suites:
+        results.update(bench_scaling(args.sizes, args.repeats, args.lod_levels, args.viewer_port))
+    if "queue" in args.suites:
+        print(f"[queue] {args.requests} requests, {args.concurrency} workers")
+        results.update(bench_queue(args.requests, args.concurrency, args.splats, args.latency, args.viewer_port))
+    if "compression" in args.suites:
+        results.update(bench_compression(args.sizes, args.repeats, args.palette_size))
+    if "index" in args.suites:
+        results.update(bench_index(args.sizes, args.repeats))
+    if "fairness" in args.suites:
+        print(f"[fairness] {args.requests} jobs from one client, {args.concurrency} from others")
+        results.update(bench_fairness(args.requests, args.concurrency, args.latency / 10, args.concurrency))
+    if "workers" in args.suites:
+        results.update(bench_workers(args.workers, args.requests, args.splats, args.latency, args.repeats))
+    if "http" in args.suites:
+        print(f"[http] {args.requests} requests, {args.concurrency} clients against {args.url}")
+        results.update(bench_http(args.url, args.requests, args.concurrency))
+
+    report = {"environment": environment(), "config": vars(args), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance, args.min_delta)
+        if regressions:
+            print(f"❌ {len(regressions)} regressions against {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"✅ No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
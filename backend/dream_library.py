@@ -0,0 +1,262 @@
+"""Persistent library of every generated dream
+
+Scenes are kept as `.dsplat` blobs at `<root>/scenes/<id[:2]>/<id>.dsplat` and
+indexed in a SQLite database at `<root>/library.db` with their prompt,
+timestamps, splat count, bounding box, size and generation timings. Prompts
+are full-text indexed with FTS5 where SQLite supports it.
+
+Listing uses keyset pagination on (created_at, id), so a page costs the same
+at 100k+ entries as it does at 100.
+"""
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from scene_summary import load_summary, save_summary
+from splat_convert import rows_finite
+from splat_format import SplatArrays, atomic_write, is_quantized, load_splat, save_splat
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dreams (
+    id TEXT PRIMARY KEY,
+    prompt TEXT NOT NULL,
+    seed INTEGER,
+    created_at REAL NOT NULL,
+    last_served_at REAL,
+    num_splats INTEGER NOT NULL,
+    bbox TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    timings TEXT NOT NULL,
+    path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dreams_created ON dreams (created_at, id);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS dreams_fts USING fts5(
+    prompt, content='dreams', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS dreams_fts_insert AFTER INSERT ON dreams BEGIN
+    INSERT INTO dreams_fts (rowid, prompt) VALUES (new.rowid, new.prompt);
+END;
+CREATE TRIGGER IF NOT EXISTS dreams_fts_delete AFTER DELETE ON dreams BEGIN
+    INSERT INTO dreams_fts (dreams_fts, rowid, prompt) VALUES ('delete', old.rowid, old.prompt);
+END;
+"""
+
+COLUMNS = "id, prompt, seed, created_at, last_served_at, num_splats, bbox, size_bytes, timings"
+MAX_PAGE_SIZE = 200
+
+
+def fts_query(text: str) -> str:
+    """Quote each word so user input can't break FTS syntax; the last word matches as a prefix"""
+    words = [word.replace('"', '""') for word in text.split()]
+    if not words:
+        return ""
+    return " ".join(f'"{word}"' for word in words[:-1]) + (" " if len(words) > 1 else "") + f'"{words[-1]}"*'
+
+
+def encode_cursor(created_at: float, dream_id: str) -> str:
+    return f"{created_at!r}:{dream_id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    created_at, _, dream_id = cursor.partition(":")
+    return float(created_at), dream_id
+
+
+def scene_bbox(scene) -> Dict[str, List[float]]:
+    centers = np.asarray(scene.centers, dtype=np.float32)
+    # NaN bounds would make the dream unserializable as JSON
+    centers = centers[rows_finite(centers)]
+    if len(centers) == 0:
+        return {"min": [0.0, 0.0, 0.0], "max": [0.0, 0.0, 0.0]}
+    return {"min": centers.min(axis=0).tolist(), "max": centers.max(axis=0).tolist()}
+
+
+class DreamLibrary:
+    """SQLite-indexed store of generated scenes"""
+
+    def __init__(self, root: Union[str, Path], compression=None):
+        self.root = Path(root).expanduser()
+        # splat_compress.Compression for scenes written here (not for hard-linked cache entries)
+        self.compression = compression
+        self.scene_dir = self.root / "scenes"
+        self.scene_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.root / "library.db", check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        try:
+            self._db.executescript(FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5; prompt search falls back to LIKE
+            self.has_fts = False
+        self._db.commit()
+
+    def add(
+        self,
+        dream_id: str,
+        prompt: str,
+        scene,
+        seed: Optional[int] = None,
+        timings: Optional[Dict[str, float]] = None,
+        source_path: Optional[Path] = None,
+        summary: Optional[dict] = None,
+    ) -> dict:
+        """Store a scene (and its summary, if given) and index it
+
+        If `source_path` is an existing `.dsplat` file of the same scene (a cache
+        entry), it is hard-linked instead of written again, unless this library
+        compresses its scenes.
+        """
+        path = self._path(dream_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if self.compression is not None or not self._link(source_path, path):
+            save_splat(path, scene, compression=self.compression)
+        if summary is not None:
+            save_summary(path, summary)
+
+        record = {
+            "id": dream_id,
+            "prompt": prompt,
+            "seed": seed,
+            "created_at": time.time(),
+            "last_served_at": None,
+            "num_splats": len(scene.centers),
+            "bbox": json.dumps(summary["bounds"] if summary is not None else scene_bbox(scene)),
+            "size_bytes": path.stat().st_size,
+            "timings": json.dumps({name: round(seconds, 4) for name, seconds in (timings or {}).items()}),
+            "path": str(path.relative_to(self.root)),
+        }
+        with self._lock:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO dreams ({COLUMNS}, path) VALUES ({', '.join('?' * 10)})",
+                tuple(record.values()),
+            )
+            self._db.commit()
+        return self._to_dict(record)
+
+    def get(self, dream_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute(f"SELECT {COLUMNS} FROM dreams WHERE id = ?", (dream_id,)).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def list(
+        self,
+        query: Optional[str] = None,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        min_splats: Optional[int] = None,
+        max_splats: Optional[int] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        """A page of dreams, newest first, and the cursor of the next page (None at the end)"""
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        conditions, params = [], []
+        if query and query.strip():
+            if self.has_fts:
+                conditions.append("rowid IN (SELECT rowid FROM dreams_fts WHERE dreams_fts MATCH ?)")
+                params.append(fts_query(query))
+            else:
+                conditions.append("prompt LIKE ?")
+                params.append(f"%{query.strip()}%")
+        if cursor:
+            created_at, dream_id = decode_cursor(cursor)
+            conditions.append("(created_at, id) < (?, ?)")
+            params += [created_at, dream_id]
+        for condition, value in (
+            ("created_at >= ?", since),
+            ("created_at < ?", until),
+            ("num_splats >= ?", min_splats),
+            ("num_splats <= ?", max_splats),
+        ):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = f"SELECT {COLUMNS} FROM dreams {where} ORDER BY created_at DESC, id DESC LIMIT ?"
+        with self._lock:
+            rows = self._db.execute(sql, (*params, limit + 1)).fetchall()
+
+        dreams = [self._to_dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor(dreams[-1]["created_at"], dreams[-1]["id"])
+        return dreams, next_cursor
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM dreams").fetchone()[0]
+
+    def load(self, dream_id: str) -> Optional[SplatArrays]:
+        """Memory-map a stored scene, or None if it isn't in the library"""
+        path = self._path(dream_id)
+        if self.get(dream_id) is None or not path.exists():
+            return None
+        return load_splat(path)
+
+    def summary(self, dream_id: str) -> Optional[dict]:
+        """Stored scene summary of a dream, or None"""
+        return load_summary(self._path(dream_id))
+
+    def compressed_path(self, dream_id: str, compression) -> Optional[Path]:
+        """A quantized `.dsplat` of a stored scene for download, or None if it isn't in the library
+
+        Scenes stored uncompressed are encoded on first request and kept next to the original.
+        """
+        path = self._path(dream_id)
+        if self.get(dream_id) is None or not path.exists():
+            return None
+        if is_quantized(path):
+            return path
+        quantized = path.with_name(f"{dream_id}.quantized.dsplat")
+        if not quantized.exists():
+            save_splat(quantized, load_splat(path), compression=compression)
+        return quantized
+
+    def mark_served(self, dream_id: str):
+        with self._lock:
+            self._db.execute("UPDATE dreams SET last_served_at = ? WHERE id = ?", (time.time(), dream_id))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _path(self, dream_id: str) -> Path:
+        return self.scene_dir / dream_id[:2] / f"{dream_id}.dsplat"
+
+    def _link(self, source_path: Optional[Path], path: Path) -> bool:
+        if source_path is None or not Path(source_path).exists():
+            return False
+        try:
+            with atomic_write(path) as tmp_path:
+                try:
+                    os.link(source_path, tmp_path)
+                except OSError:
+                    # Different filesystem or no hard link support
+                    shutil.copyfile(source_path, tmp_path)
+        except OSError:
+            return False
+        return True
+
+    @staticmethod
+    def _to_dict(row) -> dict:
+        record = {name: row[name] for name in COLUMNS.split(", ")}
+        record["bbox"] = json.loads(record["bbox"])
+        record["timings"] = json.loads(record["timings"])
+        return record
@@ -0,0 +1,412 @@
+"""Generation across several devices, one worker process each
+
+`WorkerPoolBackend` is a GenerationBackend that runs another backend in worker
+processes, one per device (for example one per GPU, or N "cpu" workers of the
+synthetic backend). Each request goes to the worker with the fewest requests in
+flight. A worker that dies (a CUDA fault, the OOM killer) fails only the
+requests it was running and is restarted, reloading the modes it had loaded,
+after a delay that doubles while it keeps dying. A restarted worker that fails
+to reload a mode counts as dying again. A worker that can't even
+construct its backend fails the whole pool instead, since every restart would
+fail the same way.
+
+Splat scenes come back through shared memory: the worker writes a `.dsplat`
+file to /dev/shm and the server memory-maps it, so scene arrays are never
+pickled. The file is unlinked as soon as it is mapped and its memory is freed
+when the last array referencing it goes away. Meshes are smaller and are sent
+back through the result queue as arrays.
+"""
+import inspect
+import itertools
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import Future
+from types import SimpleNamespace
+from typing import Dict, List
+
+import numpy as np
+
+from backends import BACKENDS, GenerationBackend, create_backend
+from metrics import REGISTRY, gpu_peak_bytes, gpu_total_bytes, record_gpu_peak, record_gpu_total, reset_gpu_peak
+from splat_convert import to_float32
+from splat_format import SplatArrays, load_splat, save_splat
+
+
+SHARED_MEMORY_DIR = "/dev/shm"
+# How often an idle reader checks that its worker is still alive
+POLL_INTERVAL = 0.5
+# Delay before restarting a dead worker, doubled for each death in a row
+RESTART_BACKOFF = 1.0
+MAX_RESTART_BACKOFF = 60.0
+
+
+def detect_devices() -> List[str]:
+    """One entry per visible GPU, or a single "cpu" without one"""
+    import torch
+
+    if not torch.cuda.is_available():
+        return ["cpu"]
+    return [f"cuda:{i}" for i in range(torch.cuda.device_count())]
+
+
+def shared_memory_dir() -> str:
+    return SHARED_MEMORY_DIR if os.path.isdir(SHARED_MEMORY_DIR) else tempfile.gettempdir()
+
+
+def takes_device(backend_name: str) -> bool:
+    """Whether a backend is constructed with a `device` (and so runs on a GPU)"""
+    return "device" in inspect.signature(BACKENDS[backend_name]).parameters
+
+
+def worker_main(device: str, backend_name: str, options: dict, requests, results):
+    """Worker process loop: load and generate on one device until told to stop"""
+    if device.startswith("cuda:"):
+        # Pin the process to its GPU before torch is imported, so device 0 is ours
+        os.environ["CUDA_VISIBLE_DEVICES"] = device.split(":", 1)[1]
+        if takes_device(backend_name):
+            options = {**options, "device": "cuda"}
+    try:
+        backend = create_backend(backend_name, **options)
+    except Exception as e:
+        traceback.print_exc()
+        results.put((None, "failed", f"{type(e).__name__}: {e}"))
+        return
+    results.put((None, "started", None))
+
+    while True:
+        command, request_id, payload = requests.get()
+        if command == "stop":
+            return
+        try:
+            if command == "load":
+                backend.load(payload)
+                # The process only sees its own GPU, as cuda:0
+                total = gpu_total_bytes().get("cuda:0")
+                results.put((request_id, "ok", {"timings": dict(backend.timings), "gpu_total_bytes": total}))
+                continue
+            if command == "panorama":
+                results.put((request_id, "ok", np.asarray(backend.generate_panorama(**payload))))
+                continue
+            # The peak is per process, so only a worker can measure its generations
+            reset_gpu_peak()
+            scene = backend.generate(**payload)
+            peak = gpu_peak_bytes()
+            if payload.get("return_mesh"):
+                result = {"mesh": {
+                    "vertices": np.asarray(scene.vertices),
+                    "triangles": np.asarray(scene.triangles),
+                    "vertex_colors": np.asarray(scene.vertex_colors),
+                }}
+            else:
+                # Invalid gaussians are kept, so the server still counts what it drops
+                scene = SplatArrays(
+                    centers=to_float32(scene.centers), rgbs=to_float32(scene.rgbs),
+                    opacities=to_float32(scene.opacities), covariances=to_float32(scene.covariances),
+                )
+                path = os.path.join(shared_memory_dir(), f"dream-{uuid.uuid4().hex}.dsplat")
+                save_splat(path, scene, half_colors=False)
+                result = {"path": path}
+            result["gpu_peak_bytes"] = peak
+            result["low_vram"] = bool(getattr(backend, "low_vram", None))
+            results.put((request_id, "ok", result))
+        except NotImplementedError as e:
+            results.put((request_id, "unsupported", str(e)))
+        except Exception as e:
+            traceback.print_exc()
+            results.put((request_id, "error", f"{type(e).__name__}: {e}"))
+
+
+class GenerationWorker:
+    """One worker process, its queues and the requests it has in flight"""
+
+    def __init__(self, index: int, device: str, backend_name: str, options: dict, context):
+        self.index = index
+        self.device = device
+        self.backend_name = backend_name
+        self.options = options
+        self.context = context
+        self.process = None
+        self.requests = None
+        self.results = None
+        # request id -> Future
+        self.pending: Dict[int, Future] = {}
+        self.restarts = 0
+        # Deaths since the worker last completed a request (reloads aside), for the restart backoff
+        self.failures = 0
+        # Whether the current process has constructed its backend
+        self.started = False
+        # Future -> mode, for the loads sent to a restarted worker
+        self.reloads: Dict[Future, str] = {}
+
+    def start(self):
+        self.open_queues()
+        self.spawn()
+
+    def open_queues(self):
+        """Fresh queues; requests sent before `spawn` wait in them"""
+        self.requests = self.context.Queue()
+        self.results = self.context.Queue()
+        self.started = False
+        self.reloads = {}
+
+    def spawn(self):
+        self.process = self.context.Process(
+            target=worker_main,
+            args=(self.device, self.backend_name, self.options, self.requests, self.results),
+            name=f"generation-worker-{self.index}",
+            daemon=True,
+        )
+        self.process.start()
+
+
+class WorkerPoolBackend(GenerationBackend):
+    """Runs a backend in one worker process per device, routing to the least loaded"""
+
+    name = "pool"
+    reports_gpu_peak = True
+
+    def __init__(self, backend_name: str, devices: List[str], **options):
+        super().__init__()
+        if not devices:
+            raise ValueError("At least one device is required")
+        # Never loaded here; answers cache_params and settings without a model
+        self.template = create_backend(backend_name, **options)
+        self.name = f"{backend_name}-pool"
+        self.inpaint_bg = getattr(self.template, "inpaint_bg", False)
+        self.supports_panoramas = self.template.supports_panoramas
+        self.devices = devices
+        self.concurrency = len(devices)
+        self.loaded_modes = set()
+        # Spawned, not forked: CUDA can't be used in a child forked after it was initialized
+        context = multiprocessing.get_context("spawn")
+        self.workers = [GenerationWorker(i, device, backend_name, options, context)
+                        for i, device in enumerate(devices)]
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._stopping = False
+        # Why the workers couldn't start, once one of them failed to construct its backend
+        self._error = None
+        self._restarts = REGISTRY.counter(
+            "generation_worker_restarts_total", "Generation worker processes restarted after dying"
+        )
+        self._started = False
+
+    @property
+    def device_name(self) -> str:
+        return ",".join(self.devices)
+
+    def is_loaded(self, mode: str = "t2s") -> bool:
+        return mode in self.loaded_modes
+
+    def start(self):
+        """Start the worker processes; the first load or generate does it if needed
+
+        Not done on construction: spawned workers import the server's main
+        module again, and must not start workers of their own when they do.
+        """
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for worker in self.workers:
+                worker.start()
+                threading.Thread(target=self._read_results, args=(worker,), name=f"generation-reader-{worker.index}",
+                                 daemon=True).start()
+
+    def load(self, mode: str = "t2s"):
+        """Load `mode` on every worker, in parallel"""
+        self.start()
+        with self._lock:
+            self._check_started()
+            futures = [self._submit(worker, "load", mode) for worker in self.workers]
+        for worker, future in zip(self.workers, futures):
+            result = future.result()
+            for name, seconds in result["timings"].items():
+                # The slowest worker decides when the pool is ready
+                self.timings[name] = max(seconds, self.timings.get(name, 0.0))
+            if result["gpu_total_bytes"] is not None:
+                record_gpu_total(result["gpu_total_bytes"], worker.device)
+        self.loaded_modes.add(mode)
+
+    def cache_params(self, mode: str = "t2s") -> Dict:
+        return self.template.cache_params(mode)
+
+    def panorama_params(self, mode: str = "t2s") -> Dict:
+        return self.template.panorama_params(mode)
+
+    def generate_panorama(self, prompt=None, image=None, seed=None):
+        from PIL import Image
+
+        pixels = self._run("panorama", {"prompt": prompt, "image": image, "seed": seed})
+        return Image.fromarray(pixels)
+
+    def generate(self, prompt=None, image=None, pano_image=None, seed=None, return_mesh=False):
+        result = self._run("generate", {
+            "prompt": prompt, "image": image, "pano_image": pano_image,
+            "seed": seed, "return_mesh": return_mesh,
+        })
+        if result["gpu_peak_bytes"] is not None:
+            record_gpu_peak(result["gpu_peak_bytes"], low_vram=result["low_vram"])
+        if "mesh" in result:
+            return SimpleNamespace(**result["mesh"])
+        scene = load_splat(result["path"])
+        # Still mapped; the memory is released with the last array using it
+        os.unlink(result["path"])
+        return scene
+
+    def _run(self, command: str, payload: dict):
+        """Run a command on the least loaded worker and wait for its result"""
+        self.start()
+        with self._lock:
+            self._check_started()
+            worker = min(self.workers, key=lambda worker: (len(worker.pending), worker.index))
+            future = self._submit(worker, command, payload)
+        return future.result()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return sum(len(worker.pending) for worker in self.workers)
+
+    def shutdown(self, timeout: float = 10.0):
+        """Stop every worker process"""
+        with self._lock:
+            self._stopping = True
+            if not self._started:
+                return
+            for worker in self.workers:
+                worker.requests.put(("stop", None, None))
+        for worker in self.workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        with self._lock:
+            for worker in self.workers:
+                failed, worker.pending = worker.pending, {}
+                for future in failed.values():
+                    future.set_exception(RuntimeError("Generation workers were shut down"))
+
+    def _check_started(self):
+        """Raise if the pool failed to start; the caller holds self._lock"""
+        if self._error is not None:
+            raise RuntimeError(self._error)
+
+    def _submit(self, worker: GenerationWorker, command: str, payload) -> Future:
+        """Send a command to a worker; the caller holds self._lock"""
+        request_id = next(self._ids)
+        future = Future()
+        worker.pending[request_id] = future
+        worker.requests.put((command, request_id, payload))
+        return future
+
+    def _read_results(self, worker: GenerationWorker):
+        """Resolve a worker's results, restarting it if it dies"""
+        while True:
+            results = worker.results
+            try:
+                request_id, status, payload = results.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if self._stopping:
+                    return
+                if not worker.process.is_alive():
+                    self._restart(worker)
+                continue
+            except (EOFError, OSError):
+                if self._stopping:
+                    return
+                self._restart(worker)
+                continue
+            if request_id is None:
+                if status == "failed":
+                    self._fail(f"Generation worker on {worker.device} failed to start: {payload}")
+                    return
+                worker.started = True
+                continue
+            with self._lock:
+                future = worker.pending.pop(request_id, None)
+                mode = worker.reloads.pop(future, None)
+                if status == "ok" and mode is None:
+                    # Reloading isn't enough: a worker that dies on every job keeps backing off
+                    worker.failures = 0
+            if mode is not None and status != "ok":
+                # Without its model the worker would only fail the jobs sent to it
+                future.set_exception(RuntimeError(payload))
+                worker.process.terminate()
+                worker.process.join(POLL_INTERVAL)
+                self._restart(worker, f"failed to reload {mode}: {payload}")
+                continue
+            if future is None:
+                continue
+            if status == "ok":
+                future.set_result(payload)
+            elif status == "unsupported":
+                future.set_exception(NotImplementedError(payload))
+            else:
+                future.set_exception(RuntimeError(payload))
+
+    def _restart(self, worker: GenerationWorker, reason: str = None):
+        exit_code = worker.process.exitcode
+        if not worker.started:
+            self._fail(f"Generation worker on {worker.device} exited (code {exit_code}) before starting")
+            return
+        reason = reason or f"died (exit code {exit_code})"
+        with self._lock:
+            if self._stopping:
+                return
+            worker.failures += 1
+            delay = min(RESTART_BACKOFF * 2 ** (worker.failures - 1), MAX_RESTART_BACKOFF)
+            print(f"⚠️ Generation worker {worker.index} on {worker.device} {reason}; restarting in {delay:.0f}s")
+            failed, worker.pending = worker.pending, {}
+            for future in failed.values():
+                future.set_exception(RuntimeError(f"Generation worker on {worker.device} {reason}"))
+            worker.restarts += 1
+            self._restarts.inc(device=worker.device)
+            # Requests sent while waiting queue up for the new process
+            worker.open_queues()
+            for mode in self.loaded_modes:
+                # Queued ahead of any new request, so nothing needs to wait for it;
+                # the reader checks the result
+                worker.reloads[self._submit(worker, "load", mode)] = mode
+        time.sleep(delay)
+        with self._lock:
+            if self._stopping:
+                return
+            worker.spawn()
+
+    def _fail(self, error: str):
+        """Fail every request and stop the pool, as no worker can be expected to start"""
+        print(f"⚠️ {error}; stopping generation workers")
+        with self._lock:
+            if self._stopping:
+                return
+            self._error = error
+            self._stopping = True
+            for worker in self.workers:
+                failed, worker.pending = worker.pending, {}
+                for future in failed.values():
+                    future.set_exception(RuntimeError(error))
+                if worker.process.is_alive():
+                    worker.requests.put(("stop", None, None))
+
+
+def create_worker_pool(backend_name: str, devices: str, **options) -> WorkerPoolBackend:
+    """Pool from a device spec: "auto" (every GPU), a count of workers, or a list like "cuda:0,cuda:1"
+
+    A count means that many GPUs for backends that take a device and that many
+    CPU workers otherwise, and bare numbers in a list are GPU indexes.
+    """
+    if devices == "auto":
+        device_list = detect_devices()
+    elif devices.isdigit():
+        count = int(devices)
+        device_list = [f"cuda:{i}" for i in range(count)] if takes_device(backend_name) else ["cpu"] * count
+    else:
+        device_list = [f"cuda:{device}" if device.isdigit() else device
+                       for device in (device.strip() for device in devices.split(",")) if device]
+    print(f"Starting {len(device_list)} generation workers: {', '.join(device_list)}")
+    return WorkerPoolBackend(backend_name, device_list, **options)
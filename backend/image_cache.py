@@ -0,0 +1,92 @@
+"""Cached panoramas and uploaded conditioning images
+
+WorldGen generates a scene in two stages: a diffusion model paints a 2048x1024
+panorama from the prompt (and the image, in image-to-scene mode), then the
+panorama is lifted to 3D. The diffusion stage is the expensive one and doesn't
+depend on the lifting settings (resolution, inpaint_bg), so its panoramas are
+cached separately, keyed only by that stage's inputs. Regenerating a scene with
+other settings, or as a mesh, starts from the cached panorama.
+
+Images uploaded to the API are kept the same way, keyed by the SHA-256 of
+their bytes, which is also what `file_digest` gives the demo for a local file.
+"""
+import hashlib
+import io
+import json
+from pathlib import Path
+from typing import Optional, Union
+
+from splat_cache import DiskLRU, normalize_prompt
+from splat_format import atomic_write
+
+
+def panorama_key(prompt: Optional[str], seed: Optional[int] = None, image: Optional[str] = None, **params) -> str:
+    """Content hash of everything that determines a panorama
+
+    `image` is the digest of the conditioning image, and `params` the backend's
+    `panorama_params`.
+    """
+    inputs = {"prompt": normalize_prompt(prompt or ""), "seed": seed, "image": image, **params}
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+class ImageCache(DiskLRU):
+    """Image files keyed by content hash, least recently used evicted beyond `max_bytes`"""
+
+    def __init__(self, cache_dir: Union[str, Path], max_bytes: int = 2 * 1024 ** 3, suffix: str = ".png"):
+        self.suffix = suffix
+        self.pattern = f"*{suffix}"
+        super().__init__(cache_dir, max_bytes)
+
+    def path(self, key: str) -> Optional[Path]:
+        """Path of a cached image, marking it as recently used, or None"""
+        return self._touch(key)
+
+    def get(self, key: str):
+        """The cached image as a PIL image, or None"""
+        from PIL import Image
+
+        path = self.path(key)
+        if path is None:
+            return None
+        try:
+            with Image.open(path) as image:
+                image.load()
+                return image
+        except OSError as e:
+            # Evicted or partially written meanwhile
+            print(f"Ignoring unreadable cached image {key}: {e}")
+            return None
+
+    def put(self, key: str, image) -> Path:
+        """Store a PIL image losslessly"""
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return self._write(key, buffer.getvalue())
+
+    def put_bytes(self, data: bytes) -> str:
+        """Store an encoded image as it is and return its key, the SHA-256 of its bytes
+
+        Raises ValueError if the bytes aren't an image PIL can read.
+        """
+        from PIL import Image
+
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image.verify()
+        except Exception as e:
+            raise ValueError(f"Not a readable image: {e}")
+        key = hashlib.sha256(data).hexdigest()
+        if self.path(key) is None:
+            self._write(key, data)
+        return key
+
+    def _write(self, key: str, data: bytes) -> Path:
+        path = self._path(key)
+        with atomic_write(path) as tmp_path, open(tmp_path, "wb") as f:
+            f.write(data)
+        self._add(key, len(data))
+        return path
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}{self.suffix}"
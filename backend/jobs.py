@@ -0,0 +1,454 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETE = "complete"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (COMPLETE, FAILED, CANCELLED)
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted to a queue that is at capacity or would make it wait too long
+
+    `retry_after` is the number of seconds until the job would likely be accepted.
+    """
+
+    def __init__(self, message: str, retry_after: float = 0.0, reason: str = "queue_full"):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class ClientLimitError(QueueFullError):
+    """Raised when a client already has as many jobs queued as it is allowed"""
+
+
+class JobCancelledError(Exception):
+    """Raised inside a runner when the job it is working on has been cancelled"""
+
+
+@dataclass
+class Job:
+    """A single generation request tracked by the JobQueue"""
+
+    prompt: str
+    priority: int = 0
+    params: dict = field(default_factory=dict)
+    # Who submitted the job, for per-client limits and fair sharing
+    client: Optional[str] = None
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = QUEUED
+    stage: str = "queued"
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    # Bumped on every state change so event streams can wait for new updates
+    version: int = 0
+    cancel_requested: bool = False
+    # Heap ordering key: (-priority, fair-share round, submission sequence)
+    sort_key: tuple = ()
+    # Identical concurrent requests share one job; see JobQueue.submit
+    dedup_key: Optional[str] = None
+    subscribers: int = 1
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    def check_cancelled(self):
+        """Abort the current runner if this job has been cancelled"""
+        if self.cancel_requested:
+            raise JobCancelledError(self.id)
+
+
+class JobQueue:
+    """Priority queue of generation jobs drained by a bounded pool of worker threads
+
+    Within a priority, clients take turns: a client's n-th waiting job is put
+    in round n (counting from the round being served), so one client queueing
+    many jobs doesn't delay a client queueing one. A client can have at most
+    `max_client_queued` jobs waiting and `max_client_running` running (0 means
+    no limit), and a new job is refused if it would wait more than `max_wait`
+    seconds.
+
+    `runner` is called as `runner(job, set_stage)` on a worker thread and must
+    return a dict that becomes `job.result`. Runners report progress through
+    `set_stage(name)` and should call `job.check_cancelled()` between stages.
+    `on_finish(job)`, if given, is called with the queue locked whenever a job
+    reaches a final state, so it must be quick.
+    """
+
+    def __init__(
+        self,
+        runner: Callable,
+        num_workers: int = 1,
+        max_queue_size: int = 64,
+        default_duration: float = 60.0,
+        history_size: int = 256,
+        on_finish: Optional[Callable] = None,
+        max_client_queued: int = 0,
+        max_client_running: int = 0,
+        max_wait: float = 0.0,
+    ):
+        self.runner = runner
+        self.on_finish = on_finish
+        self.num_workers = max(1, num_workers)
+        self.max_queue_size = max_queue_size
+        self.history_size = history_size
+        self.max_client_queued = max_client_queued
+        self.max_client_running = max_client_running
+        self.max_wait = max_wait
+        # Moving average of job run time, used for ETA estimates
+        self.avg_duration = default_duration
+
+        self._heap = []
+        self._counter = itertools.count()
+        self._jobs: Dict[str, Job] = {}
+        # dedup_key -> unfinished job
+        self._inflight: Dict[str, Job] = {}
+        self._num_queued = 0
+        self._num_running = 0
+        # Fair-share round last started, and the last round given to each client
+        self._round = 0
+        self._client_rounds: Dict[Optional[str], int] = {}
+        self._client_queued = Counter()
+        self._client_running = Counter()
+        self._cond = threading.Condition()
+        # job id -> (event loop, event) of coroutines in `watch`
+        self._watchers: Dict[str, list] = {}
+        self._workers: List[threading.Thread] = []
+        self._shutdown = False
+
+    def start(self):
+        """Start the worker threads"""
+        with self._cond:
+            if self._workers:
+                return
+            self._shutdown = False
+            for i in range(self.num_workers):
+                worker = threading.Thread(
+                    target=self._worker_loop, name=f"job-worker-{i}", daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+
+    def shutdown(self, wait: bool = False):
+        """Stop the worker threads, cancelling everything still queued"""
+        with self._cond:
+            self._shutdown = True
+            for job in self._jobs.values():
+                if job.status == QUEUED:
+                    self._finish(job, CANCELLED, error="Server shutting down")
+            self._cond.notify_all()
+            workers, self._workers = self._workers, []
+        if wait:
+            for worker in workers:
+                worker.join()
+
+    def submit(self, prompt: str, priority: int = 0, dedup_key: Optional[str] = None,
+               client: Optional[str] = None, charge: Optional[Callable[[], float]] = None,
+               **params) -> Tuple[Job, bool]:
+        """Queue a new job; higher priority values are served first
+
+        Returns the job and whether this call attached to one already in flight.
+
+        If a queued or running job has the same `dedup_key`, no new job is
+        created: the caller is attached to that job (single-flight), which is
+        moved up to `priority` if it is still queued. Attaching is never
+        refused, since it adds no work.
+
+        `charge` (such as a rate limiter's acquire) is called only once a new
+        job has passed every other check, and refuses it by returning the
+        seconds until it would be allowed. Attached and refused requests are
+        never charged.
+
+        Raises ClientLimitError if `client` has too many jobs waiting or
+        `charge` refuses the job, and QueueFullError if the queue is full or
+        the job would wait too long.
+        """
+        with self._cond:
+            job = self._inflight.get(dedup_key) if dedup_key is not None else None
+            if job is not None:
+                job.subscribers += 1
+                if job.status == QUEUED and priority > job.priority:
+                    # The old heap entry goes stale and is skipped when popped
+                    job.priority = priority
+                    job.sort_key = (-priority,) + job.sort_key[1:]
+                    heapq.heappush(self._heap, (job.sort_key, job))
+                self._touch(job)
+                return job, True
+
+            # One job finishes about this often once the queue is moving
+            turnover = self.avg_duration / self.num_workers
+            if self._num_queued >= self.max_queue_size:
+                raise QueueFullError(f"Queue is full ({self.max_queue_size} jobs waiting)", retry_after=turnover)
+            if self.max_client_queued and self._client_queued[client] >= self.max_client_queued:
+                # Once the client's next job starts, it has room for another
+                next_start = min(self._projected_wait(job.sort_key) for job in self._jobs.values()
+                                 if job.client == client and job.status == QUEUED)
+                raise ClientLimitError(f"Too many queued jobs ({self.max_client_queued}) for this client",
+                                       retry_after=next_start + turnover, reason="client_queue")
+
+            fair_round = max(self._round, self._client_rounds.get(client, 0)) + 1
+            sort_key = (-priority, fair_round, next(self._counter))
+            wait = self._projected_wait(sort_key)
+            if self.max_wait and wait > self.max_wait:
+                raise QueueFullError(f"Projected queue wait is {wait:.0f}s (limit {self.max_wait:.0f}s)",
+                                     retry_after=max(wait - self.max_wait, turnover), reason="queue_wait")
+            retry_after = charge() if charge is not None else 0.0
+            if retry_after > 0:
+                raise ClientLimitError("Rate limit exceeded", retry_after=retry_after, reason="rate_limit")
+
+            job = Job(prompt=prompt, priority=priority, params=params, client=client, dedup_key=dedup_key)
+            job.sort_key = sort_key
+            self._client_rounds[client] = fair_round
+            self._client_queued[client] += 1
+            self._jobs[job.id] = job
+            if dedup_key is not None:
+                self._inflight[dedup_key] = job
+            heapq.heappush(self._heap, (job.sort_key, job))
+            self._num_queued += 1
+            self._prune_history()
+            self._cond.notify_all()
+            return job, False
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job; queued jobs are dropped, running jobs stop at the next stage
+
+        A job shared by several submitters only stops once all of them have cancelled.
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return False
+            if job.subscribers > 1:
+                job.subscribers -= 1
+                self._touch(job)
+                return True
+            job.cancel_requested = True
+            # A cancelled job must not absorb later identical requests, so a
+            # retry queues a fresh job instead of attaching to this one
+            if job.dedup_key is not None and self._inflight.get(job.dedup_key) is job:
+                del self._inflight[job.dedup_key]
+            if job.status == QUEUED:
+                self._finish(job, CANCELLED)
+            else:
+                job.stage = "cancelling"
+                self._touch(job)
+            return True
+
+    def queue_depth(self) -> int:
+        # Reads one int without the lock, so the event loop never waits on the workers
+        return self._num_queued
+
+    def projected_wait(self, priority: int = 0, client: Optional[str] = None) -> float:
+        """Seconds a new job would likely wait before starting"""
+        with self._cond:
+            fair_round = max(self._round, self._client_rounds.get(client, 0)) + 1
+            return self._projected_wait((-priority, fair_round, float("inf")))
+
+    def running_count(self) -> int:
+        # Lock-free, like queue_depth
+        return self._num_running
+
+    def snapshot(self, job: Job) -> dict:
+        """Return a JSON-serializable view of a job including queue position and ETA"""
+        with self._cond:
+            position = self._position(job)
+            return {
+                "job_id": job.id,
+                "status": job.status,
+                "stage": job.stage,
+                "prompt": job.prompt,
+                "priority": job.priority,
+                "subscribers": job.subscribers,
+                "queue_position": position,
+                "eta_seconds": self._eta(job, position),
+                "created_at": job.created_at,
+                "started_at": job.started_at,
+                "finished_at": job.finished_at,
+                "result": job.result,
+                "error": job.error,
+            }
+
+    def wait_for_update(self, job: Job, version: int, timeout: float) -> int:
+        """Block until the job changes past `version` or the timeout expires"""
+        with self._cond:
+            self._cond.wait_for(lambda: job.version != version, timeout=timeout)
+            return job.version
+
+    async def watch(self, job: Job, version: int, timeout: float) -> int:
+        """`wait_for_update` for the event loop: waits without holding a thread"""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        watcher = (loop, event)
+        with self._cond:
+            if job.version != version:
+                return job.version
+            self._watchers.setdefault(job.id, []).append(watcher)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._cond:
+                watchers = self._watchers.get(job.id, [])
+                if watcher in watchers:
+                    watchers.remove(watcher)
+                if not watchers:
+                    self._watchers.pop(job.id, None)
+        return job.version
+
+    def _position(self, job: Job) -> Optional[int]:
+        """Number of queued jobs ahead of this one (0 = next to run)"""
+        if job.status != QUEUED:
+            return None
+        return self._jobs_ahead(job.sort_key)
+
+    def _jobs_ahead(self, sort_key: tuple) -> int:
+        return sum(
+            1 for key, other in self._heap
+            if other.status == QUEUED and key == other.sort_key and key < sort_key
+        )
+
+    def _projected_wait(self, sort_key: tuple) -> float:
+        """Time until a job with this sort key starts, with the jobs ahead spread across the workers"""
+        return self._jobs_ahead(sort_key) // self.num_workers * self.avg_duration
+
+    def _eta(self, job: Job, position: Optional[int]) -> Optional[float]:
+        if job.finished:
+            return 0.0
+        if job.status == RUNNING:
+            return max(0.0, self.avg_duration - (time.time() - job.started_at))
+        # Jobs ahead are spread across the workers, then this one runs in full
+        return (position // self.num_workers + 1) * self.avg_duration
+
+    def _touch(self, job: Job):
+        job.version += 1
+        self._cond.notify_all()
+        for loop, event in self._watchers.get(job.id, ()):
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The loop has closed
+                pass
+
+    def _finish(self, job: Job, status: str, result: Optional[dict] = None, error: Optional[str] = None):
+        if job.status == QUEUED:
+            self._num_queued -= 1
+            self._uncount(self._client_queued, job.client)
+        elif job.status == RUNNING:
+            self._num_running -= 1
+            self._uncount(self._client_running, job.client)
+        if job.dedup_key is not None and self._inflight.get(job.dedup_key) is job:
+            del self._inflight[job.dedup_key]
+        job.status = status
+        job.stage = status
+        job.result = result
+        job.error = error
+        job.finished_at = time.time()
+        self._touch(job)
+        if self.on_finish is not None:
+            try:
+                self.on_finish(job)
+            except Exception as e:
+                print(f"on_finish failed for job {job.id}: {e}")
+
+    @staticmethod
+    def _uncount(counts: Counter, client: Optional[str]):
+        counts[client] -= 1
+        if counts[client] <= 0:
+            del counts[client]
+
+    def _prune_history(self):
+        """Forget the oldest finished jobs once the history grows too large"""
+        # Clients whose last round has started are placed as if they were new
+        self._client_rounds = {client: fair_round for client, fair_round in self._client_rounds.items()
+                               if fair_round > self._round}
+        finished = [job for job in self._jobs.values() if job.finished]
+        excess = len(finished) - self.history_size
+        if excess > 0:
+            finished.sort(key=lambda job: job.finished_at)
+            for job in finished[:excess]:
+                del self._jobs[job.id]
+
+    def _next_job(self) -> Optional[Job]:
+        with self._cond:
+            while True:
+                if self._shutdown:
+                    return None
+                job = None
+                # Jobs of clients already running as many as they may; put back afterwards
+                deferred = []
+                while self._heap:
+                    key, candidate = heapq.heappop(self._heap)
+                    # Cancelled and reprioritized jobs leave entries in the heap that are skipped lazily
+                    if candidate.status != QUEUED or key != candidate.sort_key:
+                        continue
+                    if self.max_client_running and self._client_running[candidate.client] >= self.max_client_running:
+                        deferred.append((key, candidate))
+                        continue
+                    job = candidate
+                    break
+                for entry in deferred:
+                    heapq.heappush(self._heap, entry)
+                if job is not None:
+                    self._num_queued -= 1
+                    self._uncount(self._client_queued, job.client)
+                    self._client_running[job.client] += 1
+                    self._num_running += 1
+                    self._round = max(self._round, job.sort_key[1])
+                    job.status = RUNNING
+                    job.stage = "starting"
+                    job.started_at = time.time()
+                    self._touch(job)
+                    return job
+                # Woken when a job is queued or finishes
+                self._cond.wait()
+
+    def _worker_loop(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+
+            def set_stage(stage: str, job=job):
+                with self._cond:
+                    job.stage = stage
+                    self._touch(job)
+                job.check_cancelled()
+
+            try:
+                result = self.runner(job, set_stage)
+            except JobCancelledError:
+                with self._cond:
+                    self._finish(job, CANCELLED)
+            except Exception as e:
+                print(f"Job {job.id} failed: {e}")
+                with self._cond:
+                    self._finish(job, FAILED, error=str(e))
+            else:
+                with self._cond:
+                    duration = time.time() - job.started_at
+                    self.avg_duration = 0.8 * self.avg_duration + 0.2 * duration
+                    if job.cancel_requested:
+                        self._finish(job, CANCELLED)
+                    else:
+                        self._finish(job, COMPLETE, result=result)
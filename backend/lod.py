@@ -0,0 +1,135 @@
+"""Level-of-detail hierarchies for gaussian splat scenes
+
+Coarse levels are built by merging the gaussians that fall into the same cell
+of a spherical grid centred on the origin. Generated worlds are panoramic and
+viewed from around the origin, so cells subtend a constant angle: they grow with
+distance, and far-away splats are merged more aggressively than nearby ones.
+
+Each merged gaussian matches the first two moments of its members, weighted by
+importance (opacity x covariance volume), and keeps their total opacity mass.
+"""
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+
+SPLAT_KEYS = ("centers", "rgbs", "opacities", "covariances")
+
+# Don't bother keeping a level that removes less than this fraction of splats
+MIN_REDUCTION = 0.5
+
+# Detail options offered to each client, mapped onto the scene's LOD levels
+DETAIL_OPTIONS = ("low", "medium", "full")
+
+
+def covariance_volumes(covariances: np.ndarray) -> np.ndarray:
+    """sqrt(det(cov)), proportional to the volume of each gaussian's ellipsoid"""
+    return np.sqrt(np.clip(np.linalg.det(covariances.astype(np.float64)), 0, None))
+
+
+def spherical_cell_keys(centers: np.ndarray, angular_bins: int, min_radius: float = 1e-3) -> np.ndarray:
+    """Integer cell id of each center on a spherical grid with `angular_bins` polar bins
+
+    Radial cells are spaced logarithmically so that cells are roughly cubic.
+    """
+    centers = centers.astype(np.float64)
+    radius = np.maximum(np.linalg.norm(centers, axis=1), min_radius)
+    theta = np.arccos(np.clip(centers[:, 2] / radius, -1, 1))
+    phi = np.arctan2(centers[:, 1], centers[:, 0])
+
+    cell_angle = np.pi / angular_bins
+    theta_bin = np.minimum((theta / cell_angle).astype(np.int64), angular_bins - 1)
+    phi_bin = np.minimum(((phi + np.pi) / cell_angle).astype(np.int64), 2 * angular_bins - 1)
+    radial_bin = np.floor(np.log(radius / min_radius) / cell_angle).astype(np.int64)
+    return (radial_bin * angular_bins + theta_bin) * (2 * angular_bins) + phi_bin
+
+
+def merge_splats(arrays: Dict[str, np.ndarray], keys: np.ndarray) -> Dict[str, np.ndarray]:
+    """Merge all gaussians sharing a key into one, by weighted moment matching"""
+    centers = arrays["centers"].astype(np.float64)
+    covariances = arrays["covariances"].astype(np.float64)
+    opacities = arrays["opacities"].reshape(-1).astype(np.float64)
+    volumes = covariance_volumes(covariances)
+
+    _, groups = np.unique(keys, return_inverse=True)
+    groups = groups.reshape(-1)
+    num_groups = groups.max() + 1 if len(groups) else 0
+
+    def group_sum(values):
+        return np.bincount(groups, weights=values, minlength=num_groups)
+
+    # Importance weights; the epsilon keeps degenerate (zero volume) groups well defined
+    weights = opacities * volumes + 1e-30
+    total = group_sum(weights)
+
+    merged_centers = np.stack([group_sum(weights * centers[:, i]) for i in range(3)], axis=1) / total[:, None]
+    merged_rgbs = np.stack(
+        [group_sum(weights * arrays["rgbs"][:, i]) for i in range(3)], axis=1
+    ) / total[:, None]
+
+    # Second moment about the origin, then shift to the merged center
+    second = covariances + centers[:, :, None] * centers[:, None, :]
+    merged_covariances = np.stack(
+        [group_sum(weights * second[:, i, j]) for i in range(3) for j in range(3)], axis=1
+    ).reshape(-1, 3, 3) / total[:, None, None]
+    merged_covariances -= merged_centers[:, :, None] * merged_centers[:, None, :]
+
+    # Spread the members' opacity mass over the merged volume
+    merged_volumes = covariance_volumes(merged_covariances)
+    opacity_mass = group_sum(opacities * volumes)
+    mean_opacity = group_sum(opacities) / np.bincount(groups, minlength=num_groups)
+    merged_opacities = np.where(
+        merged_volumes > 0, opacity_mass / np.maximum(merged_volumes, 1e-300), mean_opacity
+    )
+
+    return {
+        "centers": merged_centers.astype(np.float32),
+        "rgbs": np.clip(merged_rgbs, 0, 1).astype(np.float32),
+        "opacities": np.clip(merged_opacities, 0, 1).astype(np.float32).reshape(-1, 1),
+        "covariances": merged_covariances.astype(np.float32),
+    }
+
+
+def build_lod(arrays: Dict[str, np.ndarray], num_levels: int = 3, base_angular_bins: int = 32) -> List[Dict[str, np.ndarray]]:
+    """Build a LOD hierarchy, coarsest level first; the last level is the full scene
+
+    Each level doubles the angular resolution of the previous one. Levels that
+    would not meaningfully reduce the splat count are dropped.
+    """
+    full = {key: arrays[key] for key in SPLAT_KEYS}
+    levels = []
+    for level in range(num_levels - 1):
+        keys = spherical_cell_keys(full["centers"], base_angular_bins * 2 ** level)
+        merged = merge_splats(full, keys)
+        if len(merged["centers"]) > MIN_REDUCTION * len(full["centers"]):
+            break
+        if levels and len(merged["centers"]) <= len(levels[-1]["centers"]):
+            continue
+        levels.append(merged)
+    levels.append(full)
+    return levels
+
+
+def detail_level(detail: str, num_levels: int) -> int:
+    """Index of the level to stream for a detail setting; "full" is always the full scene"""
+    return round(DETAIL_OPTIONS.index(detail) * (num_levels - 1) / (len(DETAIL_OPTIONS) - 1))
+
+
+def iter_chunks(arrays: Dict[str, np.ndarray], chunk_size: int,
+                order: Optional[np.ndarray] = None) -> Iterator[Dict[str, np.ndarray]]:
+    """Split splat arrays into views of at most `chunk_size` gaussians
+
+    With `order` (a permutation of the splats), chunks are copies taken in that order instead.
+    """
+    if order is None:
+        num_splats = len(arrays["centers"])
+        for start in range(0, num_splats, chunk_size):
+            yield {key: arrays[key][start:start + chunk_size] for key in SPLAT_KEYS}
+        return
+    for start in range(0, len(order), chunk_size):
+        indices = order[start:start + chunk_size]
+        yield {key: arrays[key][indices] for key in SPLAT_KEYS}
+
+
+def lod_nbytes(levels: List[Dict[str, np.ndarray]]) -> int:
+    return sum(array.nbytes for level in levels for array in level.values())
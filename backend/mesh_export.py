@@ -0,0 +1,112 @@
+"""Mesh conversion and GLB export, shared by the API server and the demo
+
+WorldGen returns meshes as Open3D TriangleMeshes. Each is converted to a
+trimesh once, with its vertex and face buffers taken as array views and its
+colors packed to RGBA8 in one vectorized pass. That trimesh is both displayed
+(viser's add_mesh_trimesh) and exported as a GLB, instead of writing the GLB
+with Open3D and building a second copy for display.
+
+Meshes can be decimated to a target face count with Open3D's quadric
+decimation before conversion. Exported GLBs are cached by content key and
+served over HTTP as they are.
+"""
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Optional, Union
+
+import numpy as np
+
+from scene_summary import summarize_scene
+from splat_cache import DiskLRU
+from splat_format import atomic_write
+
+
+def decimate(mesh, target_faces: Optional[int]):
+    """Quadric decimation of an Open3D mesh down to about `target_faces` triangles"""
+    if not target_faces or len(mesh.triangles) <= target_faces:
+        return mesh
+    if not hasattr(mesh, "simplify_quadric_decimation"):
+        try:
+            import open3d as o3d
+        except ImportError:
+            print(f"Can't decimate a {type(mesh).__name__} without open3d; keeping all {len(mesh.triangles)} faces")
+            return mesh
+        # Plain arrays, e.g. a mesh returned by a generation worker process
+        arrays = mesh
+        mesh = o3d.geometry.TriangleMesh(o3d.utility.Vector3dVector(np.asarray(arrays.vertices, dtype=np.float64)),
+                                         o3d.utility.Vector3iVector(np.asarray(arrays.triangles, dtype=np.int32)))
+        if len(arrays.vertex_colors):
+            mesh.vertex_colors = o3d.utility.Vector3dVector(np.asarray(arrays.vertex_colors, dtype=np.float64))
+    return mesh.simplify_quadric_decimation(target_number_of_triangles=int(target_faces))
+
+
+def vertex_colors_rgba(colors: np.ndarray, num_vertices: int) -> np.ndarray:
+    """(N, 3) float colors in [0, 1] as (N, 4) uint8 RGBA; gray if there are none"""
+    rgba = np.full((num_vertices, 4), 255, dtype=np.uint8)
+    if len(colors):
+        rgba[:, :3] = np.clip(np.asarray(colors) * 255 + 0.5, 0, 255)
+    else:
+        rgba[:, :3] = 180
+    return rgba
+
+
+def to_trimesh(mesh, target_faces: Optional[int] = None):
+    """Convert an Open3D TriangleMesh (or anything with vertices/triangles/vertex_colors) to a trimesh"""
+    import trimesh
+
+    if isinstance(mesh, trimesh.Trimesh):
+        return mesh
+    mesh = decimate(mesh, target_faces)
+    # Views of Open3D's buffers; no per-vertex Python work
+    vertices = np.asarray(mesh.vertices)
+    faces = np.asarray(mesh.triangles)
+    colors = vertex_colors_rgba(np.asarray(mesh.vertex_colors), len(vertices))
+    # process=False skips vertex merging and validation, which dominate for large meshes
+    return trimesh.Trimesh(vertices=vertices, faces=faces, vertex_colors=colors, process=False)
+
+
+def export_glb(mesh, path: Union[str, Path]):
+    """Write a trimesh as a binary glTF, atomically"""
+    with atomic_write(path) as tmp_path, open(tmp_path, "wb") as f:
+        f.write(mesh.export(file_type="glb"))
+
+
+def load_glb(path: Union[str, Path]):
+    import trimesh
+
+    return trimesh.load(path, file_type="glb", force="mesh", process=False)
+
+
+def mesh_nbytes(mesh) -> int:
+    """Memory of the vertex, face and color buffers shown by a viewer"""
+    return int(mesh.vertices.nbytes + mesh.faces.nbytes + len(mesh.vertices) * 4)
+
+
+def mesh_summary(mesh) -> dict:
+    """Scene summary of a trimesh, treating its vertices as opaque points"""
+    vertices = np.asarray(mesh.vertices, dtype=np.float32)
+    colors = np.asarray(mesh.visual.vertex_colors)[:, :3].astype(np.float32) / 255
+    points = SimpleNamespace(centers=vertices, rgbs=colors, opacities=np.ones((len(vertices), 1), np.float32))
+    return summarize_scene(points)
+
+
+class MeshCache(DiskLRU):
+    """GLB files keyed like the splat cache, least recently used evicted beyond `max_bytes`"""
+
+    pattern = "*.glb"
+
+    def __init__(self, cache_dir: Union[str, Path], max_bytes: int = 4 * 1024 ** 3):
+        super().__init__(cache_dir, max_bytes)
+
+    def get(self, key: str) -> Optional[Path]:
+        """Path of a cached GLB, marking it as recently used, or None"""
+        return self._touch(key)
+
+    def put(self, key: str, mesh) -> Path:
+        path = self._path(key)
+        export_glb(mesh, path)
+        self._add(key, path.stat().st_size)
+        return path
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.glb"
@@ -0,0 +1,244 @@
+"""Process-wide metrics, exposed in the Prometheus text format at /metrics
+
+Hot-path stages are timed with `span(name)`, which records into the histogram
+`dream_<name>_seconds`. Counters and gauges cover everything else; gauges may
+be callbacks that are evaluated on each scrape, so the values they report
+(queue depth, live scenes) cost nothing to keep up to date.
+"""
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+PREFIX = "dream"
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BYTES_BUCKETS = tuple(2 ** power for power in range(28, 37))  # 256MB to 64GB
+
+SPAN_HELP = {
+    "load_model": "Loading the generation model",
+    "generation": "Generating a world with the backend",
+    "cache_get": "Looking up and loading a scene from the splat cache",
+    "cache_put": "Writing a scene to the splat cache",
+    "splat_conversion": "Converting a scene to validated float32 viewer arrays",
+    "mesh_conversion": "Converting (and decimating) a generated mesh to a trimesh",
+    "mesh_export": "Writing a mesh's GLB to the mesh cache",
+    "lod_build": "Building a scene's level-of-detail hierarchy",
+    "compress": "Finding or writing the quantized copy of a dream for download",
+    "summary": "Summarizing a scene: background color, bounds and start camera",
+    "viewer_start": "Starting a Viser server",
+    "viewer_load": "Loading a scene into a viewer slot",
+    "client_connect": "From a viewer client connecting until its preview splats are sent",
+    "splat_upload": "Sending one chunk of splats to one viewer client",
+    "job": "Running a generation job, from dequeue to finish",
+    "job_wait": "Time a generation job spent queued",
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((name, str(value).lower() if isinstance(value, bool) else str(value))
+                        for name, value in labels.items()))
+
+
+def _format_labels(key: LabelKey) -> str:
+    if not key:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in key) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, callback: Optional[Callable[[], Optional[float]]] = None):
+        self.name = name
+        self.help = help
+        # Reads a count kept elsewhere, instead of inc()
+        self.callback = callback
+        self.values: Dict[LabelKey, float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def samples(self):
+        if self.callback is not None:
+            value = self.callback()
+            return [] if value is None else [(self.name, (), value)]
+        with self.lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+
+class Gauge:
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, callback: Optional[Callable[[], Optional[float]]] = None):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.values: Dict[LabelKey, float] = {}
+        self.lock = threading.Lock()
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[_label_key(labels)] = value
+
+    def samples(self):
+        if self.callback is not None:
+            value = self.callback()
+            return [] if value is None else [(self.name, (), value)]
+        with self.lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # label key -> [bucket counts..., sum, count]
+        self.values: Dict[LabelKey, list] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, state in self.values.items():
+                for bound, count in zip(self.buckets, state):
+                    samples.append((f"{self.name}_bucket", key + (("le", _format_value(bound)),), count))
+                samples.append((f"{self.name}_sum", key, state[-2]))
+                samples.append((f"{self.name}_count", key, state[-1]))
+        return samples
+
+
+class Registry:
+    """Named metrics, created on first use"""
+
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+        self.lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name: str, help: str, callback=None) -> Counter:
+        return self._get_or_create(Counter, f"{PREFIX}_{name}", help, callback)
+
+    def gauge(self, name: str, help: str, callback=None) -> Gauge:
+        return self._get_or_create(Gauge, f"{PREFIX}_{name}", help, callback)
+
+    def histogram(self, name: str, help: str, buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, f"{PREFIX}_{name}", help, buckets)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                # A broken callback must not take the whole endpoint down
+                print(f"Failed to collect metric {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, key, value in samples:
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def observe_span(name: str, seconds: float, **labels):
+    """Record a stage duration in the `dream_<name>_seconds` histogram"""
+    REGISTRY.histogram(f"{name}_seconds", SPAN_HELP.get(name, name.replace("_", " "))).observe(seconds, **labels)
+
+
+@contextmanager
+def span(name: str, timings: Optional[Dict[str, float]] = None, **labels):
+    """Time a block into the `dream_<name>_seconds` histogram, even if it raises
+
+    The duration is also stored in `timings[name]` when a dict is given.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        observe_span(name, seconds, **labels)
+        if timings is not None:
+            timings[name] = seconds
+
+
+def _cuda():
+    """torch.cuda if torch is already imported and has a GPU; never imports torch itself"""
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available():
+        return None
+    return torch.cuda
+
+
+def reset_gpu_peak():
+    cuda = _cuda()
+    if cuda is not None:
+        cuda.reset_peak_memory_stats()
+
+
+def gpu_peak_bytes() -> Optional[int]:
+    """Peak GPU memory allocated since the last reset_gpu_peak()"""
+    cuda = _cuda()
+    return cuda.max_memory_allocated() if cuda is not None else None
+
+
+def record_gpu_peak(peak: int, low_vram: bool = False):
+    """Record the peak GPU memory of one generation"""
+    REGISTRY.gauge("gpu_memory_peak_bytes", "Peak GPU memory allocated by the last generation").set(peak)
+    REGISTRY.histogram(
+        "generation_gpu_peak_bytes", "Peak GPU memory allocated per generation", buckets=BYTES_BUCKETS
+    ).observe(peak, low_vram=bool(low_vram))
+
+
+def gpu_allocated_bytes() -> Optional[int]:
+    cuda = _cuda()
+    return cuda.memory_allocated() if cuda is not None else None
+
+
+def gpu_total_bytes() -> Dict[str, int]:
+    """Total memory of each GPU this process can see, by device ("cuda:0", ...)"""
+    cuda = _cuda()
+    if cuda is None:
+        return {}
+    return {f"cuda:{i}": cuda.get_device_properties(i).total_memory for i in range(cuda.device_count())}
+
+
+def record_gpu_total(total: int, device: str):
+    """Record the total memory of one GPU"""
+    REGISTRY.gauge("gpu_memory_total_bytes", "Total memory of each GPU").set(total, device=device)
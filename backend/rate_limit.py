@@ -0,0 +1,68 @@
+"""Per-client token bucket rate limiting
+
+Each client key (an API key header or the client's address) gets a bucket of
+`burst` tokens refilled at `rate` tokens per second. A request takes one token;
+without one it is rejected with the time until the next token is available,
+which the API returns as Retry-After.
+"""
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+
+@dataclass
+class TokenBucket:
+    tokens: float
+    updated_at: float
+
+
+class RateLimiter:
+    """Token buckets keyed by client; a rate of 0 disables limiting"""
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 10_000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_clients = max_clients
+        self.clock = clock
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def acquire(self, client: str, tokens: float = 1.0) -> float:
+        """Take tokens for a request; 0 if allowed, else seconds until it would be"""
+        if not self.enabled:
+            return 0.0
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                if len(self._buckets) >= self.max_clients:
+                    self._prune(now)
+                bucket = self._buckets[client] = TokenBucket(self.burst, now)
+            else:
+                bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated_at) * self.rate)
+                bucket.updated_at = now
+            if bucket.tokens >= tokens:
+                bucket.tokens -= tokens
+                return 0.0
+            return (tokens - bucket.tokens) / self.rate
+
+    def remaining(self, client: str) -> Optional[float]:
+        """Tokens a client has left right now, or None without limiting"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                return self.burst
+            return min(self.burst, bucket.tokens + (self.clock() - bucket.updated_at) * self.rate)
+
+    def _prune(self, now: float):
+        """Forget buckets that have refilled; they behave exactly like new ones"""
+        full_after = self.burst / self.rate
+        for client in [client for client, bucket in self._buckets.items() if now - bucket.updated_at >= full_after]:
+            del self._buckets[client]
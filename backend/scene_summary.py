@@ -0,0 +1,136 @@
+"""Scene summaries: what the viewer needs to know about a scene besides its splats
+
+A summary holds the background color (the mean color of the splats farthest
+from the origin), bounds, centroid, opacity histogram and a suggested start
+camera. It is computed in a single chunked pass, so memory-mapped scenes are
+never fully expanded, and the farthest splats are found with partial selection
+instead of sorting every distance. Summaries are plain JSON-serializable dicts,
+stored next to cached and library scenes so re-serving skips the analysis.
+Splats with non-finite centers or opacities are left out, so one bad gaussian
+can't turn the bounds or camera into NaNs that JSON responses reject.
+"""
+import json
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+
+from splat_convert import rows_finite
+from splat_format import atomic_write
+
+
+NUM_FARTHEST = 5
+HISTOGRAM_BINS = 10
+# Matches the viewer's original camera
+START_FOV = float(np.deg2rad(90))
+
+
+def farthest_indices(sq_norms: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest values, unordered, in O(n)"""
+    if len(sq_norms) <= k:
+        return np.arange(len(sq_norms))
+    return np.argpartition(sq_norms, -k)[-k:]
+
+
+def summarize_scene(scene, chunk_size: int = 1_000_000, num_farthest: int = NUM_FARTHEST,
+                    histogram_bins: int = HISTOGRAM_BINS) -> dict:
+    """Summarize anything with centers/rgbs/opacities arrays in one pass over chunks"""
+    centers, rgbs, opacities = scene.centers, scene.rgbs, scene.opacities
+    num_splats = len(centers)
+
+    # Running top-k of squared distances from the origin, with global indices
+    top_sq = np.empty(0, dtype=np.float64)
+    top_idx = np.empty(0, dtype=np.int64)
+    lower = np.full(3, np.inf)
+    upper = np.full(3, -np.inf)
+    center_sum = np.zeros(3)
+    histogram = np.zeros(histogram_bins, dtype=np.int64)
+    opacity_sum = 0.0
+    num_finite = 0
+    num_opacities = 0
+
+    for start in range(0, num_splats, chunk_size):
+        chunk = np.asarray(centers[start:start + chunk_size], dtype=np.float32)
+        indices = np.arange(start, start + len(chunk))
+        finite = rows_finite(chunk)
+        if not finite.all():
+            chunk, indices = chunk[finite], indices[finite]
+        num_finite += len(chunk)
+        sq = np.einsum("ij,ij->i", chunk, chunk)
+        keep = farthest_indices(sq, num_farthest)
+        top_sq = np.concatenate([top_sq, sq[keep]])
+        top_idx = np.concatenate([top_idx, indices[keep]])
+        best = farthest_indices(top_sq, num_farthest)
+        top_sq, top_idx = top_sq[best], top_idx[best]
+
+        # Reductions over contiguous columns are much faster than over axis 0 of (n, 3)
+        columns = np.ascontiguousarray(chunk.T)
+        np.minimum(lower, columns.min(axis=1), out=lower)
+        np.maximum(upper, columns.max(axis=1), out=upper)
+        center_sum += columns.sum(axis=1, dtype=np.float64)
+
+        chunk_opacities = np.asarray(opacities[start:start + chunk_size], dtype=np.float32).reshape(-1)
+        chunk_opacities = chunk_opacities[np.isfinite(chunk_opacities)]
+        num_opacities += len(chunk_opacities)
+        bins = np.clip((chunk_opacities * histogram_bins).astype(np.int64), 0, histogram_bins - 1)
+        histogram += np.bincount(bins, minlength=histogram_bins)
+        opacity_sum += float(chunk_opacities.sum(dtype=np.float64))
+
+    if num_finite == 0:
+        lower = upper = np.zeros(3)
+    top_idx = np.sort(top_idx)
+    colors = np.asarray(rgbs[top_idx], dtype=np.float32).reshape(-1, 3)
+    colors = colors[rows_finite(colors)]
+    background = colors.mean(axis=0) if len(colors) else np.zeros(3)
+    centroid = center_sum / max(num_finite, 1)
+    max_distance = float(np.sqrt(top_sq.max())) if len(top_sq) else 1.0
+
+    return {
+        "num_splats": int(num_splats),
+        "background_color": background.tolist(),
+        "bounds": {"min": lower.tolist(), "max": upper.tolist()},
+        "centroid": centroid.tolist(),
+        "max_distance": max_distance,
+        "mean_opacity": opacity_sum / max(num_opacities, 1),
+        "opacity_histogram": histogram.tolist(),
+        "start_camera": start_camera(lower, upper, centroid, max_distance),
+    }
+
+
+def start_camera(lower: np.ndarray, upper: np.ndarray, centroid: np.ndarray, max_distance: float) -> dict:
+    """Suggested first view
+
+    Generated worlds are panoramas lifted around the origin, so the camera starts
+    there, looking down the original view direction. Scenes that don't contain
+    the origin (such as imported PLYs) are viewed from their centroid instead.
+    """
+    origin_inside = bool(np.all(lower <= 0) and np.all(upper >= 0))
+    position = [0.0, 0.0, 0.0] if origin_inside else centroid.tolist()
+    return {
+        "position": position,
+        "wxyz": [1.0, 0.0, 0.0, 0.0],
+        "fov": START_FOV,
+        "near": 0.01,
+        # Leave room to see the far side of the scene from anywhere inside it
+        "far": max(2.0 * max_distance, 10.0),
+    }
+
+
+def summary_path(scene_path: Union[str, Path]) -> Path:
+    scene_path = Path(scene_path)
+    return scene_path.with_name(f"{scene_path.stem}.summary.json")
+
+
+def save_summary(scene_path: Union[str, Path], summary: dict):
+    """Store a summary next to its `.dsplat` file"""
+    with atomic_write(summary_path(scene_path)) as tmp_path, open(tmp_path, "w") as f:
+        json.dump(summary, f)
+
+
+def load_summary(scene_path: Union[str, Path]) -> Optional[dict]:
+    """The stored summary of a `.dsplat` file, or None if there isn't a readable one"""
+    try:
+        with open(summary_path(scene_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,301 @@
+"""Spatial index over splats for culling, picking and cropping
+
+`SplatIndex` is a bounding volume hierarchy over a scene's gaussians. Splats
+are sorted along a Morton (Z-order) curve of their centers and cut into leaves
+of `leaf_size` consecutive splats, so each leaf is a compact patch of the scene.
+Every `fanout` consecutive nodes of a level are grouped under one node of the
+level above, up to a single root. A node's box bounds the 3-sigma extent of its
+gaussians (a gaussian's box has half-widths of 3 sqrt(diagonal of its
+covariance)), not only their centers, so a query that rejects a box can't miss
+a visible splat inside it.
+
+Building is one sort and a few reductions. Queries walk the levels top down,
+testing every candidate node of a level at once, then test the splats of the
+leaves that are left. Results are indices into the indexed arrays.
+"""
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from splat_format import quaternions_to_matrices
+
+
+MORTON_BITS = 10
+# Gaussians are bounded at this many standard deviations
+EXTENT_SIGMAS = 3.0
+
+
+def spread_bits(values: np.ndarray) -> np.ndarray:
+    """Insert two zero bits after each of the low 10 bits"""
+    x = values.astype(np.uint32) & 0x3FF
+    x = (x | (x << 16)) & 0x030000FF
+    x = (x | (x << 8)) & 0x0300F00F
+    x = (x | (x << 4)) & 0x030C30C3
+    x = (x | (x << 2)) & 0x09249249
+    return x
+
+
+def morton_codes(centers: np.ndarray, lower: np.ndarray, upper: np.ndarray) -> np.ndarray:
+    """30-bit Z-order code of each center on a 1024^3 grid over [lower, upper]"""
+    levels = 2 ** MORTON_BITS - 1
+    scale = levels / np.maximum(upper - lower, 1e-12)
+    cells = np.clip((centers - lower) * scale.astype(np.float32), 0, levels).astype(np.uint32)
+    return spread_bits(cells[:, 0]) | (spread_bits(cells[:, 1]) << 1) | (spread_bits(cells[:, 2]) << 2)
+
+
+def splat_extents(covariances: Optional[np.ndarray] = None, covariances_triu: Optional[np.ndarray] = None,
+                  sigmas: float = EXTENT_SIGMAS) -> np.ndarray:
+    """(N, 3) half-widths of each gaussian's box, from full or upper-triangle covariances"""
+    if covariances_triu is not None:
+        # Upper triangle order is xx, xy, xz, yy, yz, zz
+        diagonal = np.asarray(covariances_triu)[:, [0, 3, 5]]
+    else:
+        diagonal = np.diagonal(np.asarray(covariances), axis1=1, axis2=2)
+    return (sigmas * np.sqrt(np.clip(diagonal, 0, None))).astype(np.float32)
+
+
+def frustum_planes(position, wxyz, fov: float, aspect: float, near: float, far: float) -> np.ndarray:
+    """(6, 4) inward planes (normal, offset) of a viser camera's view frustum
+
+    viser cameras look down +z with +y down (OpenCV convention); `fov` is the
+    vertical field of view in radians.
+    """
+    half_v = fov / 2
+    half_h = np.arctan(np.tan(half_v) * aspect)
+    normals = np.array([
+        [0, 0, 1],
+        [0, 0, -1],
+        [np.cos(half_h), 0, np.sin(half_h)],
+        [-np.cos(half_h), 0, np.sin(half_h)],
+        [0, np.cos(half_v), np.sin(half_v)],
+        [0, -np.cos(half_v), np.sin(half_v)],
+    ])
+    offsets = np.array([-near, far, 0, 0, 0, 0], dtype=np.float64)
+    rotation = quaternions_to_matrices(np.asarray(wxyz, dtype=np.float64).reshape(1, 4))[0]
+    world_normals = normals @ rotation.T
+    world_offsets = offsets - world_normals @ np.asarray(position, dtype=np.float64)
+    return np.concatenate([world_normals, world_offsets[:, None]], axis=1)
+
+
+def ranges_to_indices(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Concatenation of arange(start, end) for each range, without a Python loop"""
+    lengths = ends - starts
+    if len(lengths) == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return np.arange(lengths.sum(), dtype=np.int64) + offsets
+
+
+def boxes_overlap(lower, upper, query_lower, query_upper) -> np.ndarray:
+    return np.all((lower <= query_upper) & (upper >= query_lower), axis=1)
+
+
+def boxes_near_point(lower, upper, point, radius: float) -> np.ndarray:
+    gap = np.maximum(np.maximum(lower - point, point - upper), 0)
+    return np.einsum("ij,ij->i", gap, gap) <= radius * radius
+
+
+def boxes_in_frustum(lower, upper, planes: np.ndarray) -> np.ndarray:
+    """Boxes not entirely behind any plane (conservative near the frustum's edges)"""
+    visible = np.ones(len(lower), dtype=bool)
+    for normal, offset in zip(planes[:, :3], planes[:, 3]):
+        # The box corner furthest along the plane's normal
+        corner = np.where(normal >= 0, upper, lower)
+        visible &= corner @ normal + offset >= 0
+    return visible
+
+
+def ray_box_distances(lower, upper, origin, direction) -> np.ndarray:
+    """Distance along the ray to where it enters each box; nan where it misses"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        inverse = 1.0 / direction
+        t0 = (lower - origin) * inverse
+        t1 = (upper - origin) * inverse
+        # fmin/fmax skip the nans of axis-parallel rays starting on a slab boundary
+        near = np.fmax.reduce(np.fmin(t0, t1), axis=1)
+        far = np.fmin.reduce(np.fmax(t0, t1), axis=1)
+    near = np.maximum(near, 0)
+    # nan rather than inf, so misses fail every distance test, even against an unbounded max_distance
+    return np.where(near <= far, near, np.nan)
+
+
+class SplatIndex:
+    """Bounding volume hierarchy over splat centers and extents; see the module docstring"""
+
+    def __init__(self, order: np.ndarray, centers: np.ndarray, extents: np.ndarray,
+                 lowers: list, uppers: list, leaf_size: int, fanout: int):
+        # Index into the original arrays of each sorted splat
+        self.order = order
+        self.centers = centers
+        self.extents = extents
+        # Node boxes per level, leaves first
+        self.lowers = lowers
+        self.uppers = uppers
+        self.leaf_size = leaf_size
+        self.fanout = fanout
+
+    @classmethod
+    def build(cls, centers: np.ndarray, covariances: Optional[np.ndarray] = None,
+              covariances_triu: Optional[np.ndarray] = None, extents: Optional[np.ndarray] = None,
+              leaf_size: int = 512, fanout: int = 8) -> "SplatIndex":
+        """Index a scene's centers, bounding each gaussian by its covariance (or given extents)"""
+        centers = np.asarray(centers, dtype=np.float32)
+        if extents is None:
+            if covariances is None and covariances_triu is None:
+                extents = np.zeros_like(centers)
+            else:
+                extents = splat_extents(covariances, covariances_triu)
+        num_splats = len(centers)
+        if num_splats == 0:
+            empty = np.zeros((0, 3), dtype=np.float32)
+            return cls(np.zeros(0, dtype=np.int32), empty, empty, [empty], [empty], leaf_size, fanout)
+
+        codes = morton_codes(centers, centers.min(axis=0), centers.max(axis=0))
+        # int32 keeps the index at 28 bytes per splat
+        order = np.argsort(codes, kind="stable").astype(np.int32 if num_splats < 2 ** 31 else np.int64)
+        centers = centers[order]
+        extents = np.asarray(extents, dtype=np.float32)[order]
+
+        starts = np.arange(0, num_splats, leaf_size)
+        lowers = [np.minimum.reduceat(centers - extents, starts, axis=0)]
+        uppers = [np.maximum.reduceat(centers + extents, starts, axis=0)]
+        while len(lowers[-1]) > 1:
+            starts = np.arange(0, len(lowers[-1]), fanout)
+            lowers.append(np.minimum.reduceat(lowers[-1], starts, axis=0))
+            uppers.append(np.maximum.reduceat(uppers[-1], starts, axis=0))
+        return cls(order, centers, extents, lowers, uppers, leaf_size, fanout)
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], **options) -> "SplatIndex":
+        """Index a dict of splat arrays (as served by the viewer pool)"""
+        if "covariances" in arrays:
+            return cls.build(arrays["centers"], covariances=arrays["covariances"], **options)
+        return cls.build(arrays["centers"], covariances_triu=arrays["covariances_triu"], **options)
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    @property
+    def num_leaves(self) -> int:
+        return len(self.lowers[0])
+
+    @property
+    def nbytes(self) -> int:
+        boxes = sum(lower.nbytes + upper.nbytes for lower, upper in zip(self.lowers, self.uppers))
+        return self.order.nbytes + self.centers.nbytes + self.extents.nbytes + boxes
+
+    @property
+    def bounds(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Box around every gaussian's extent"""
+        return self.lowers[-1][0], self.uppers[-1][0]
+
+    def leaves(self, test: Callable) -> np.ndarray:
+        """Leaves whose boxes pass `test(lower, upper) -> bool mask`, walking down from the root"""
+        if len(self) == 0:
+            return np.zeros(0, dtype=np.int64)
+        nodes = np.arange(len(self.lowers[-1]))
+        for level in range(len(self.lowers) - 1, -1, -1):
+            nodes = nodes[test(self.lowers[level][nodes], self.uppers[level][nodes])]
+            if level == 0 or len(nodes) == 0:
+                break
+            children = (nodes[:, None] * self.fanout + np.arange(self.fanout)).reshape(-1)
+            nodes = children[children < len(self.lowers[level - 1])]
+        return nodes
+
+    def leaf_ranges(self, leaves: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Sorted-order [start, end) of each leaf's splats"""
+        starts = np.asarray(leaves, dtype=np.int64) * self.leaf_size
+        return starts, np.minimum(starts + self.leaf_size, len(self))
+
+    def leaf_splats(self, leaves: np.ndarray) -> np.ndarray:
+        """Original indices of every splat in the given leaves"""
+        return self.order[ranges_to_indices(*self.leaf_ranges(leaves))]
+
+    def _query(self, test: Callable, centers_only: bool = False) -> np.ndarray:
+        """Original indices of splats whose boxes (or centers) pass `test`"""
+        sorted_indices = ranges_to_indices(*self.leaf_ranges(self.leaves(test)))
+        centers = self.centers[sorted_indices]
+        if centers_only:
+            keep = test(centers, centers)
+        else:
+            extents = self.extents[sorted_indices]
+            keep = test(centers - extents, centers + extents)
+        return self.order[sorted_indices[keep]]
+
+    def query_box(self, lower, upper, centers_only: bool = False) -> np.ndarray:
+        """Splats whose extent overlaps the box; with `centers_only`, those centered inside it"""
+        lower = np.asarray(lower, dtype=np.float32)
+        upper = np.asarray(upper, dtype=np.float32)
+        return self._query(lambda lo, hi: boxes_overlap(lo, hi, lower, upper), centers_only)
+
+    def query_radius(self, point, radius: float, centers_only: bool = False) -> np.ndarray:
+        """Splats whose extent comes within `radius` of a point; with `centers_only`, whose centers do"""
+        point = np.asarray(point, dtype=np.float32)
+        return self._query(lambda lo, hi: boxes_near_point(lo, hi, point, radius), centers_only)
+
+    def query_frustum(self, planes: np.ndarray) -> np.ndarray:
+        """Splats that may be visible in a view frustum (see `frustum_planes`)"""
+        return self._query(lambda lo, hi: boxes_in_frustum(lo, hi, planes))
+
+    def frustum_leaves(self, planes: np.ndarray) -> np.ndarray:
+        """Leaves that may be visible in a view frustum, for streaming whole leaves"""
+        return self.leaves(lambda lo, hi: boxes_in_frustum(lo, hi, planes))
+
+    def view_order(self, planes: np.ndarray, position=None) -> np.ndarray:
+        """Every splat, those in leaves visible in the frustum first (nearest leaves first with `position`)"""
+        visible = np.zeros(self.num_leaves, dtype=bool)
+        visible[self.frustum_leaves(planes)] = True
+        in_view = np.nonzero(visible)[0]
+        if position is not None:
+            middles = (self.lowers[0][in_view] + self.uppers[0][in_view]) / 2
+            in_view = in_view[np.argsort(np.linalg.norm(middles - np.asarray(position, dtype=np.float32), axis=1))]
+        return self.leaf_splats(np.concatenate([in_view, np.nonzero(~visible)[0]]))
+
+    def query_ray(self, origin, direction, max_distance: float = np.inf) -> Tuple[np.ndarray, np.ndarray]:
+        """Splats whose extent the ray passes through, nearest first, with their distances
+
+        The distance is to the point on the ray closest to the splat's center
+        (or to where the ray enters its box, if that is further).
+        """
+        origin, direction = self._ray(origin, direction)
+        leaves = self.leaves(lambda lo, hi: ray_box_distances(lo, hi, origin, direction) <= max_distance)
+        return self._ray_hits(leaves, origin, direction, max_distance)
+
+    def pick(self, origin, direction, opacities: np.ndarray, min_opacity: float = 0.3,
+             max_distance: float = np.inf, batch_leaves: int = 8) -> Optional[Tuple[int, float]]:
+        """Nearest splat along a ray that is opaque enough to be what a click landed on, or None
+
+        Leaves are searched front to back, stopping once the rest start beyond the best hit.
+        """
+        origin, direction = self._ray(origin, direction)
+        opacities = np.asarray(opacities).reshape(-1)
+        leaves = self.leaves(lambda lo, hi: ray_box_distances(lo, hi, origin, direction) <= max_distance)
+        entries = ray_box_distances(self.lowers[0][leaves], self.uppers[0][leaves], origin, direction)
+        leaves = leaves[np.argsort(entries, kind="stable")]
+        entries = np.sort(entries)
+        best = None
+        for start in range(0, len(leaves), batch_leaves):
+            if best is not None and entries[start] > best[1]:
+                break
+            indices, distances = self._ray_hits(leaves[start:start + batch_leaves], origin, direction, max_distance)
+            opaque = opacities[indices] >= min_opacity
+            if opaque.any():
+                first = int(np.argmax(opaque))
+                if best is None or distances[first] < best[1]:
+                    best = (int(indices[first]), float(distances[first]))
+        return best
+
+    @staticmethod
+    def _ray(origin, direction) -> Tuple[np.ndarray, np.ndarray]:
+        direction = np.asarray(direction, dtype=np.float64)
+        return np.asarray(origin, dtype=np.float64), direction / np.linalg.norm(direction)
+
+    def _ray_hits(self, leaves: np.ndarray, origin, direction, max_distance: float):
+        sorted_indices = ranges_to_indices(*self.leaf_ranges(leaves))
+        centers = self.centers[sorted_indices]
+        extents = self.extents[sorted_indices]
+        entry = ray_box_distances(centers - extents, centers + extents, origin, direction)
+        hit = entry <= max_distance
+        distances = np.maximum((centers[hit] - origin) @ direction, entry[hit])
+        nearest = np.argsort(distances, kind="stable")
+        return self.order[sorted_indices[hit][nearest]], distances[nearest]
@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Union
+
+from scene_summary import load_summary, save_summary, summary_path
+from splat_format import SplatArrays, load_splat, save_splat
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Fold case, whitespace and trailing punctuation so trivially different prompts match"""
+    return " ".join(prompt.lower().split()).strip(" .!?")
+
+
+def cache_key(
+    prompt: str,
+    mode: str,
+    resolution: int,
+    inpaint_bg: bool,
+    seed: Optional[int] = None,
+    **extra,
+) -> str:
+    """Content hash of everything that determines a generated scene
+
+    `extra` carries additional inputs such as a hash of the conditioning image.
+    """
+    params = {
+        "prompt": normalize_prompt(prompt or ""),
+        "mode": mode,
+        "resolution": resolution,
+        "inpaint_bg": bool(inpaint_bg),
+        "seed": seed,
+        **extra,
+    }
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def file_digest(path: Union[str, Path]) -> str:
+    """SHA-256 of a file's contents, for keying image-conditioned generations"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DiskLRU:
+    """Files keyed by content hash in one directory, least recently used deleted beyond `max_bytes`
+
+    Subclasses say where an entry lives (`_path`), which other files go with it
+    (`_files`) and how to find entries on startup (`pattern`). File modification
+    times record last use, so recency survives restarts.
+    """
+
+    pattern = "*"
+
+    def __init__(self, cache_dir: Union[str, Path], max_bytes: int):
+        self.cache_dir = Path(cache_dir).expanduser()
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> (size in bytes, last use time)
+        self._index: Dict[str, tuple] = {}
+        # Total size of the entries in the index
+        self._bytes = 0
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        for path in self.cache_dir.glob(self.pattern):
+            stat = path.stat()
+            self._index[self._key(path)] = (stat.st_size, stat.st_mtime)
+            self._bytes += stat.st_size
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._index
+
+    def _touch(self, key: str) -> Optional[Path]:
+        """Mark an entry as recently used and return its path, or None if it isn't cached"""
+        with self._lock:
+            if key not in self._index:
+                return None
+            now = time.time()
+            self._index[key] = (self._index[key][0], now)
+        path = self._path(key)
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        return path
+
+    def _add(self, key: str, size: int):
+        """Record a newly written entry, then evict others until the cache fits its budget"""
+        with self._lock:
+            if key in self._index:
+                self._bytes -= self._index[key][0]
+            self._index[key] = (size, time.time())
+            self._bytes += size
+            self._evict(keep=key)
+
+    def _key(self, path: Path) -> str:
+        return path.stem
+
+    def _path(self, key: str) -> Path:
+        raise NotImplementedError
+
+    def _files(self, key: str) -> Iterable[Path]:
+        """Every file belonging to an entry, deleted with it"""
+        return (self._path(key),)
+
+    def _size(self) -> int:
+        return self._bytes
+
+    def _evict(self, keep: Optional[str] = None):
+        """Delete least recently used entries, other than `keep`, until the cache fits its budget"""
+        total = self._size()
+        for key, (size, _) in sorted(self._index.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self._remove(key)
+            total -= size
+
+    def _remove(self, key: str):
+        entry = self._index.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[0]
+        for path in self._files(key):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class SplatCache(DiskLRU):
+    """Content-addressed on-disk cache of generated scenes with size-bounded LRU eviction
+
+    Entries are `.dsplat` files at `<cache_dir>/<key[:2]>/<key>.dsplat` and are
+    memory-mapped on a hit. File modification times record last use, so recency
+    survives restarts. With a `splat_compress.Compression`, entries are stored
+    quantized: about a third of the size, but decoded rather than mapped on a hit.
+    """
+
+    pattern = "*/*.dsplat"
+
+    def __init__(self, cache_dir: Union[str, Path], max_bytes: int = 20 * 1024 ** 3, compression=None):
+        super().__init__(cache_dir, max_bytes)
+        self.compression = compression
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[SplatArrays]:
+        """Load a cached scene, or None on a miss"""
+        path = self._path(key)
+        with self._lock:
+            if key not in self._index:
+                self.misses += 1
+                return None
+        try:
+            splat = load_splat(path)
+        except (OSError, KeyError, ValueError) as e:
+            print(f"Dropping unreadable cache entry {key}: {e}")
+            with self._lock:
+                self._remove(key)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        self._touch(key)
+        return splat
+
+    def put(self, key: str, splat) -> SplatArrays:
+        """Store a scene and return it as float32 arrays ready to serve"""
+        arrays = SplatArrays.from_splat(splat)
+        if arrays.nbytes > self.max_bytes:
+            return arrays
+
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        save_splat(path, arrays, compression=self.compression)
+        self._add(key, path.stat().st_size)
+        return arrays
+
+    def summary(self, key: str) -> Optional[dict]:
+        """Stored scene summary of a cached scene, or None"""
+        path = self.path(key)
+        return load_summary(path) if path is not None else None
+
+    def set_summary(self, key: str, summary: dict):
+        """Store a scene summary next to a cached scene"""
+        path = self.path(key)
+        if path is not None:
+            save_summary(path, summary)
+
+    def path(self, key: str) -> Optional[Path]:
+        """File holding a cached scene, or None if it isn't cached"""
+        with self._lock:
+            return self._path(key) if key in self._index else None
+
+    def stats(self) -> dict:
+        # Only reads counters, without the lock, so health checks never wait on a cache write
+        hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "entries": len(self._index),
+            "size_mb": round(self._size() / 1024 ** 2, 1),
+            "max_size_mb": round(self.max_bytes / 1024 ** 2, 1),
+        }
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.dsplat"
+
+    def _files(self, key: str) -> Iterable[Path]:
+        return (self._path(key), summary_path(self._path(key)))
@@ -0,0 +1,268 @@
+"""Quantized scene encoding for storage and transfer
+
+Full float32 splats take 64 bytes each (centers, rgbs, opacity and a 3x3
+covariance). The quantized encoding stores instead:
+
+    centers     3 x uint16 over the scene bounds
+    scales      3 x uint8/uint16 in log space
+    rotations   4 x int8/int16 wxyz quaternion, covariance = R S S^T R^T
+    opacities   1 x uint8/uint16
+    rgbs        3 x uint8, or a 1-2 byte index into a k-means color palette
+
+which is 14 to 24 bytes per splat. Bit widths are picked per attribute as the
+smallest that keeps the worst-case quantization error within an `ErrorBudget`;
+an attribute whose budget even 16 bits can't meet is stored as float32 instead.
+`roundtrip_errors` measures what a scene actually lost.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from splat_convert import convert_splats
+from splat_format import (
+    SplatArrays,
+    covariances_to_scale_rotation,
+    covariances_to_triu,
+    scale_rotation_to_covariances,
+)
+
+
+ENCODING = "quantized"
+CHUNK_SIZE = 262_144
+KMEANS_SAMPLE = 65_536
+KMEANS_ITERATIONS = 12
+
+
+@dataclass
+class ErrorBudget:
+    """Largest quantization error allowed per attribute"""
+
+    # Center error, as a fraction of the scene's largest bounding box side
+    position: float = 1e-4
+    # Relative error of each gaussian's axis lengths
+    scale: float = 0.01
+    # Error of each quaternion component, about half the rotation error in radians
+    rotation: float = 0.005
+    opacity: float = 1 / 255
+    # RMS color error; also decides whether a palette is accurate enough to use
+    color: float = 0.02
+
+
+@dataclass
+class Compression:
+    """How to encode a scene: an error budget and an optional color palette size"""
+
+    budget: ErrorBudget = field(default_factory=ErrorBudget)
+    # 0 stores 8-bit RGB; up to 65536 stores palette indices instead
+    palette_size: int = 0
+
+
+def unsigned_bits(value_range: float, max_error: float) -> Optional[int]:
+    """Fewest of 8 or 16 bits whose rounding error over `value_range` stays within `max_error`"""
+    for bits in (8, 16):
+        if value_range / (2 * (2 ** bits - 1)) <= max_error:
+            return bits
+    return None
+
+
+def quantize(values: np.ndarray, low, high, bits: int) -> np.ndarray:
+    levels = 2 ** bits - 1
+    span = np.maximum(np.asarray(high) - np.asarray(low), 1e-30)
+    q = np.rint((values - low) / span * levels)
+    return np.clip(q, 0, levels).astype(np.uint8 if bits == 8 else np.uint16)
+
+
+def dequantize(q: np.ndarray, low, high, bits: int) -> np.ndarray:
+    levels = 2 ** bits - 1
+    return (np.asarray(low) + q.astype(np.float64) * ((np.asarray(high) - np.asarray(low)) / levels)).astype(np.float32)
+
+
+def kmeans_palette(colors: np.ndarray, size: int, seed: int = 0) -> np.ndarray:
+    """(size, 3) palette fit with Lloyd's algorithm on a sample of the colors"""
+    rng = np.random.default_rng(seed)
+    sample = colors[rng.choice(len(colors), min(len(colors), KMEANS_SAMPLE), replace=False)].astype(np.float32)
+    size = min(size, len(sample))
+    palette = sample[rng.choice(len(sample), size, replace=False)]
+    for _ in range(KMEANS_ITERATIONS):
+        labels = nearest_colors(sample, palette)
+        counts = np.bincount(labels, minlength=size)
+        sums = np.stack([np.bincount(labels, weights=sample[:, i], minlength=size) for i in range(3)], axis=1)
+        used = counts > 0
+        palette[used] = (sums[used] / counts[used, None]).astype(np.float32)
+    return palette
+
+
+def nearest_colors(colors: np.ndarray, palette: np.ndarray, chunk_size: int = 16_384) -> np.ndarray:
+    """Index of the closest palette entry for each color"""
+    labels = np.empty(len(colors), dtype=np.int64)
+    palette_sq = (palette * palette).sum(axis=1)
+    for start in range(0, len(colors), chunk_size):
+        chunk = np.asarray(colors[start:start + chunk_size], dtype=np.float32)
+        # |c - p|^2 without the |c|^2 term, which doesn't change the argmin
+        labels[start:start + chunk_size] = np.argmin(palette_sq - 2 * chunk @ palette.T, axis=1)
+    return labels
+
+
+def encode_splats(splat, compression: Optional[Compression] = None) -> Tuple[Dict[str, np.ndarray], dict]:
+    """Quantized columns and the metadata needed to decode them
+
+    Invalid gaussians are dropped first (see `splat_convert`), so bounds and
+    ranges are finite.
+    """
+    compression = compression or Compression()
+    budget = compression.budget
+    arrays, _ = convert_splats(splat)
+    centers, rgbs = arrays["centers"], arrays["rgbs"]
+    opacities, covariances = arrays["opacities"], arrays["covariances"]
+    num_splats = len(centers)
+
+    columns = {}
+    metadata = {"encoding": ENCODING, "budget": asdict(budget)}
+
+    lower = centers.min(axis=0).astype(np.float64) if num_splats else np.zeros(3)
+    upper = centers.max(axis=0).astype(np.float64) if num_splats else np.zeros(3)
+    center_bits = unsigned_bits(1.0, budget.position)
+    if center_bits is None:
+        columns["centers"] = centers
+    else:
+        columns["centers"] = quantize(centers, lower, upper, center_bits)
+    metadata["centers"] = {"bits": center_bits, "min": lower.tolist(), "max": upper.tolist()}
+
+    # Scales and rotations, decomposed one chunk at a time; eigh releases the GIL
+    log_scales = np.empty((num_splats, 3), dtype=np.float32)
+    quaternions = np.empty((num_splats, 4), dtype=np.float32)
+
+    def decompose(start: int):
+        scales, q = covariances_to_scale_rotation(covariances[start:start + CHUNK_SIZE])
+        # q and -q are the same rotation; keep w >= 0
+        q *= np.where(q[:, :1] < 0, -1.0, 1.0)
+        log_scales[start:start + CHUNK_SIZE] = np.log(scales)
+        quaternions[start:start + CHUNK_SIZE] = q
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+        list(executor.map(decompose, range(0, num_splats, CHUNK_SIZE)))
+
+    log_low = float(log_scales.min()) if num_splats else 0.0
+    log_high = float(log_scales.max()) if num_splats else 0.0
+    # log_scales are logs of axis lengths (not variances): an error of d scales an axis by up to exp(d)
+    scale_bits = unsigned_bits(log_high - log_low, np.log1p(budget.scale))
+    if scale_bits is None:
+        columns["scales"] = log_scales
+    else:
+        columns["scales"] = quantize(log_scales, log_low, log_high, scale_bits)
+    metadata["scales"] = {"bits": scale_bits, "log_min": log_low, "log_max": log_high}
+
+    # Signed components over [-1, 1] round to within 1 / (2 * levels)
+    rotation_bits = next((bits for bits in (8, 16) if 1 / (2 * (2 ** (bits - 1) - 1)) <= budget.rotation), None)
+    if rotation_bits is None:
+        columns["rotations"] = quaternions
+    else:
+        levels = 2 ** (rotation_bits - 1) - 1
+        columns["rotations"] = np.rint(quaternions * levels).astype(np.int8 if rotation_bits == 8 else np.int16)
+    metadata["rotations"] = {"bits": rotation_bits}
+
+    opacity_bits = unsigned_bits(1.0, budget.opacity)
+    if opacity_bits is None:
+        columns["opacities"] = opacities
+    else:
+        columns["opacities"] = quantize(np.clip(opacities, 0, 1), 0.0, 1.0, opacity_bits)
+    metadata["opacities"] = {"bits": opacity_bits}
+
+    palette = None
+    if compression.palette_size > 0 and num_splats:
+        palette = kmeans_palette(rgbs, min(compression.palette_size, 65536))
+        labels = nearest_colors(rgbs, palette)
+        rms = float(np.sqrt(np.mean((palette[labels] - rgbs) ** 2)))
+        if rms <= budget.color:
+            columns["palette_index"] = labels.astype(np.uint8 if len(palette) <= 256 else np.uint16).reshape(-1, 1)
+            metadata["palette"] = palette.tolist()
+        else:
+            print(f"Color palette error {rms:.4f} exceeds the budget ({budget.color}); storing RGB")
+            palette = None
+    if palette is None:
+        # The worst-case error bounds the RMS error
+        rgb_bits = unsigned_bits(1.0, budget.color)
+        if rgb_bits is None:
+            columns["rgbs"] = rgbs
+        else:
+            columns["rgbs"] = quantize(np.clip(rgbs, 0, 1), 0.0, 1.0, rgb_bits)
+        metadata["rgbs"] = {"bits": rgb_bits}
+    return columns, metadata
+
+
+def decode_splats(columns: Dict[str, np.ndarray], metadata: dict) -> SplatArrays:
+    """Float32 SplatArrays from `encode_splats` output"""
+    if metadata.get("encoding") != ENCODING:
+        raise ValueError(f"Unknown splat encoding {metadata.get('encoding')!r}")
+    centers_meta = metadata["centers"]
+    if centers_meta["bits"] is None:
+        centers = np.asarray(columns["centers"], dtype=np.float32)
+    else:
+        centers = dequantize(columns["centers"], centers_meta["min"], centers_meta["max"], centers_meta["bits"])
+    num_splats = len(centers)
+
+    scales_meta = metadata["scales"]
+    rotation_bits = metadata["rotations"]["bits"]
+    levels = 2 ** (rotation_bits - 1) - 1 if rotation_bits is not None else 1
+    covariances_triu = np.empty((num_splats, 6), dtype=np.float32)
+    for start in range(0, num_splats, CHUNK_SIZE):
+        end = start + CHUNK_SIZE
+        log_scales = columns["scales"][start:end]
+        if scales_meta["bits"] is not None:
+            log_scales = dequantize(log_scales, scales_meta["log_min"], scales_meta["log_max"], scales_meta["bits"])
+        quaternions = columns["rotations"][start:end].astype(np.float64) / levels
+        covariances = scale_rotation_to_covariances(np.exp(log_scales.astype(np.float64)), quaternions)
+        covariances_triu[start:end] = covariances_to_triu(covariances)
+
+    if "palette_index" in columns:
+        palette = np.asarray(metadata["palette"], dtype=np.float32)
+        rgbs = palette[np.asarray(columns["palette_index"]).reshape(-1)]
+    else:
+        # Files written before the width was recorded always used 8 bits
+        rgb_bits = metadata.get("rgbs", {"bits": 8})["bits"]
+        rgbs = columns["rgbs"]
+        rgbs = dequantize(rgbs, 0.0, 1.0, rgb_bits) if rgb_bits is not None else np.asarray(rgbs, dtype=np.float32)
+    opacity_bits = metadata["opacities"]["bits"]
+    opacities = columns["opacities"]
+    if opacity_bits is not None:
+        opacities = dequantize(opacities, 0.0, 1.0, opacity_bits)
+    else:
+        opacities = np.asarray(opacities, dtype=np.float32)
+    return SplatArrays(centers=centers, rgbs=rgbs, opacities=opacities, covariances_triu=covariances_triu)
+
+
+def encoded_nbytes(columns: Dict[str, np.ndarray]) -> int:
+    return sum(column.nbytes for column in columns.values())
+
+
+def roundtrip_errors(original, decoded) -> Dict[str, float]:
+    """Worst-case (and RMS color) error between a validated scene and its decoded copy
+
+    `original` must have no invalid gaussians, so the two line up splat for splat.
+    """
+    original = SplatArrays.from_splat(original)
+    centers = np.asarray(original.centers, dtype=np.float32)
+    if len(centers) != len(decoded):
+        raise ValueError(f"Scenes differ in size ({len(centers)} vs {len(decoded)} splats)")
+    if len(centers) == 0:
+        return {}
+    extent = float((centers.max(axis=0) - centers.min(axis=0)).max()) or 1.0
+
+    covariance_error = 0.0
+    for start in range(0, len(centers), CHUNK_SIZE):
+        end = start + CHUNK_SIZE
+        a = original.covariances_slice(start, end).astype(np.float64)
+        b = decoded.covariances_slice(start, end).astype(np.float64)
+        relative = np.linalg.norm(a - b, axis=(1, 2)) / np.linalg.norm(a, axis=(1, 2))
+        covariance_error = max(covariance_error, float(relative.max()))
+
+    rgbs = np.asarray(original.rgbs, dtype=np.float32)
+    return {
+        "position_error": float(np.abs(decoded.centers - centers).max()) / extent,
+        "covariance_error": covariance_error,
+        "opacity_error": float(np.abs(decoded.opacities - np.asarray(original.opacities, dtype=np.float32)).max()),
+        "color_rms_error": float(np.sqrt(np.mean((decoded.rgbs - rgbs) ** 2))),
+    }
@@ -0,0 +1,130 @@
+"""Chunked, parallel conversion of scenes to the viewer's float32 arrays
+
+Scenes arrive as SplatFiles (torch tensors, possibly BFloat16 and on the GPU),
+in-memory SplatArrays or memory-mapped `.dsplat` files. `convert_splats` reads
+them in fixed-size chunks on a thread pool, so only a few chunks are ever
+expanded to float32/float64 temporaries at once, and writes each chunk straight
+into preallocated output buffers. Invalid gaussians are dropped in the same pass:
+
+- non_finite: a NaN or infinite center, color, opacity or covariance entry
+- non_psd:    a covariance that is not positive definite (a degenerate or
+              impossible ellipsoid, which renders as garbage or not at all)
+- transparent: opacity below `min_opacity`, invisible at 8-bit precision
+
+NumPy releases the GIL for the arithmetic here, so threads scale across cores
+without copying scene-sized arrays between processes.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+DEFAULT_CHUNK_SIZE = 262_144
+MIN_OPACITY = 1 / 255
+DROP_REASONS = ("non_finite", "non_psd", "transparent")
+
+
+def to_float32(values) -> np.ndarray:
+    """A chunk of a NumPy array or torch tensor as a float32 NumPy array"""
+    if hasattr(values, "detach"):
+        # Torch tensor: convert on its device so BFloat16 never reaches NumPy
+        return values.detach().float().cpu().numpy()
+    return np.asarray(values, dtype=np.float32)
+
+
+def covariance_chunk(splat, start: int, end: int):
+    if hasattr(splat, "covariances_slice"):
+        # SplatArrays: expands only this chunk of a stored upper triangle
+        return splat.covariances_slice(start, end)
+    return splat.covariances[start:end]
+
+
+def check_covariances(covariances: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Finite and positive definite (Sylvester's criterion) masks of (n, 3, 3) covariances
+
+    Works on contiguous float64 columns: elementwise arithmetic on those is several
+    times faster than reductions along the short last axis of (n, 9).
+    """
+    a, b, c, d, e, f, g, h, i = np.ascontiguousarray(covariances.reshape(-1, 9).T, dtype=np.float64)
+    with np.errstate(invalid="ignore", over="ignore"):
+        # Any NaN or infinity makes the sum non-finite
+        finite = np.isfinite(a + b + c + d + e + f + g + h + i)
+        minor2 = a * e - b * d
+        det = a * (e * i - f * h) - b * (d * i - f * g) + c * (d * h - e * g)
+    return finite, (a > 0) & (minor2 > 0) & (det > 0)
+
+
+def rows_finite(values: np.ndarray) -> np.ndarray:
+    """Rows of an (n, 3) array without NaNs or infinities"""
+    with np.errstate(invalid="ignore", over="ignore"):
+        return np.isfinite(values[:, 0] + values[:, 1] + values[:, 2])
+
+
+def convert_splats(
+    splat,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    num_workers: Optional[int] = None,
+    min_opacity: float = MIN_OPACITY,
+) -> Tuple[Dict[str, np.ndarray], Dict[str, int]]:
+    """Validated float32 arrays for add_gaussian_splats, and the number of splats dropped per reason"""
+    num_splats = len(splat.centers)
+    out = {
+        "centers": np.empty((num_splats, 3), dtype=np.float32),
+        "rgbs": np.empty((num_splats, 3), dtype=np.float32),
+        "opacities": np.empty((num_splats, 1), dtype=np.float32),
+        "covariances": np.empty((num_splats, 3, 3), dtype=np.float32),
+    }
+
+    def convert(start: int) -> Tuple[int, Dict[str, int]]:
+        end = min(start + chunk_size, num_splats)
+        centers = to_float32(splat.centers[start:end]).reshape(-1, 3)
+        rgbs = to_float32(splat.rgbs[start:end]).reshape(-1, 3)
+        opacities = to_float32(splat.opacities[start:end]).reshape(-1, 1)
+        covariances = to_float32(covariance_chunk(splat, start, end)).reshape(-1, 3, 3)
+
+        covariances_finite, psd = check_covariances(covariances)
+        finite = covariances_finite & rows_finite(centers) & rows_finite(rgbs) & np.isfinite(opacities[:, 0])
+        # Each dropped splat is counted under its first failing check only
+        psd |= ~finite
+        opaque = (opacities[:, 0] >= min_opacity) | ~finite | ~psd
+        keep = finite & psd & opaque
+        dropped = {
+            "non_finite": int((~finite).sum()),
+            "non_psd": int((~psd).sum()),
+            "transparent": int((~opaque).sum()),
+        }
+
+        # Valid rows go to the front of this chunk's slot; compacted once all chunks are done
+        kept = int(keep.sum())
+        if kept == end - start:
+            parts = (centers, rgbs, opacities, covariances)
+        else:
+            parts = (centers[keep], rgbs[keep], opacities[keep], covariances[keep])
+        for name, part in zip(("centers", "rgbs", "opacities", "covariances"), parts):
+            out[name][start:start + kept] = part
+        return kept, dropped
+
+    starts = range(0, num_splats, chunk_size)
+    num_workers = num_workers or os.cpu_count() or 1
+    if num_workers > 1 and len(starts) > 1:
+        with ThreadPoolExecutor(max_workers=min(num_workers, len(starts))) as executor:
+            results = list(executor.map(convert, starts))
+    else:
+        results = [convert(start) for start in starts]
+
+    dropped = dict.fromkeys(DROP_REASONS, 0)
+    offset = 0
+    for start, (kept, chunk_dropped) in zip(starts, results):
+        if offset != start:
+            # Moves rows toward the front; NumPy handles the overlap
+            for array in out.values():
+                array[offset:offset + kept] = array[start:start + kept]
+        offset += kept
+        for reason, count in chunk_dropped.items():
+            dropped[reason] += count
+
+    if offset < num_splats:
+        out = {name: array[:offset] for name, array in out.items()}
+    return out, dropped
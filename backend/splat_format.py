@@ -0,0 +1,407 @@
+"""Compact columnar storage for gaussian splat scenes
+
+A `.dsplat` file is a fixed header followed by one column per attribute:
+
+    header   magic (8s) | version (u32) | num_columns (u32) | num_splats (u64)
+    columns  num_columns x [name (16s) | dtype (4s) | components (u32) | offset (u64)]
+    data     each column as a contiguous little-endian (num_splats, components) array,
+             starting on a 64-byte boundary
+
+Covariances are symmetric, so only their upper triangle (xx, xy, xz, yy, yz, zz)
+is stored, and colors are float16 by default. Files are opened with `np.memmap`,
+so opening one reads nothing; the pages of a column are read when it is used.
+The viewer still copies every scene it serves: `ViewerPool.serve` validates it
+and expands it into float32 arrays one chunk at a time (see `splat_convert`).
+Scenes are revalidated even on a cache hit, because `demo.py` and batch runs
+store scenes in the same cache without validating them.
+
+Version 2 files hold a quantized scene (see `splat_compress`): the column table
+is followed by a metadata block, length (u32) | UTF-8 JSON, with what is needed
+to decode the columns. Uncompressed scenes are still written as version 1.
+"""
+import json
+import os
+import struct
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Union
+
+import numpy as np
+
+
+MAGIC = b"DRMSPLT\x00"
+VERSION = 2
+ALIGNMENT = 64
+HEADER = struct.Struct("<8sIIQ")
+COLUMN = struct.Struct("<16s4sIQ")
+METADATA_LENGTH = struct.Struct("<I")
+
+# Upper triangle of a row-major 3x3 matrix, and where each of the 9 entries comes from
+TRIU_INDICES = (0, 1, 2, 4, 5, 8)
+TRIU_TO_FULL = (0, 1, 2, 1, 3, 4, 2, 4, 5)
+
+# Spherical harmonics DC coefficient used by 3DGS PLY files
+SH_C0 = 0.28209479177387814
+
+
+def covariances_to_triu(covariances: np.ndarray) -> np.ndarray:
+    """(N, 3, 3) covariances -> (N, 6) upper triangles"""
+    return np.asarray(covariances).reshape(-1, 9)[:, TRIU_INDICES]
+
+
+def triu_to_covariances(triu: np.ndarray) -> np.ndarray:
+    """(N, 6) upper triangles -> (N, 3, 3) float32 covariances"""
+    return np.asarray(triu, dtype=np.float32)[:, TRIU_TO_FULL].reshape(-1, 3, 3)
+
+
+class SplatArrays:
+    """Gaussian splat attributes as (possibly memory-mapped) NumPy arrays
+
+    Has the same `centers`/`rgbs`/`opacities`/`covariances` attributes as a
+    SplatFile, so it can be served or cached in its place.
+    """
+
+    def __init__(
+        self,
+        centers: np.ndarray,
+        rgbs: np.ndarray,
+        opacities: np.ndarray,
+        covariances: Optional[np.ndarray] = None,
+        covariances_triu: Optional[np.ndarray] = None,
+    ):
+        if covariances is None and covariances_triu is None:
+            raise ValueError("Either covariances or covariances_triu is required")
+        self.centers = centers
+        self.rgbs = rgbs
+        self.opacities = opacities.reshape(-1, 1)
+        self._covariances = covariances
+        self._covariances_triu = covariances_triu
+
+    @classmethod
+    def from_splat(cls, splat) -> "SplatArrays":
+        """Float32 copy of a SplatFile (or anything with the same attributes)"""
+        if isinstance(splat, cls):
+            return splat
+        # Convert to float32 to avoid BFloat16 errors
+        return cls(
+            centers=np.asarray(splat.centers, dtype=np.float32),
+            rgbs=np.asarray(splat.rgbs, dtype=np.float32),
+            opacities=np.asarray(splat.opacities, dtype=np.float32),
+            covariances=np.asarray(splat.covariances, dtype=np.float32),
+        )
+
+    @property
+    def covariances(self) -> np.ndarray:
+        """(N, 3, 3) covariances, expanded from the stored upper triangle on first use"""
+        if self._covariances is None:
+            self._covariances = triu_to_covariances(self._covariances_triu)
+        return self._covariances
+
+    def covariances_slice(self, start: int, end: int) -> np.ndarray:
+        """(n, 3, 3) covariances of splats start:end, without expanding the whole scene"""
+        if self._covariances is not None:
+            return self._covariances[start:end]
+        return triu_to_covariances(self._covariances_triu[start:end])
+
+    @property
+    def covariances_triu(self) -> np.ndarray:
+        if self._covariances_triu is None:
+            self._covariances_triu = covariances_to_triu(self._covariances)
+        return self._covariances_triu
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the attributes once expanded to float32 for the viewer"""
+        return len(self) * (3 + 3 + 1 + 9) * 4
+
+    def __len__(self) -> int:
+        return len(self.centers)
+
+
+def save_splat(
+    path: Union[str, Path],
+    splat,
+    half_colors: bool = True,
+    half_covariances: bool = False,
+    compression=None,
+):
+    """Write a scene in the columnar `.dsplat` format
+
+    Colors and opacities default to float16, which is lossless at display
+    precision. Centers are always float32. With a `splat_compress.Compression`,
+    the scene is quantized instead, which drops invalid gaussians.
+    """
+    metadata = None
+    if compression is not None:
+        from splat_compress import encode_splats
+        encoded, metadata = encode_splats(splat, compression)
+        columns = {name: (array, array.dtype.str) for name, array in encoded.items()}
+        num_splats = len(encoded["centers"])
+    else:
+        splat = SplatArrays.from_splat(splat)
+        color_dtype = "<f2" if half_colors else "<f4"
+        columns = {
+            "centers": (np.asarray(splat.centers), "<f4"),
+            "covariances": (np.asarray(splat.covariances_triu), "<f2" if half_covariances else "<f4"),
+            "rgbs": (np.asarray(splat.rgbs), color_dtype),
+            "opacities": (np.asarray(splat.opacities).reshape(-1, 1), color_dtype),
+        }
+        num_splats = len(splat)
+
+    metadata_bytes = b""
+    if metadata is not None:
+        metadata_bytes = json.dumps(metadata).encode()
+        metadata_bytes = METADATA_LENGTH.pack(len(metadata_bytes)) + metadata_bytes
+    offset = _align(HEADER.size + COLUMN.size * len(columns) + len(metadata_bytes))
+    table = []
+    for name, (array, dtype) in columns.items():
+        components = array.shape[1]
+        table.append((name, dtype, components, offset))
+        offset = _align(offset + num_splats * components * np.dtype(dtype).itemsize)
+
+    with atomic_write(path) as tmp_path, open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, 2 if metadata is not None else 1, len(columns), num_splats))
+        for name, dtype, components, column_offset in table:
+            f.write(COLUMN.pack(name.encode(), dtype.encode(), components, column_offset))
+        f.write(metadata_bytes)
+        for (name, dtype, _, column_offset), (array, _) in zip(table, columns.values()):
+            f.seek(column_offset)
+            np.ascontiguousarray(array, dtype=dtype).tofile(f)
+        f.truncate(offset)
+
+
+@contextmanager
+def atomic_write(path: Union[str, Path]) -> Iterator[Path]:
+    """Yield a temporary path next to `path` and rename it over `path` once the block succeeds
+
+    Readers never see a partial file, and the temporary file is removed if the block fails.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            tmp_path.unlink()
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def load_splat(path: Union[str, Path], mmap: bool = True) -> SplatArrays:
+    """Open a `.dsplat` file; with `mmap`, columns are views into the mapped file
+
+    Quantized (version 2) scenes are decoded to float32 arrays.
+    """
+    if mmap:
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+    else:
+        data = np.fromfile(path, dtype=np.uint8)
+
+    magic, version, num_columns, num_splats = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a dream splat file")
+    if version > VERSION:
+        raise ValueError(f"{path} uses format version {version}, newer than supported ({VERSION})")
+
+    columns: Dict[str, np.ndarray] = {}
+    for i in range(num_columns):
+        name, dtype, components, offset = COLUMN.unpack_from(data, HEADER.size + i * COLUMN.size)
+        dtype = np.dtype(dtype.rstrip(b"\x00").decode())
+        end = offset + num_splats * components * dtype.itemsize
+        columns[name.rstrip(b"\x00").decode()] = data[offset:end].view(dtype).reshape(num_splats, components)
+
+    if version >= 2:
+        start = HEADER.size + num_columns * COLUMN.size
+        (length,) = METADATA_LENGTH.unpack_from(data, start)
+        start += METADATA_LENGTH.size
+        metadata = json.loads(bytes(data[start:start + length]))
+        from splat_compress import decode_splats
+        return decode_splats(columns, metadata)
+
+    return SplatArrays(
+        centers=columns["centers"],
+        rgbs=columns["rgbs"],
+        opacities=columns["opacities"],
+        covariances_triu=columns["covariances"],
+    )
+
+
+def is_quantized(path: Union[str, Path]) -> bool:
+    """Whether a `.dsplat` file holds a quantized (version 2) scene"""
+    with open(path, "rb") as f:
+        _, version, _, _ = HEADER.unpack(f.read(HEADER.size))
+    return version >= 2
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+# PLY conversion, using the standard 3D gaussian splatting vertex layout
+
+PLY_PROPERTIES = (
+    ["x", "y", "z", "nx", "ny", "nz", "f_dc_0", "f_dc_1", "f_dc_2", "opacity"]
+    + [f"scale_{i}" for i in range(3)]
+    + [f"rot_{i}" for i in range(4)]
+)
+PLY_TYPES = {
+    "char": "i1", "uchar": "u1", "short": "i2", "ushort": "u2",
+    "int": "i4", "uint": "u4", "float": "f4", "double": "f8",
+    "int8": "i1", "uint8": "u1", "int16": "i2", "uint16": "u2",
+    "int32": "i4", "uint32": "u4", "float32": "f4", "float64": "f8",
+}
+
+
+def covariances_to_scale_rotation(covariances: np.ndarray):
+    """Decompose covariances into per-axis scales and wxyz rotation quaternions"""
+    eigvals, eigvecs = np.linalg.eigh(np.asarray(covariances, dtype=np.float64))
+    scales = np.sqrt(np.clip(eigvals, 1e-20, None))
+    # Make each basis a proper rotation
+    eigvecs[np.linalg.det(eigvecs) < 0, :, 2] *= -1
+    return scales, matrices_to_quaternions(eigvecs)
+
+
+def scale_rotation_to_covariances(scales: np.ndarray, quaternions: np.ndarray) -> np.ndarray:
+    """Covariances R S S^T R^T from scales and wxyz quaternions"""
+    rotations = quaternions_to_matrices(quaternions)
+    rs = rotations * np.asarray(scales)[:, None, :]
+    return (rs @ rs.transpose(0, 2, 1)).astype(np.float32)
+
+
+def quaternions_to_matrices(quaternions: np.ndarray) -> np.ndarray:
+    q = np.asarray(quaternions, dtype=np.float64)
+    q = q / np.linalg.norm(q, axis=1, keepdims=True)
+    w, x, y, z = q.T
+    return np.stack([
+        1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y),
+        2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x),
+        2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y),
+    ], axis=1).reshape(-1, 3, 3)
+
+
+def matrices_to_quaternions(matrices: np.ndarray) -> np.ndarray:
+    """Rotation matrices -> wxyz quaternions (Shepperd's method, vectorized)"""
+    m = np.asarray(matrices, dtype=np.float64)
+    trace = m[:, 0, 0] + m[:, 1, 1] + m[:, 2, 2]
+    # Candidate 4*q_i^2 for w, x, y, z; use the largest for numerical stability
+    candidates = np.stack([
+        1 + trace,
+        1 + m[:, 0, 0] - m[:, 1, 1] - m[:, 2, 2],
+        1 - m[:, 0, 0] + m[:, 1, 1] - m[:, 2, 2],
+        1 - m[:, 0, 0] - m[:, 1, 1] + m[:, 2, 2],
+    ], axis=1)
+    best = np.argmax(candidates, axis=1)
+    s = np.sqrt(np.clip(candidates[np.arange(len(m)), best], 1e-20, None)) * 2
+
+    q = np.empty((len(m), 4))
+    rows = [
+        (s / 4, (m[:, 2, 1] - m[:, 1, 2]) / s, (m[:, 0, 2] - m[:, 2, 0]) / s, (m[:, 1, 0] - m[:, 0, 1]) / s),
+        ((m[:, 2, 1] - m[:, 1, 2]) / s, s / 4, (m[:, 0, 1] + m[:, 1, 0]) / s, (m[:, 0, 2] + m[:, 2, 0]) / s),
+        ((m[:, 0, 2] - m[:, 2, 0]) / s, (m[:, 0, 1] + m[:, 1, 0]) / s, s / 4, (m[:, 1, 2] + m[:, 2, 1]) / s),
+        ((m[:, 1, 0] - m[:, 0, 1]) / s, (m[:, 0, 2] + m[:, 2, 0]) / s, (m[:, 1, 2] + m[:, 2, 1]) / s, s / 4),
+    ]
+    for i, row in enumerate(rows):
+        mask = best == i
+        q[mask] = np.stack(row, axis=1)[mask]
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+def export_ply(path: Union[str, Path], splat):
+    """Write a scene as a binary little-endian 3DGS PLY"""
+    splat = SplatArrays.from_splat(splat)
+    num_splats = len(splat)
+    scales, quaternions = covariances_to_scale_rotation(splat.covariances)
+    opacities = np.clip(np.asarray(splat.opacities, dtype=np.float64).reshape(-1), 1e-6, 1 - 1e-6)
+
+    vertices = np.zeros(num_splats, dtype=[(name, "<f4") for name in PLY_PROPERTIES])
+    for i, axis in enumerate("xyz"):
+        vertices[axis] = splat.centers[:, i]
+    for i in range(3):
+        vertices[f"f_dc_{i}"] = (splat.rgbs[:, i] - 0.5) / SH_C0
+        vertices[f"scale_{i}"] = np.log(scales[:, i])
+    for i in range(4):
+        vertices[f"rot_{i}"] = quaternions[:, i]
+    vertices["opacity"] = np.log(opacities / (1 - opacities))
+
+    header = "\n".join(
+        ["ply", "format binary_little_endian 1.0", f"element vertex {num_splats}"]
+        + [f"property float {name}" for name in PLY_PROPERTIES]
+        + ["end_header", ""]
+    )
+    with open(path, "wb") as f:
+        f.write(header.encode("ascii"))
+        vertices.tofile(f)
+
+
+def import_ply(path: Union[str, Path]) -> SplatArrays:
+    """Read a binary little-endian 3DGS PLY into float32 splat arrays"""
+    with open(path, "rb") as f:
+        if f.readline().strip() != b"ply":
+            raise ValueError(f"{path} is not a PLY file")
+        num_splats = None
+        properties = []
+        in_vertex = False
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError(f"{path} has no end_header")
+            tokens = line.decode("ascii").split()
+            if not tokens:
+                continue
+            if tokens[0] == "end_header":
+                break
+            if tokens[0] == "format" and tokens[1] != "binary_little_endian":
+                raise ValueError(f"Unsupported PLY format {tokens[1]}")
+            if tokens[0] == "element":
+                in_vertex = tokens[1] == "vertex"
+                if in_vertex:
+                    num_splats = int(tokens[2])
+            elif tokens[0] == "property" and in_vertex:
+                if tokens[1] == "list":
+                    raise ValueError("List properties are not supported on splat vertices")
+                properties.append((tokens[2], "<" + PLY_TYPES[tokens[1]]))
+        vertices = np.fromfile(f, dtype=properties, count=num_splats)
+
+    centers = np.stack([vertices[axis] for axis in "xyz"], axis=1).astype(np.float32)
+    rgbs = np.stack([vertices[f"f_dc_{i}"] for i in range(3)], axis=1) * SH_C0 + 0.5
+    opacities = 1 / (1 + np.exp(-vertices["opacity"].astype(np.float64)))
+    scales = np.exp(np.stack([vertices[f"scale_{i}"] for i in range(3)], axis=1).astype(np.float64))
+    quaternions = np.stack([vertices[f"rot_{i}"] for i in range(4)], axis=1)
+    return SplatArrays(
+        centers=centers,
+        rgbs=np.clip(rgbs, 0, 1).astype(np.float32),
+        opacities=opacities.astype(np.float32),
+        covariances=scale_rotation_to_covariances(scales, quaternions),
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Convert between PLY and .dsplat scene files")
+    parser.add_argument("input", type=str, help="Input .ply or .dsplat file")
+    parser.add_argument("output", type=str, help="Output .ply or .dsplat file")
+    parser.add_argument("--half_covariances", action="store_true", help="Store covariances as float16")
+    parser.add_argument("--compress", action="store_true", help="Store a quantized scene (see splat_compress.py)")
+    parser.add_argument("--palette_size", type=int, default=0, help="With --compress, store colors as a k-means palette")
+    parser.add_argument("--position_error", type=float, default=1e-4, help="With --compress, max center error relative to the scene size")
+    parser.add_argument("--scale_error", type=float, default=0.01, help="With --compress, max relative error of gaussian axis lengths")
+    parser.add_argument("--rotation_error", type=float, default=0.005, help="With --compress, max quaternion component error")
+    args = parser.parse_args()
+
+    if args.input.endswith(".ply"):
+        scene = import_ply(args.input)
+    else:
+        scene = load_splat(args.input)
+
+    if args.output.endswith(".ply"):
+        export_ply(args.output, scene)
+    elif args.compress:
+        from splat_compress import Compression, ErrorBudget
+        budget = ErrorBudget(position=args.position_error, scale=args.scale_error, rotation=args.rotation_error)
+        save_splat(args.output, scene, compression=Compression(budget, palette_size=args.palette_size))
+    else:
+        save_splat(args.output, scene, half_covariances=args.half_covariances)
+    print(f"Converted {len(scene)} splats: {args.input} -> {args.output}")
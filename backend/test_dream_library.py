@@ -0,0 +1,41 @@
+import json
+
+import numpy as np
+import pytest
+
+from dream_library import DreamLibrary
+from scene_summary import summarize_scene
+from splat_format import SplatArrays
+
+
+def nan_center_scene(num_splats: int = 100) -> SplatArrays:
+    rng = np.random.default_rng(0)
+    centers = rng.uniform(-5, 5, size=(num_splats, 3)).astype(np.float32)
+    centers[3] = [np.nan, 0.0, 1.0]
+    return SplatArrays(
+        centers=centers,
+        rgbs=rng.uniform(0, 1, size=(num_splats, 3)).astype(np.float32),
+        opacities=rng.uniform(0.1, 1, size=(num_splats, 1)).astype(np.float32),
+        covariances=np.tile(np.eye(3, dtype=np.float32) * 0.01, (num_splats, 1, 1)),
+    )
+
+
+def test_summary_ignores_nan_centers():
+    summary = summarize_scene(nan_center_scene())
+    # What Starlette's JSONResponse does; raises on NaN or infinity
+    json.dumps(summary, allow_nan=False)
+    assert summary["start_camera"]["far"] >= 10.0
+
+
+@pytest.mark.parametrize("with_summary", [True, False])
+def test_dreams_with_a_nan_center_serialize(tmp_path, with_summary):
+    library = DreamLibrary(tmp_path)
+    scene = nan_center_scene()
+    summary = summarize_scene(scene) if with_summary else None
+    library.add("dream", "a room", scene, summary=summary)
+
+    dreams, _ = library.list()
+    assert [dream["id"] for dream in dreams] == ["dream"]
+    json.dumps(dreams, allow_nan=False)
+    json.dumps(library.get("dream"), allow_nan=False)
+    library.close()
@@ -0,0 +1,83 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import generation_workers
+from generation_workers import WorkerPoolBackend, create_worker_pool
+
+
+def wait_until(condition, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+def ready(worker) -> bool:
+    """Started, with the modes it had loaded back in place"""
+    return worker.process.is_alive() and worker.started and not worker.reloads and not worker.pending
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    # Record restart delays instead of waiting them out
+    delays = []
+    monkeypatch.setattr(generation_workers, "time", SimpleNamespace(sleep=delays.append))
+    pool = WorkerPoolBackend("synthetic", ["cpu"], num_splats=1_000, latency=1.0)
+    pool.delays = delays
+    yield pool
+    pool.shutdown()
+
+
+def test_dead_worker_fails_its_requests_and_restarts_with_backoff(pool):
+    pool.load()
+    worker = pool.workers[0]
+    wait_until(lambda: ready(worker))
+
+    errors = []
+
+    def generate():
+        try:
+            pool.generate("a room")
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=generate)
+    thread.start()
+    wait_until(lambda: worker.pending)
+    worker.process.kill()
+    thread.join(30)
+    assert "died" in str(errors[0])
+    wait_until(lambda: ready(worker))
+    assert worker.restarts == 1 and pool.delays == [1.0]
+
+    # Reloading alone doesn't reset the backoff
+    worker.process.kill()
+    wait_until(lambda: worker.restarts == 2 and ready(worker))
+    assert pool.delays == [1.0, 2.0]
+
+    # A completed generation does
+    assert len(pool.generate("a room").centers) == 1_000
+    worker.process.kill()
+    wait_until(lambda: worker.restarts == 3 and ready(worker))
+    assert pool.delays == [1.0, 2.0, 1.0]
+    assert pool.is_loaded()
+
+
+def test_backoff_is_capped(pool, monkeypatch):
+    monkeypatch.setattr(generation_workers, "MAX_RESTART_BACKOFF", 3.0)
+    pool.start()
+    worker = pool.workers[0]
+    for restarts in range(1, 5):
+        wait_until(lambda: ready(worker))
+        worker.process.kill()
+        wait_until(lambda: worker.restarts == restarts)
+    assert pool.delays == [1.0, 2.0, 3.0, 3.0]
+
+
+def test_device_specs():
+    assert create_worker_pool("synthetic", "2").devices == ["cpu", "cpu"]
+    assert create_worker_pool("worldgen", "2").devices == ["cuda:0", "cuda:1"]
+    assert create_worker_pool("worldgen", "1, cuda:3,").devices == ["cuda:1", "cuda:3"]
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from jobs import ClientLimitError, JobQueue, QueueFullError
+from rate_limit import RateLimiter
+
+
+def blocked_queue(**options):
+    """A queue whose jobs run until `release` is set, so submitted jobs stay in flight"""
+    release = threading.Event()
+
+    def runner(job, set_stage):
+        release.wait(5)
+        return {}
+
+    queue = JobQueue(runner, **options)
+    queue.start()
+    return queue, release
+
+
+def test_coalesced_requests_are_not_charged():
+    limiter = RateLimiter(rate=1 / 60, burst=1, clock=lambda: 0.0)
+    queue, release = blocked_queue()
+    try:
+        job, attached = queue.submit("a room", dedup_key="a room", client="c", charge=lambda: limiter.acquire("c"))
+        assert not attached
+        # The only token is gone, but an identical retry attaches to the job in flight
+        again, attached = queue.submit("a room", dedup_key="a room", client="c", charge=lambda: limiter.acquire("c"))
+        assert attached and again is job and job.subscribers == 2
+        with pytest.raises(ClientLimitError) as error:
+            queue.submit("a garden", dedup_key="a garden", client="c", charge=lambda: limiter.acquire("c"))
+        assert error.value.reason == "rate_limit" and error.value.retry_after > 0
+    finally:
+        release.set()
+        queue.shutdown(wait=True)
+
+
+def test_refused_requests_are_not_charged():
+    limiter = RateLimiter(rate=1 / 60, burst=2, clock=lambda: 0.0)
+    queue, release = blocked_queue(max_queue_size=1)
+    try:
+        queue.submit("first", client="c", charge=lambda: limiter.acquire("c"))
+        # Wait for the worker to pick it up, so the next job is the only one queued
+        while queue.running_count() == 0:
+            time.sleep(0.01)
+        queue.submit("second", client="c", charge=lambda: limiter.acquire("c"))
+        assert limiter.remaining("c") == 0
+        with pytest.raises(QueueFullError) as error:
+            queue.submit("third", client="d", charge=lambda: limiter.acquire("d"))
+        assert error.value.reason == "queue_full"
+        # The full queue refused the job before it was charged
+        assert limiter.remaining("d") == 2
+    finally:
+        release.set()
+        queue.shutdown(wait=True)
+
+
+def test_retry_after_cancel_queues_a_new_job():
+    queue, release = blocked_queue()
+    try:
+        job, _ = queue.submit("a room", dedup_key="a room")
+        while queue.running_count() == 0:
+            time.sleep(0.01)
+        assert queue.cancel(job.id)
+        # The running job is still stopping, but a retry must not attach to it
+        retry, attached = queue.submit("a room", dedup_key="a room")
+        assert not attached and retry is not job and retry.subscribers == 1
+        release.set()
+        while not (job.finished and retry.finished):
+            time.sleep(0.01)
+        assert job.status == "cancelled" and retry.status == "complete"
+        assert not retry.cancel_requested
+    finally:
+        release.set()
+        queue.shutdown(wait=True)
+
+
+def test_cancelling_a_coalesced_job_only_drops_one_subscriber():
+    queue, release = blocked_queue()
+    try:
+        job, _ = queue.submit("a room", dedup_key="a room")
+        while queue.running_count() == 0:
+            time.sleep(0.01)
+        queue.submit("a room", dedup_key="a room")
+        # One waiting client disconnects; the other still gets the result
+        assert queue.cancel(job.id)
+        assert job.subscribers == 1 and not job.cancel_requested
+        # Back to one subscriber, but this request still attached to the job in flight
+        again, attached = queue.submit("a room", dedup_key="a room")
+        assert attached and again is job and job.subscribers == 2
+        release.set()
+        while not job.finished:
+            time.sleep(0.01)
+        assert job.status == "complete"
+        assert queue.running_count() == 0 and queue.queue_depth() == 0
+    finally:
+        release.set()
+        queue.shutdown(wait=True)
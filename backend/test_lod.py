@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from lod import DETAIL_OPTIONS, MIN_REDUCTION, build_lod, detail_level, merge_splats
+
+
+def shell(num_splats: int, seed: int = 0) -> dict:
+    """Small gaussians scattered over a shell 4 to 5 units from the origin"""
+    rng = np.random.default_rng(seed)
+    directions = rng.normal(size=(num_splats, 3))
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    return {
+        "centers": (directions * rng.uniform(4, 5, size=(num_splats, 1))).astype(np.float32),
+        "rgbs": rng.uniform(0, 1, size=(num_splats, 3)).astype(np.float32),
+        "opacities": rng.uniform(0.1, 1, size=(num_splats, 1)).astype(np.float32),
+        "covariances": np.tile(np.eye(3, dtype=np.float32) * 1e-4, (num_splats, 1, 1)),
+    }
+
+
+def test_levels_are_coarsest_first_and_end_with_the_full_scene():
+    arrays = shell(200_000)
+    levels = build_lod(arrays, num_levels=3)
+    assert len(levels) == 3
+    assert all(levels[-1][key] is arrays[key] for key in arrays)
+    counts = [len(level["centers"]) for level in levels]
+    assert counts == sorted(set(counts))
+    assert all(count <= MIN_REDUCTION * counts[-1] for count in counts[:-1])
+
+
+def test_levels_that_barely_reduce_are_dropped():
+    # Too few splats per cell at the finer grid, so only one coarse level is worth keeping
+    levels = build_lod(shell(50_000), num_levels=3)
+    assert len(levels) == 2
+    # Too sparse for any merging to pay off
+    levels = build_lod(shell(2_000), num_levels=3)
+    assert len(levels) == 1 and len(levels[0]["centers"]) == 2_000
+
+
+def test_merge_matches_the_first_two_moments():
+    arrays = shell(2)
+    arrays["centers"] = np.array([[4, 0, 0], [4, 0.1, 0]], dtype=np.float32)
+    arrays["opacities"] = np.array([[0.5], [0.5]], dtype=np.float32)
+    merged = merge_splats(arrays, np.zeros(2, dtype=np.int64))
+
+    assert np.allclose(merged["centers"], [[4, 0.05, 0]])
+    # Half the members' spread along y, on top of their own covariance
+    expected = np.eye(3) * 1e-4
+    expected[1, 1] += 0.05 ** 2
+    assert np.allclose(merged["covariances"][0], expected, atol=1e-7)
+
+
+@pytest.mark.parametrize("num_levels, expected", [(1, [0, 0, 0]), (2, [0, 0, 1]), (3, [0, 1, 2]), (4, [0, 2, 3])])
+def test_detail_level_spreads_options_over_levels(num_levels, expected):
+    assert [detail_level(detail, num_levels) for detail in DETAIL_OPTIONS] == expected
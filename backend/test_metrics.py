@@ -0,0 +1,29 @@
+import sys
+from types import SimpleNamespace
+
+from metrics import REGISTRY, gpu_total_bytes, record_gpu_total
+
+
+def fake_torch(totals):
+    cuda = SimpleNamespace(
+        is_available=lambda: True,
+        device_count=lambda: len(totals),
+        get_device_properties=lambda index: SimpleNamespace(total_memory=totals[index]),
+    )
+    return SimpleNamespace(cuda=cuda)
+
+
+def test_gpu_total_bytes_covers_every_device(monkeypatch):
+    monkeypatch.setitem(sys.modules, "torch", fake_torch([8 << 30, 24 << 30]))
+    assert gpu_total_bytes() == {"cuda:0": 8 << 30, "cuda:1": 24 << 30}
+
+    for device, total in gpu_total_bytes().items():
+        record_gpu_total(total, device)
+    text = REGISTRY.render()
+    assert 'dream_gpu_memory_total_bytes{device="cuda:0"} 8589934592.0' in text
+    assert 'dream_gpu_memory_total_bytes{device="cuda:1"} 25769803776.0' in text
+
+
+def test_gpu_total_bytes_without_torch(monkeypatch):
+    monkeypatch.delitem(sys.modules, "torch", raising=False)
+    assert gpu_total_bytes() == {}
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from spatial_index import (
+    SplatIndex,
+    boxes_in_frustum,
+    boxes_near_point,
+    boxes_overlap,
+    frustum_planes,
+    ray_box_distances,
+    splat_extents,
+)
+
+
+@pytest.fixture(scope="module")
+def scene():
+    rng = np.random.default_rng(0)
+    num_splats = 5_000
+    centers = rng.uniform(-10, 10, size=(num_splats, 3)).astype(np.float32)
+    sigmas = rng.uniform(0.01, 0.3, size=(num_splats, 3))
+    covariances = np.zeros((num_splats, 3, 3), dtype=np.float32)
+    covariances[:, [0, 1, 2], [0, 1, 2]] = sigmas ** 2
+    opacities = rng.uniform(0, 1, size=(num_splats, 1)).astype(np.float32)
+    # Small leaves and fanout give the hierarchy several levels to walk
+    index = SplatIndex.build(centers, covariances=covariances, leaf_size=16, fanout=4)
+    return centers, splat_extents(covariances), opacities, index
+
+
+def brute_force(centers, extents, test, centers_only: bool = False) -> np.ndarray:
+    if centers_only:
+        return np.nonzero(test(centers, centers))[0]
+    return np.nonzero(test(centers - extents, centers + extents))[0]
+
+
+@pytest.mark.parametrize("centers_only", [False, True])
+def test_query_box_matches_brute_force(scene, centers_only):
+    centers, extents, _, index = scene
+    lower, upper = np.array([-3, -1, 2], dtype=np.float32), np.array([4, 5, 6], dtype=np.float32)
+    expected = brute_force(centers, extents, lambda lo, hi: boxes_overlap(lo, hi, lower, upper), centers_only)
+    assert len(expected) > 0
+    assert np.array_equal(np.sort(index.query_box(lower, upper, centers_only)), expected)
+
+
+@pytest.mark.parametrize("centers_only", [False, True])
+def test_query_radius_matches_brute_force(scene, centers_only):
+    centers, extents, _, index = scene
+    point = np.array([1, -2, 0.5], dtype=np.float32)
+    expected = brute_force(centers, extents, lambda lo, hi: boxes_near_point(lo, hi, point, 3.0), centers_only)
+    assert len(expected) > 0
+    assert np.array_equal(np.sort(index.query_radius(point, 3.0, centers_only)), expected)
+
+
+def test_query_frustum_matches_brute_force(scene):
+    centers, extents, _, index = scene
+    # At the origin looking down +x
+    planes = frustum_planes([0, 0, 0], [np.cos(np.pi / 4), 0, np.sin(np.pi / 4), 0],
+                            fov=np.pi / 3, aspect=1.5, near=0.1, far=8.0)
+    expected = brute_force(centers, extents, lambda lo, hi: boxes_in_frustum(lo, hi, planes))
+    assert 0 < len(expected) < len(centers)
+    assert np.array_equal(np.sort(index.query_frustum(planes)), expected)
+
+    # Visible leaves come first, and every splat is still streamed once
+    order = index.view_order(planes, position=[0, 0, 0])
+    assert np.array_equal(np.sort(order), np.arange(len(centers)))
+    assert set(expected) <= set(order[:len(index.leaf_splats(index.frustum_leaves(planes)))])
+
+
+def test_query_ray_and_pick_match_brute_force(scene):
+    centers, extents, opacities, index = scene
+    origin, direction = np.array([-12.0, 0.3, -0.2]), np.array([1.0, 0.05, 0.02])
+    direction /= np.linalg.norm(direction)
+    entries = ray_box_distances(centers - extents, centers + extents, origin, direction)
+    hits = np.nonzero(entries <= np.inf)[0]
+    distances = np.maximum((centers[hits] - origin) @ direction, entries[hits])
+    assert len(hits) > 1
+
+    indices, found = index.query_ray(origin, direction)
+    assert np.array_equal(np.sort(indices), hits)
+    assert np.all(np.diff(found) >= 0)
+    assert np.allclose(np.sort(found), np.sort(distances))
+
+    opaque = opacities[hits, 0] >= 0.3
+    nearest = hits[opaque][np.argmin(distances[opaque])]
+    picked, distance = index.pick(origin, direction, opacities)
+    assert picked == nearest
+    assert distance == pytest.approx(distances[opaque].min())
+    assert index.pick(origin, direction, opacities, min_opacity=2.0) is None
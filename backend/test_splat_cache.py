@@ -0,0 +1,116 @@
+import io
+import os
+
+import numpy as np
+import pytest
+
+from image_cache import ImageCache
+from scene_summary import summary_path
+from splat_cache import SplatCache
+from splat_format import SplatArrays
+
+
+def scene(seed: int, num_splats: int = 1000) -> SplatArrays:
+    rng = np.random.default_rng(seed)
+    return SplatArrays(
+        centers=rng.uniform(-5, 5, size=(num_splats, 3)).astype(np.float32),
+        rgbs=rng.uniform(0, 1, size=(num_splats, 3)).astype(np.float32),
+        opacities=rng.uniform(0.1, 1, size=(num_splats, 1)).astype(np.float32),
+        covariances=np.tile(np.eye(3, dtype=np.float32) * 0.01, (num_splats, 1, 1)),
+    )
+
+
+def age(cache, key: str, seconds: float):
+    """Pretend an entry was last used `seconds` ago, on disk and in the index"""
+    path = cache._path(key)
+    used = path.stat().st_mtime - seconds
+    os.utime(path, (used, used))
+    cache._index[key] = (cache._index[key][0], used)
+
+
+def test_splat_cache_evicts_least_recently_used(tmp_path):
+    cache = SplatCache(tmp_path, max_bytes=1 << 30)
+    cache.put("a", scene(0))
+    entry_bytes = cache.path("a").stat().st_size
+    cache.max_bytes = 2 * entry_bytes
+    cache.put("b", scene(1))
+    age(cache, "a", 20)
+    age(cache, "b", 10)
+    # Using "a" makes "b" the least recently used
+    assert cache.get("a") is not None
+    cache.put("c", scene(2))
+
+    assert "b" not in cache and "a" in cache and "c" in cache
+    assert not cache._path("b").exists()
+    assert cache.stats()["entries"] == 2
+
+
+def test_splat_cache_eviction_removes_summaries(tmp_path):
+    cache = SplatCache(tmp_path, max_bytes=1 << 30)
+    cache.put("a", scene(0))
+    cache.set_summary("a", {"num_splats": 1000})
+    sidecar = summary_path(cache._path("a"))
+    assert sidecar.exists()
+    cache.max_bytes = cache.path("a").stat().st_size * 3 // 2
+    age(cache, "a", 10)
+    cache.put("b", scene(1))
+    assert "a" not in cache and not sidecar.exists()
+
+
+def test_recency_survives_restart(tmp_path):
+    cache = SplatCache(tmp_path, max_bytes=1 << 30)
+    for i, key in enumerate("abc"):
+        cache.put(key, scene(i))
+    age(cache, "a", 30)
+    age(cache, "b", 20)
+    age(cache, "c", 10)
+    cache.get("a")
+
+    reopened = SplatCache(tmp_path, max_bytes=2 * cache.path("a").stat().st_size)
+    reopened.put("d", scene(3))
+    # "a" was used last before the restart, so "b" and "c" go first
+    assert "a" in reopened and "d" in reopened
+    assert "b" not in reopened and "c" not in reopened
+
+
+def test_image_cache_keeps_the_newest_entry_over_budget(tmp_path):
+    cache = ImageCache(tmp_path, max_bytes=100, suffix=".img")
+    cache._write("small", b"x" * 60)
+    cache._write("large", b"y" * 150)
+    # The new entry alone exceeds the budget, but is never evicted on write
+    assert "large" in cache and "small" not in cache
+    assert cache.path("large").read_bytes() == b"y" * 150
+
+
+def test_image_cache_evicts_least_recently_used(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    cache = ImageCache(tmp_path, max_bytes=1 << 30)
+    images = [Image.fromarray(np.full((8, 8, 3), i * 40, dtype=np.uint8)) for i in range(3)]
+    cache.put("a", images[0])
+    cache.max_bytes = 2 * cache.path("a").stat().st_size
+    cache.put("b", images[1])
+    age(cache, "a", 20)
+    age(cache, "b", 10)
+    assert cache.get("a") is not None
+    cache.put("c", images[2])
+    assert "b" not in cache and "a" in cache and "c" in cache
+
+    buffer = io.BytesIO()
+    images[0].save(buffer, format="PNG")
+    assert cache.put_bytes(buffer.getvalue()) in cache
+
+
+def test_mesh_cache_evicts_least_recently_used(tmp_path):
+    trimesh = pytest.importorskip("trimesh")
+    from mesh_export import MeshCache
+
+    cache = MeshCache(tmp_path, max_bytes=1 << 30)
+    meshes = [trimesh.creation.icosphere(subdivisions=2 + i) for i in range(3)]
+    cache.put("a", meshes[0])
+    cache.put("b", meshes[1])
+    age(cache, "a", 20)
+    age(cache, "b", 10)
+    assert cache.get("a") is not None
+    cache.max_bytes = cache._size() + 1
+    cache.put("c", meshes[2])
+    assert "b" not in cache and "c" in cache
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from splat_compress import Compression, ErrorBudget, decode_splats, dequantize, encode_splats, roundtrip_errors
+from splat_format import SplatArrays, covariances_to_scale_rotation, scale_rotation_to_covariances
+
+
+def random_scene(num_splats: int = 20_000, seed: int = 0) -> SplatArrays:
+    """Randomly rotated gaussians with axis lengths log-uniform over 1e-3 to 1
+
+    That range (6.9 in log space) fits 8-bit scales for a 2% step tolerance but
+    not for 1%, so doubling the tolerance would show up as a budget violation.
+    """
+    rng = np.random.default_rng(seed)
+    quaternions = rng.normal(size=(num_splats, 4))
+    quaternions /= np.linalg.norm(quaternions, axis=1, keepdims=True)
+    scales = np.exp(rng.uniform(np.log(1e-3), 0.0, size=(num_splats, 3)))
+    return SplatArrays(
+        centers=rng.uniform(-10, 10, size=(num_splats, 3)).astype(np.float32),
+        rgbs=rng.uniform(0, 1, size=(num_splats, 3)).astype(np.float32),
+        opacities=rng.uniform(0.05, 1, size=(num_splats, 1)).astype(np.float32),
+        covariances=scale_rotation_to_covariances(scales, quaternions),
+    )
+
+
+@pytest.mark.parametrize("budget", [ErrorBudget(), ErrorBudget(scale=0.05, rotation=0.02)])
+def test_roundtrip_stays_within_budget(budget):
+    scene = random_scene()
+    columns, metadata = encode_splats(scene, Compression(budget))
+    decoded = decode_splats(columns, metadata)
+
+    # The stored axis lengths; decoded covariances also carry the rotation error
+    original_scales, _ = covariances_to_scale_rotation(scene.covariances)
+    scales = metadata["scales"]
+    log_scales = dequantize(columns["scales"], scales["log_min"], scales["log_max"], scales["bits"])
+    assert np.abs(np.exp(log_scales.astype(np.float64)) / original_scales - 1).max() <= budget.scale
+
+    errors = roundtrip_errors(scene, decoded)
+    assert errors["position_error"] <= budget.position
+    assert errors["opacity_error"] <= budget.opacity
+    # Covariances are squared axis lengths, plus the rotation error: each quaternion
+    # component is off by at most `rotation`, so the rotation angle by at most 4x that
+    # and the covariance by at most twice the angle
+    assert errors["covariance_error"] <= (1 + budget.scale) ** 2 - 1 + 8 * budget.rotation
+
+
+def test_attributes_beyond_16_bits_are_stored_as_float32():
+    scene = random_scene(2_000)
+    # 16 bits over the scenes' 6.9 log range scale axes by up to 5e-5, over the budget
+    budget = ErrorBudget(scale=1e-5, rotation=1e-5, opacity=1e-6, color=1e-6)
+    columns, metadata = encode_splats(scene, Compression(budget))
+    for name in ("scales", "rotations", "opacities", "rgbs"):
+        assert metadata[name]["bits"] is None
+        assert columns[name].dtype == np.float32
+    decoded = decode_splats(columns, metadata)
+
+    errors = roundtrip_errors(scene, decoded)
+    assert errors["opacity_error"] == 0.0
+    assert errors["color_rms_error"] == 0.0
+    assert errors["covariance_error"] <= (1 + budget.scale) ** 2 - 1 + 8 * budget.rotation
@@ -0,0 +1,663 @@
+import socket
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from lod import DETAIL_OPTIONS, build_lod, detail_level, iter_chunks, lod_nbytes
+from mesh_export import mesh_nbytes
+from metrics import REGISTRY, observe_span, span
+from scene_summary import summarize_scene
+from spatial_index import SplatIndex, frustum_planes
+from splat_convert import convert_splats
+from splat_format import SplatArrays
+
+
+# How long a new server waits for a previous one to release its port
+PORT_RELEASE_TIMEOUT = 10.0
+PORT_POLL_INTERVAL = 0.05
+# Shown to clients still watching a scene once it has been evicted
+EXPIRED_NOTICE = "**This scene has expired.** Serve it again from the dream library to keep exploring it."
+
+
+def port_available(port: int, host: str = "0.0.0.0") -> bool:
+    """Whether a server could listen on the port right now"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        # As servers bind, so connections lingering in TIME_WAIT don't count
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind((host, port))
+        except OSError:
+            return False
+        return True
+
+
+def wait_for_port(port: int, timeout: float = PORT_RELEASE_TIMEOUT) -> bool:
+    """Poll until the port is free, or give up after `timeout` seconds"""
+    deadline = time.monotonic() + timeout
+    while not port_available(port):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(PORT_POLL_INTERVAL)
+    return True
+
+
+def pick_splat(index: SplatIndex, full: Dict[str, np.ndarray], origin, direction) -> Optional[dict]:
+    """The first opaque splat along a ray, as a dict of its attributes, or None"""
+    with span("pick"):
+        hit = index.pick(origin, direction, full["opacities"])
+    if hit is None:
+        return None
+    i, distance = hit
+    return {
+        "index": i,
+        "position": full["centers"][i].tolist(),
+        "rgb": full["rgbs"][i].tolist(),
+        "opacity": float(full["opacities"][i, 0]),
+        "distance": distance,
+    }
+
+
+class ViewerSlot:
+    """A long-lived Viser server and the scene currently loaded into it
+
+    Splats are sent to each client separately: the coarsest LOD level first, then
+    the level matching the client's detail setting in chunks, so time to first
+    frame and client memory depend on the chosen level rather than the scene size.
+    Full detail is sent in view order when the scene has a spatial index: splats
+    in the client camera's frustum first, nearest first, then the rest.
+
+    A client only ever sees the scene that was loaded when it connected. Once
+    that scene is cleared, the client is shown an expired notice and is never
+    switched to a scene loaded later.
+    """
+
+    def __init__(self, port: int, host: str = "localhost", on_connect=None, chunk_size: int = 250_000):
+        self.port = port
+        # Called with this slot whenever a client connects, for LRU bookkeeping
+        self.on_connect = on_connect
+        self.chunk_size = chunk_size
+        self.url = f"http://{host}:{port}"
+        self.server = None
+        self.scene_id = None
+        self.nbytes = 0
+        self.mesh = None
+        self.lod_levels = []
+        self.summary = None
+        # SplatIndex over the full LOD level, for view ordering and picking
+        self.index = None
+        # Bumped whenever the loaded scene changes, so stale streams stop early
+        self.generation = 0
+        # client id -> [detail dropdown, stream token, splat handles, connect time, scene handles]
+        # for the clients watching the loaded scene
+        self._clients: Dict[int, list] = {}
+        self._clients_lock = threading.Lock()
+        # Held while the server is started or stopped
+        self._server_lock = threading.Lock()
+
+    def start(self):
+        """Start the Viser server once; it is reused for every scene loaded here"""
+        # Warm-up and a first scene can race to start the same slot
+        with self._server_lock:
+            if self.server is None:
+                self._start_server()
+
+    def _start_server(self):
+        # Imported here so the API can start (and answer health checks) without viser loaded
+        import viser
+
+        print(f"Starting Viser server on port {self.port}...")
+        with span("viewer_start"):
+            if not wait_for_port(self.port):
+                print(f"⚠️ Port {self.port} is still in use; viser will pick another")
+            self.server = viser.ViserServer(port=self.port)
+            if self.server.get_port() != self.port:
+                self.port = self.server.get_port()
+                self.url = f"{self.url.rsplit(':', 1)[0]}:{self.port}"
+            self.server.scene.set_up_direction("-y")
+            self.server.scene.enable_default_lights(False)
+
+        # Set up client connection handlers
+        @self.server.on_client_connect
+        def connect(client) -> None:
+            REGISTRY.counter("viewer_connections_total", "Viewer clients that connected").inc()
+            connected_at = time.perf_counter()
+            detail = client.gui.add_dropdown("Detail", DETAIL_OPTIONS, initial_value="full")
+            with self._clients_lock:
+                # The connect time is kept until the preview has been sent
+                self._clients[client.client_id] = [
+                    detail, 0, [], connected_at if self.lod_levels else None, []
+                ]
+
+            @detail.on_update
+            def _(_):
+                if self.scene_id is not None:
+                    self._stream(client)
+
+            pick = client.gui.add_checkbox("Pick splats", initial_value=False)
+            picked = client.gui.add_markdown("")
+
+            @pick.on_update
+            def _(_):
+                if not pick.value:
+                    client.scene.remove_pointer_callback()
+                    picked.content = ""
+                    return
+
+                @client.scene.on_pointer_event(event_type="click")
+                def _(event):
+                    if event.ray_origin is None or event.ray_direction is None:
+                        return
+                    if client.client_id not in self._clients:
+                        # The scene this client was watching has expired
+                        return
+                    hit = self.pick(event.ray_origin, event.ray_direction)
+                    if hit is None:
+                        picked.content = "No splat under the cursor"
+                        return
+                    x, y, z = hit["position"]
+                    picked.content = (
+                        f"Splat {hit['index']} at ({x:.2f}, {y:.2f}, {z:.2f}), "
+                        f"{hit['distance']:.2f} away, opacity {hit['opacity']:.2f}"
+                    )
+
+            if self.scene_id is None:
+                # Nothing is loaded, most likely a stale link to an evicted scene
+                with self._clients_lock:
+                    entry = self._clients.pop(client.client_id, None)
+                if entry is not None:
+                    self._expire(client, entry)
+                return
+            self._show_scene(client)
+            self._stream(client)
+            if self.on_connect is not None:
+                self.on_connect(self)
+
+        @self.server.on_client_disconnect
+        def disconnect(client) -> None:
+            with self._clients_lock:
+                self._clients.pop(client.client_id, None)
+
+    def load(self, scene_id: str, lod_levels: List[Dict[str, np.ndarray]], summary: dict, mesh=None,
+             index: Optional[SplatIndex] = None):
+        """Replace whatever this slot is showing with a new scene
+
+        `lod_levels` is a LOD hierarchy from `lod.build_lod`, coarsest first, and
+        `summary` the scene's `scene_summary.summarize_scene`. A `mesh` (a trimesh)
+        is shown to each client as it is, instead of streamed splats. `index` is
+        a `SplatIndex` over the last (full) level. Only clients that connect from
+        now on are shown the scene.
+        """
+        self.start()
+        self.clear()
+        self.scene_id = scene_id
+        self.lod_levels = lod_levels
+        self.summary = summary
+        self.mesh = mesh
+        self.index = index
+        self.nbytes = lod_nbytes(lod_levels) + (index.nbytes if index is not None else 0)
+        if mesh is not None:
+            self.nbytes = mesh_nbytes(mesh)
+
+    def clear(self):
+        """Drop the loaded scene but keep the server (and its socket) alive
+
+        Clients watching the scene are left on an expired notice.
+        """
+        self.generation += 1
+        if self.server is not None and self.scene_id is not None:
+            clients = self.server.get_clients()
+            with self._clients_lock:
+                entries, self._clients = self._clients, {}
+            for client_id, entry in entries.items():
+                client = clients.get(client_id)
+                if client is not None:
+                    self._expire(client, entry)
+        self.scene_id = None
+        self.nbytes = 0
+        self.mesh = None
+        self.lod_levels = []
+        self.summary = None
+        self.index = None
+
+    def stop(self):
+        """Stop the Viser server and release the port"""
+        with self._server_lock:
+            if self.server is not None:
+                try:
+                    self.server.stop()
+                except Exception as e:
+                    print(f"Error stopping server on port {self.port}: {e}")
+            self.server = None
+        self.clear()
+        self._clients.clear()
+
+    def _stream(self, client):
+        """(Re)start sending splats to one client on a background thread"""
+        if not self.lod_levels:
+            # Meshes are part of the server's scene and reach every client on their own
+            return
+        with self._clients_lock:
+            entry = self._clients.get(client.client_id)
+            if entry is None:
+                return
+            entry[1] += 1
+            token = entry[1]
+            detail = entry[0].value
+        levels = self.lod_levels
+        level = detail_level(detail, len(levels))
+        threading.Thread(
+            target=self._stream_levels,
+            args=(client, token, self.generation, levels, level, self.index),
+            daemon=True,
+        ).start()
+
+    def _stream_levels(self, client, token: int, generation: int, levels, level: int, index=None):
+        def current(entry):
+            return entry is not None and entry[1] == token and self.generation == generation
+
+        with self._clients_lock:
+            entry = self._clients.get(client.client_id)
+            if not current(entry):
+                return
+            self._remove_handles(entry)
+
+        try:
+            # Coarsest level first for a fast first frame
+            handles = [self._add_gs(client, "/scene_gs/preview", levels[0])]
+            with self._clients_lock:
+                entry = self._clients.get(client.client_id)
+                if entry is not None and entry[3] is not None:
+                    observe_span("client_connect", time.perf_counter() - entry[3])
+                    entry[3] = None
+            if level > 0:
+                order = None
+                if index is not None and level == len(levels) - 1:
+                    order = self._view_order(client, index)
+                for i, chunk in enumerate(iter_chunks(levels[level], self.chunk_size, order)):
+                    with self._clients_lock:
+                        if not current(self._clients.get(client.client_id)):
+                            for handle in handles:
+                                handle.remove()
+                            return
+                    handles.append(self._add_gs(client, f"/scene_gs/detail/{i}", chunk))
+                # The full chunks now cover everything the preview showed
+                handles.pop(0).remove()
+        except Exception as e:
+            # Most likely the client disconnected mid-stream
+            print(f"Stopped streaming splats to client {client.client_id}: {e}")
+            return
+
+        with self._clients_lock:
+            entry = self._clients.get(client.client_id)
+            if current(entry):
+                entry[2] = handles
+                return
+        for handle in handles:
+            handle.remove()
+
+    def pick(self, origin, direction) -> Optional[dict]:
+        """The splat a ray from a click would land on, or None"""
+        index, levels = self.index, self.lod_levels
+        if index is None or not levels:
+            return None
+        return pick_splat(index, levels[-1], origin, direction)
+
+    def _view_order(self, client, index: SplatIndex) -> Optional[np.ndarray]:
+        """Splats of the full level in the client camera's view order, or None to keep theirs"""
+        try:
+            camera = client.camera
+            planes = frustum_planes(camera.position, camera.wxyz, camera.fov, camera.aspect, camera.near, camera.far)
+        except Exception as e:
+            # The client hasn't reported its camera yet
+            print(f"Streaming splats to client {client.client_id} unordered: {e}")
+            return None
+        with span("view_order"):
+            return index.view_order(planes, camera.position)
+
+    def _remove_handles(self, entry: list):
+        for handle in entry[2]:
+            try:
+                handle.remove()
+            except Exception:
+                pass
+        entry[2] = []
+
+    def _add_gs(self, client, name: str, arrays: Dict[str, np.ndarray]):
+        """Add gaussian splats to one client's scene"""
+        with span("splat_upload"):
+            return client.scene.add_gaussian_splats(
+                name,
+                centers=arrays["centers"],
+                rgbs=arrays["rgbs"],
+                opacities=arrays["opacities"],
+                covariances=arrays["covariances"],
+            )
+
+    def _show_scene(self, client):
+        """Show the loaded scene's background, mesh and start view to one client"""
+        generation = self.generation
+        summary, mesh = self.summary, self.mesh
+        handles = []
+        try:
+            # Background color, the mean color of the farthest splats
+            client.scene.set_background_image(np.ones((1, 1, 3)) * np.asarray(summary["background_color"]))
+            if mesh is not None:
+                handles.append(client.scene.add_mesh_trimesh(name="/scene_mesh", mesh=mesh))
+            handles.append(self._create_ui(client, summary["start_camera"]))
+        except Exception as e:
+            # Most likely the client disconnected
+            print(f"Could not show scene {self.scene_id} to client {client.client_id}: {e}")
+
+        with self._clients_lock:
+            entry = self._clients.get(client.client_id)
+            if entry is not None and self.generation == generation:
+                entry[4] = handles
+                return
+            # The scene was cleared while it was being shown
+            entry = self._clients.pop(client.client_id, None)
+        for handle in handles:
+            handle.remove()
+        if entry is not None:
+            self._expire(client, entry)
+
+    def _expire(self, client, entry: list):
+        """Take a client's scene away and tell it the scene has expired"""
+        self._remove_handles(entry)
+        for handle in entry[4]:
+            try:
+                handle.remove()
+            except Exception:
+                pass
+        entry[4] = []
+        try:
+            client.gui.add_markdown(EXPIRED_NOTICE)
+        except Exception:
+            pass
+
+    def _create_ui(self, client, camera: dict):
+        """Create minimal UI for the viewer, returning the original camera frustum"""
+        client.camera.position = tuple(camera["position"])
+        client.camera.wxyz = tuple(camera["wxyz"])
+        client.camera.fov = camera["fov"]
+        client.camera.far = camera["far"]
+        client.camera.near = camera["near"]
+
+        # Disable the scene tree only, keep other GUI elements
+        client.scene.show_scene_tree = False
+
+        # The original camera frustum at the scene's suggested start view
+        h, w = 1080, 1920
+        original_camera = client.scene.add_camera_frustum(
+            "original_camera", camera["fov"], w / h,
+            position=tuple(camera["position"]), wxyz=tuple(camera["wxyz"]),
+        )
+        original_camera.visible = False
+
+        @original_camera.on_click
+        def _(_):
+            with client.atomic():
+                client.camera.wxyz = original_camera.wxyz
+                client.camera.position = original_camera.position
+                client.camera.fov = original_camera.fov
+
+        return original_camera
+
+
+class ViewerPool:
+    """Pool of long-lived Viser servers, one live scene per port
+
+    Each scene's viewer URL is `<public_url>/scenes/<scene_id>/viewer`, which the
+    API redirects to whichever server holds the scene while it is live, so a URL
+    never leads to another scene once its port is reused. Scenes are evicted
+    least-recently-used first once `max_scenes` or `memory_budget_bytes` (the
+    float32 splat data of every LOD level held by the servers, and their spatial
+    indexes) would be exceeded.
+    """
+
+    def __init__(
+        self,
+        base_port: int = 8080,
+        max_scenes: int = 4,
+        memory_budget_bytes: int = 4 * 1024 ** 3,
+        host: str = "localhost",
+        lod_levels: int = 3,
+        chunk_size: int = 250_000,
+        convert_workers: Optional[int] = None,
+        public_url: str = "http://localhost:8888",
+    ):
+        self.public_url = public_url.rstrip("/")
+        self.max_scenes = max(1, max_scenes)
+        self.memory_budget_bytes = memory_budget_bytes
+        self.lod_levels = lod_levels
+        # Threads converting and validating splats; None uses every core
+        self.convert_workers = convert_workers
+        self.slots: List[ViewerSlot] = [
+            ViewerSlot(base_port + i, host, on_connect=self._touch_slot, chunk_size=chunk_size)
+            for i in range(self.max_scenes)
+        ]
+        # scene_id -> slot, ordered from least to most recently used
+        self._scenes: "OrderedDict[str, ViewerSlot]" = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        # Slots reserved for scenes being loaded -> their size in bytes
+        self._loading: Dict[ViewerSlot, int] = {}
+        # Evicted slots whose scene is still being cleared
+        self._clearing: set = set()
+        self._slot_freed = threading.Condition(self._lock)
+
+    def validate(self, scene_id: str, splat) -> SplatArrays:
+        """Float32 copy of a scene without its invalid splats, logging and counting what was dropped"""
+        with span("splat_conversion"):
+            arrays, dropped = convert_splats(splat, num_workers=self.convert_workers)
+        if any(dropped.values()):
+            print(f"Dropped {sum(dropped.values())} invalid splats from scene {scene_id}: {dropped}")
+            counter = REGISTRY.counter("splats_dropped_total", "Invalid splats dropped before serving")
+            for reason, count in dropped.items():
+                if count:
+                    counter.inc(count, reason=reason)
+        return SplatArrays(**arrays)
+
+    def serve(self, scene_id: str, splat, summary: Optional[dict] = None, validated: bool = False) -> str:
+        """Load a scene into a free (or evicted) server and return its viewer URL
+
+        Pass the scene's stored summary, if there is one, to skip analysing it again,
+        and `validated` if the scene came from `validate`.
+        """
+        if not validated:
+            splat = self.validate(scene_id, splat)
+        if summary is None:
+            with span("summary"):
+                summary = summarize_scene(splat)
+        arrays = {
+            "centers": splat.centers,
+            "rgbs": splat.rgbs,
+            "opacities": splat.opacities,
+            "covariances": splat.covariances,
+        }
+        with span("lod_build"):
+            levels = build_lod(arrays, num_levels=self.lod_levels)
+        with span("index_build"):
+            index = SplatIndex.from_arrays(levels[-1])
+        return self._load(scene_id, levels, summary, lod_nbytes(levels) + index.nbytes, index=index)
+
+    def serve_mesh(self, scene_id: str, mesh, summary: dict) -> str:
+        """Load a trimesh into a free (or evicted) server and return its viewer URL"""
+        return self._load(scene_id, [], summary, mesh_nbytes(mesh), mesh=mesh)
+
+    def _load(self, scene_id: str, levels, summary: dict, nbytes: int, mesh=None, index=None) -> str:
+        # Starting a server and uploading or clearing a scene can take seconds, so the
+        # pool lock is only held to reserve slots and to publish them once loaded
+        evicted = []
+        with self._lock:
+            if nbytes > self.memory_budget_bytes:
+                print(
+                    f"Scene {scene_id} ({nbytes / 1024 ** 2:.0f} MB) exceeds the viewer "
+                    f"memory budget; evicting all other scenes"
+                )
+            while True:
+                # Scenes still loading count against the limits but can't be evicted
+                while self._scenes and (
+                    len(self._scenes) + len(self._loading) >= self.max_scenes
+                    or self.memory_used() + sum(self._loading.values()) + nbytes > self.memory_budget_bytes
+                ):
+                    lru_scene_id = next(iter(self._scenes))
+                    print(f"Evicting least recently used scene {lru_scene_id}")
+                    evicted.append(self._evict(lru_scene_id))
+                slot = next(
+                    (slot for slot in self.slots
+                     if slot.scene_id is None and slot not in self._loading and slot not in self._clearing),
+                    None,
+                )
+                if slot is None and evicted:
+                    # Load straight into a slot this call evicted; loading clears it first
+                    slot = evicted.pop()
+                    self._clearing.discard(slot)
+                if slot is not None:
+                    break
+                # Every slot is loading or clearing another scene
+                self._slot_freed.wait()
+            self._loading[slot] = nbytes
+        self._release(evicted)
+
+        try:
+            with span("viewer_load"):
+                slot.load(scene_id, levels, summary, mesh=mesh, index=index)
+        except Exception:
+            slot.clear()
+            with self._lock:
+                del self._loading[slot]
+                self._slot_freed.notify()
+            raise
+
+        stale = []
+        with self._lock:
+            del self._loading[slot]
+            if scene_id in self._scenes:
+                # Loaded again while this copy was loading; the newest one wins
+                stale.append(self._evict(scene_id))
+            self._scenes[scene_id] = slot
+            self._last_used[scene_id] = time.time()
+            # Published scenes can be evicted for loads waiting on a slot
+            self._slot_freed.notify()
+        self._release(stale)
+        return self.viewer_url(scene_id)
+
+    def viewer_url(self, scene_id: str) -> str:
+        """Stable, scene-scoped viewer URL, live or not"""
+        return f"{self.public_url}/scenes/{scene_id}/viewer"
+
+    def get_url(self, scene_id: str) -> Optional[str]:
+        """Viewer URL of a live scene, marking it as recently used"""
+        return self.viewer_url(scene_id) if self.server_url(scene_id) is not None else None
+
+    def server_url(self, scene_id: str) -> Optional[str]:
+        """Address of the Viser server holding a live scene, marking it as recently used"""
+        with self._lock:
+            slot = self._scenes.get(scene_id)
+            if slot is None:
+                return None
+            self._scenes.move_to_end(scene_id)
+            self._last_used[scene_id] = time.time()
+            return slot.url
+
+    def pick(self, scene_id: str, origin, direction) -> Optional[dict]:
+        """The splat a ray hits first in a live scene (see `ViewerSlot.pick`)
+
+        Raises KeyError if the scene isn't live, or has no splats to pick.
+        """
+        index, full = self._indexed_scene(scene_id)
+        return pick_splat(index, full, origin, direction)
+
+    def crop(self, scene_id: str, lower, upper, centers_only: bool = False) -> Dict[str, np.ndarray]:
+        """Full-detail splat arrays of a live scene within a box, in their original order
+
+        Splats whose 3-sigma extent overlaps the box are kept, or with
+        `centers_only` those centered inside it. Raises KeyError as `pick` does.
+        """
+        index, full = self._indexed_scene(scene_id)
+        with span("crop"):
+            indices = np.sort(index.query_box(lower, upper, centers_only=centers_only))
+            return {key: full[key][indices] for key in full}
+
+    def _indexed_scene(self, scene_id: str):
+        """A live scene's spatial index and the full LOD level it indexes"""
+        with self._lock:
+            slot = self._scenes.get(scene_id)
+            if slot is None or slot.index is None:
+                raise KeyError(scene_id)
+            self._scenes.move_to_end(scene_id)
+            self._last_used[scene_id] = time.time()
+            return slot.index, slot.lod_levels[-1]
+
+    def evict(self, scene_id: str) -> bool:
+        with self._lock:
+            if scene_id not in self._scenes:
+                return False
+            slot = self._evict(scene_id)
+        self._release([slot])
+        return True
+
+    def scene_count(self) -> int:
+        return len(self._scenes)
+
+    def memory_used(self) -> int:
+        # A snapshot, so it can be read without the lock while scenes are loaded
+        return sum(slot.nbytes for slot in list(self._scenes.values()))
+
+    def client_count(self) -> int:
+        """Viewer clients connected across all slots"""
+        return sum(len(slot._clients) for slot in self.slots)
+
+    def list_scenes(self) -> List[dict]:
+        """Live scenes, most recently used first"""
+        with self._lock:
+            return [
+                {
+                    "scene_id": scene_id,
+                    "viewer_url": self.viewer_url(scene_id),
+                    "bytes": slot.nbytes,
+                    "last_used": self._last_used[scene_id],
+                }
+                for scene_id, slot in reversed(self._scenes.items())
+            ]
+
+    def warm_up(self):
+        """Start the first server ahead of the first scene"""
+        self.slots[0].start()
+
+    def ports(self) -> List[int]:
+        """Ports of the servers that have been started"""
+        return [slot.port for slot in self.slots if slot.server is not None]
+
+    def shutdown(self):
+        """Stop every server in the pool"""
+        with self._lock:
+            for slot in self.slots:
+                slot.stop()
+            self._scenes.clear()
+            self._last_used.clear()
+
+    def _touch_slot(self, slot: ViewerSlot):
+        with self._lock:
+            if self._scenes.get(slot.scene_id) is slot:
+                self._scenes.move_to_end(slot.scene_id)
+                self._last_used[slot.scene_id] = time.time()
+
+    def _evict(self, scene_id: str) -> ViewerSlot:
+        """Unpublish a scene, reserving its slot until `_release` clears it; call with the lock held"""
+        slot = self._scenes.pop(scene_id)
+        self._last_used.pop(scene_id, None)
+        self._clearing.add(slot)
+        return slot
+
+    def _release(self, slots: List[ViewerSlot]):
+        """Clear evicted slots, without the lock, and hand them back to the pool"""
+        for slot in slots:
+            try:
+                slot.clear()
+            finally:
+                with self._lock:
+                    self._clearing.discard(slot)
+                    self._slot_freed.notify()
@@ -8,13 +8,24 @@ const ViewerPage = ({ prompt, setIsGenerating, onBack }) => {
   const [viewerUrl, setViewerUrl] = useState('');
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  const [status, setStatus] = useState(null);
 
   useEffect(() => {
     let isCancelled = false;
+    let events = null;
+
+    const fail = (message) => {
+      if (!isCancelled) {
+        setError(message);
+        setLoading(false);
+        setIsGenerating(false);
+      }
+    };
 
     const generateWorld = async () => {
       setLoading(true);
       setError(null);
+      setStatus(null);
 
       try {
         const response = await fetch(`${API_URL}/generate`, {
@@ -32,20 +43,36 @@ const ViewerPage = ({ prompt, setIsGenerating, onBack }) => {
           throw new Error(errorData.detail || 'Generation failed');
         }
 
-        const data = await response.json();
-
-        if (!isCancelled) {
-          setViewerUrl(data.viewer_url);
-          setLoading(false);
-          setIsGenerating(false);
-        }
+        const { job_id: jobId } = await response.json();
+        if (isCancelled) return;
+
+        // Follow the queued job until it finishes
+        events = new EventSource(`${API_URL}/jobs/${jobId}/events`);
+        const onUpdate = (event) => {
+          const job = JSON.parse(event.data);
+          if (isCancelled) return;
+          setStatus(job);
+          if (job.status === 'complete') {
+            events.close();
+            setViewerUrl(job.result.viewer_url);
+            setLoading(false);
+            setIsGenerating(false);
+          } else if (job.status === 'failed' || job.status === 'cancelled') {
+            events.close();
+            fail(job.error || `Generation ${job.status}`);
+          }
+        };
+        ['queued', 'running', 'complete', 'failed', 'cancelled'].forEach((name) =>
+          events.addEventListener(name, onUpdate)
+        );
+        events.onerror = () => {
+          if (events.readyState === EventSource.CLOSED) {
+            fail('Lost connection to the generation server');
+          }
+        };
       } catch (err) {
-        if (!isCancelled) {
-          console.error('Error generating world:', err);
-          setError(err.message);
-          setLoading(false);
-          setIsGenerating(false);
-        }
+        console.error('Error generating world:', err);
+        fail(err.message);
       }
     };
 
@@ -54,6 +81,7 @@ const ViewerPage = ({ prompt, setIsGenerating, onBack }) => {
     // Cleanup function to prevent state updates if component unmounts
     return () => {
       isCancelled = true;
+      if (events) events.close();
     };
   }, [prompt]); // Removed setIsGenerating from dependencies to prevent re-runs
 
@@ -92,7 +120,13 @@ const ViewerPage = ({ prompt, setIsGenerating, onBack }) => {
           >
             <div className="loading-spinner"></div>
             <p className="loading-text">weaving your dream...</p>
-            <p className="loading-subtext">this may take 30-90 seconds</p>
+            <p className="loading-subtext">
+              {status && status.status === 'queued'
+                ? `waiting in line (${status.queue_position} ahead, ~${Math.round(status.eta_seconds)}s)`
+                : status && status.eta_seconds != null
+                  ? `${status.stage.replaceAll('_', ' ')}... ~${Math.round(status.eta_seconds)}s left`
+                  : 'this may take 30-90 seconds'}
+            </p>
           </motion.div>
         )}
 
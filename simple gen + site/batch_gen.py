@@ -0,0 +1,264 @@
+"""Headless batch generation of dream worlds
+
+Reads prompts from a JSONL or CSV file and generates them one after another
+with a single warm WorldGen instance, without starting a viewer. Each item is
+written to `<output_dir>/<id>/` and recorded in `<output_dir>/manifest.jsonl`
+with per-stage timings as soon as it finishes, so an interrupted batch resumes
+where it stopped.
+
+Input rows have a `prompt` and may also set `id`, `image`, `pano_image` and `seed`.
+Ids name the item's directory, so they are limited to letters, digits, `.`, `_`
+and `-`, and must be unique.
+"""
+import csv
+import json
+import os
+import re
+import time
+import traceback
+from typing import Dict, List
+
+import numpy as np
+from PIL import Image
+
+from splat_cache import SplatCache, cache_key, file_digest
+from splat_format import (
+    SplatArrays,
+    covariances_to_scale_rotation,
+    export_ply,
+    quaternions_to_matrices,
+    save_splat,
+)
+from backends import generation_mode
+from mesh_export import export_glb, to_trimesh
+from scene_summary import summarize_scene
+from camera_path import interpolate_camera_path
+from render_pipeline import render_camera_path
+
+try:
+    from gsplat import rasterization
+except ImportError:
+    rasterization = None
+
+# Safe as a single path component: no separators, and no leading dot
+ITEM_ID = re.compile(r"[A-Za-z0-9][A-Za-z0-9._-]*")
+
+
+def read_batch(path: str) -> List[dict]:
+    """Load batch items from a .jsonl or .csv file, assigning ids where missing"""
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            items = [dict(row) for row in csv.DictReader(f)]
+        else:
+            items = [json.loads(line) for line in f if line.strip()]
+
+    seen = set()
+    for index, item in enumerate(items):
+        item["id"] = str(item.get("id") or f"{index:05d}")
+        if not ITEM_ID.fullmatch(item["id"]):
+            raise ValueError(f"Batch item id {item['id']!r} may only contain letters, digits, '.', '_' and '-'")
+        if item["id"] in seen:
+            raise ValueError(f"Batch item id {item['id']!r} is used more than once")
+        seen.add(item["id"])
+        for key in ("image", "pano_image", "seed"):
+            if item.get(key) in ("", None):
+                item[key] = None
+        if item["seed"] is not None:
+            item["seed"] = int(item["seed"])
+        if not item.get("prompt") and item["pano_image"] is None:
+            raise ValueError(f"Batch item {item['id']} has neither a prompt nor a pano_image")
+    return items
+
+
+def item_dir(output_dir: str, item_id: str) -> str:
+    """Directory of one item's outputs, refusing any that would resolve outside `output_dir`"""
+    root = os.path.realpath(output_dir)
+    path = os.path.realpath(os.path.join(root, item_id))
+    if os.path.dirname(path) != root:
+        raise ValueError(f"Batch item {item_id!r} would be written outside {output_dir}")
+    return path
+
+
+def read_manifest(path: str) -> Dict[str, dict]:
+    """Latest manifest record per item id"""
+    records = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    records[record["id"]] = record
+    return records
+
+
+def append_manifest(path: str, record: dict):
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def flythrough_cameras(frames: int):
+    """A full turn around the up axis from the origin, starting at the original view"""
+    angles = np.deg2rad(np.arange(0, 361, 90))
+    # Rotations about the world up axis (-y), as wxyz quaternions
+    keyframe_wxyz = np.stack(
+        [np.cos(angles / 2), np.zeros_like(angles), -np.sin(angles / 2), np.zeros_like(angles)], axis=1
+    )
+    positions, wxyz, _ = interpolate_camera_path(
+        np.zeros((len(angles), 3)), keyframe_wxyz, frames, ease=False, spline=False, include_start=True
+    )
+    return list(zip(wxyz[:-1], positions[:-1]))
+
+
+def make_splat_renderer(splat, height: int, width: int, fov: float):
+    """Offline gaussian splat renderer built on gsplat, matching the viewer's camera convention"""
+    import torch
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    splat = SplatArrays.from_splat(splat)
+    scales, quaternions = covariances_to_scale_rotation(splat.covariances)
+    means = torch.as_tensor(np.asarray(splat.centers, dtype=np.float32), device=device)
+    quats = torch.as_tensor(quaternions, dtype=torch.float32, device=device)
+    scales = torch.as_tensor(scales, dtype=torch.float32, device=device)
+    opacities = torch.as_tensor(np.asarray(splat.opacities, dtype=np.float32).reshape(-1), device=device)
+    colors = torch.as_tensor(np.asarray(splat.rgbs, dtype=np.float32), device=device)
+
+    # Same background as the viewer: the mean color of the farthest splats
+    background_color = summarize_scene(splat)["background_color"]
+    background = torch.as_tensor(background_color, dtype=torch.float32, device=device)
+
+    focal = height / 2 / np.tan(fov / 2)
+    K = torch.tensor([[focal, 0, width / 2], [0, focal, height / 2], [0, 0, 1]], dtype=torch.float32, device=device)
+
+    def render(camera):
+        wxyz, position = camera
+        c2w = np.eye(4)
+        c2w[:3, :3] = quaternions_to_matrices(np.asarray(wxyz)[None])[0]
+        c2w[:3, 3] = position
+        viewmat = torch.as_tensor(np.linalg.inv(c2w), dtype=torch.float32, device=device)
+        with torch.no_grad():
+            image, _, _ = rasterization(
+                means, quats, scales, opacities, colors,
+                viewmat[None], K[None], width, height,
+                backgrounds=background[None],
+            )
+        return (image[0].clamp(0, 1) * 255).to(torch.uint8).cpu().numpy()
+
+    return render
+
+
+class BatchGenerator:
+    """Generates a batch of worlds with one warm backend (and WorldGen per mode)"""
+
+    def __init__(self, args, backend):
+        self.args = args
+        self.backend = backend
+        self.splat_cache = None
+        if args.cache_dir and not args.return_mesh:
+            self.splat_cache = SplatCache(args.cache_dir, max_bytes=args.cache_max_mb * 1024 ** 2)
+        if args.render_flythrough and rasterization is None:
+            print("gsplat is not installed; flythroughs will be skipped")
+
+    def load_backend(self, mode: str, timings: dict):
+        if not self.backend.is_loaded(mode):
+            start = time.perf_counter()
+            self.backend.load(mode)
+            timings["load_model"] = time.perf_counter() - start
+
+    def generate(self, item: dict, timings: dict):
+        mode = generation_mode(item["image"])
+        key = None
+        if self.splat_cache is not None:
+            extra = {}
+            if item["pano_image"] is not None:
+                extra["pano_image"] = file_digest(item["pano_image"])
+            elif item["image"] is not None:
+                extra["image"] = file_digest(item["image"])
+            key = cache_key(item.get("prompt"), seed=item["seed"], **self.backend.cache_params(mode), **extra)
+            scene = self.splat_cache.get(key)
+            if scene is not None:
+                timings["cache_hit"] = True
+                return scene
+
+        self.load_backend(mode, timings)
+        start = time.perf_counter()
+        scene = self.backend.generate(
+            item.get("prompt"),
+            image=Image.open(item["image"]) if item["image"] is not None else None,
+            pano_image=Image.open(item["pano_image"]) if item["pano_image"] is not None else None,
+            seed=item["seed"],
+            return_mesh=self.args.return_mesh,
+        )
+        timings["generate"] = time.perf_counter() - start
+
+        if key is not None:
+            scene = self.splat_cache.put(key, scene)
+        return scene
+
+    def save(self, scene, item_dir: str, timings: dict) -> dict:
+        start = time.perf_counter()
+        outputs = {}
+        if self.args.return_mesh:
+            outputs["mesh"] = os.path.join(item_dir, "mesh.glb")
+            export_glb(to_trimesh(scene, self.args.target_faces), outputs["mesh"])
+        else:
+            outputs["scene"] = os.path.join(item_dir, "scene.dsplat")
+            save_splat(outputs["scene"], scene)
+            outputs["num_splats"] = len(scene.centers)
+            if self.args.save_ply:
+                outputs["ply"] = os.path.join(item_dir, "splat.ply")
+                export_ply(outputs["ply"], scene)
+        timings["save"] = time.perf_counter() - start
+
+        if self.args.render_flythrough and not self.args.return_mesh and rasterization is not None:
+            start = time.perf_counter()
+            render = make_splat_renderer(
+                scene, self.args.render_height, self.args.render_width, np.deg2rad(self.args.render_fov),
+            )
+            render_camera_path(
+                render,
+                flythrough_cameras(self.args.flythrough_frames),
+                item_dir,
+                still_format="none",
+                max_in_flight=2,
+            )
+            outputs["flythrough"] = os.path.join(item_dir, "rgb.mp4")
+            timings["render"] = time.perf_counter() - start
+        return outputs
+
+    def run(self, batch_path: str):
+        items = read_batch(batch_path)
+        os.makedirs(self.args.output_dir, exist_ok=True)
+        manifest_path = os.path.join(self.args.output_dir, "manifest.jsonl")
+        done = {
+            item_id for item_id, record in read_manifest(manifest_path).items()
+            if record["status"] == "ok"
+        }
+        todo = [item for item in items if item["id"] not in done]
+        print(f"Batch of {len(items)} items, {len(items) - len(todo)} already done")
+
+        failures = 0
+        for n, item in enumerate(todo, 1):
+            print(f"[{n}/{len(todo)}] Generating {item['id']}: '{item.get('prompt') or item['pano_image']}'")
+            timings = {}
+            record = {"id": item["id"], "prompt": item.get("prompt"), "started_at": time.time()}
+            start = time.perf_counter()
+            try:
+                scene = self.generate(item, timings)
+                path = item_dir(self.args.output_dir, item["id"])
+                os.makedirs(path, exist_ok=True)
+                record["outputs"] = self.save(scene, path, timings)
+                record["status"] = "ok"
+            except Exception as e:
+                traceback.print_exc()
+                failures += 1
+                record["status"] = "failed"
+                record["error"] = str(e)
+            timings["total"] = time.perf_counter() - start
+            record["timings"] = timings
+            append_manifest(manifest_path, record)
+            print(f"  {record['status']} in {timings['total']:.1f}s")
+
+        print(f"Batch finished: {len(todo) - failures} generated, {failures} failed")
+        print(f"Manifest written to {manifest_path}")
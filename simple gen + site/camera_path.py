@@ -0,0 +1,188 @@
+"""Batched camera path interpolation
+
+Positions and wxyz quaternions for a whole camera path are computed in one
+shot with NumPy. Paths through two keyframes reproduce the original
+ease-in-out lerp/slerp; longer paths use Catmull-Rom splines for positions and
+SQUAD for rotations, optionally reparameterized to move at constant speed.
+"""
+from typing import Tuple
+
+import numpy as np
+
+
+def quaternion_slerp(q1, q2, t):
+    """Spherical linear interpolation between quaternions."""
+    q1 = np.array(q1)
+    q2 = np.array(q2)
+
+    q1 = q1 / np.linalg.norm(q1)
+    q2 = q2 / np.linalg.norm(q2)
+    dot = np.sum(q1 * q2)
+
+    if dot < 0.0:
+        q2 = -q2
+        dot = -dot
+
+    dot = min(1.0, max(-1.0, dot))
+    theta = np.arccos(dot)
+    sin_theta = np.sin(theta)
+    if sin_theta < 1e-6:
+        return q1 * (1 - t) + q2 * t
+
+    s1 = np.sin((1 - t) * theta) / sin_theta
+    s2 = np.sin(t * theta) / sin_theta
+
+    return q1 * s1 + q2 * s2
+
+
+def slerp(q1: np.ndarray, q2: np.ndarray, t: np.ndarray) -> np.ndarray:
+    """Batched slerp; q1 and q2 are (..., 4) and broadcast against t (...)"""
+    q1 = np.asarray(q1, dtype=np.float64)
+    q2 = np.asarray(q2, dtype=np.float64)
+    t = np.asarray(t, dtype=np.float64)[..., None]
+
+    q1 = q1 / np.linalg.norm(q1, axis=-1, keepdims=True)
+    q2 = q2 / np.linalg.norm(q2, axis=-1, keepdims=True)
+    dot = np.sum(q1 * q2, axis=-1, keepdims=True)
+
+    # Take the short way around
+    q2 = np.where(dot < 0.0, -q2, q2)
+    dot = np.clip(np.abs(dot), -1.0, 1.0)
+
+    theta = np.arccos(dot)
+    sin_theta = np.sin(theta)
+    # Nearly identical rotations fall back to lerp, as in quaternion_slerp
+    near = sin_theta < 1e-6
+    safe_sin = np.where(near, 1.0, sin_theta)
+    s1 = np.where(near, 1 - t, np.sin((1 - t) * theta) / safe_sin)
+    s2 = np.where(near, t, np.sin(t * theta) / safe_sin)
+    return q1 * s1 + q2 * s2
+
+
+def smoothstep(t: np.ndarray) -> np.ndarray:
+    """Ease-in-out curve used for camera paths"""
+    return t * t * (3 - 2 * t)
+
+
+def quaternion_multiply(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    aw, ax, ay, az = np.moveaxis(a, -1, 0)
+    bw, bx, by, bz = np.moveaxis(b, -1, 0)
+    return np.stack([
+        aw * bw - ax * bx - ay * by - az * bz,
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw,
+    ], axis=-1)
+
+
+def quaternion_conjugate(q: np.ndarray) -> np.ndarray:
+    return q * np.array([1.0, -1.0, -1.0, -1.0])
+
+
+def quaternion_log(q: np.ndarray) -> np.ndarray:
+    """Log of unit quaternions, as pure quaternions (w = 0)"""
+    vector = q[..., 1:]
+    norm = np.linalg.norm(vector, axis=-1, keepdims=True)
+    angle = np.arctan2(norm, q[..., :1])
+    scale = np.where(norm > 1e-12, angle / np.maximum(norm, 1e-12), 1.0)
+    return np.concatenate([np.zeros_like(angle), vector * scale], axis=-1)
+
+
+def quaternion_exp(q: np.ndarray) -> np.ndarray:
+    """Exp of pure quaternions"""
+    vector = q[..., 1:]
+    angle = np.linalg.norm(vector, axis=-1, keepdims=True)
+    scale = np.where(angle > 1e-12, np.sin(angle) / np.maximum(angle, 1e-12), 1.0)
+    return np.concatenate([np.cos(angle), vector * scale], axis=-1)
+
+
+def align_hemispheres(quaternions: np.ndarray) -> np.ndarray:
+    """Flip signs so consecutive quaternions are on the same hemisphere"""
+    quaternions = np.asarray(quaternions, dtype=np.float64)
+    quaternions = quaternions / np.linalg.norm(quaternions, axis=1, keepdims=True)
+    signs = np.ones(len(quaternions))
+    dots = np.sum(quaternions[1:] * quaternions[:-1], axis=1)
+    signs[1:] = np.cumprod(np.where(dots < 0, -1.0, 1.0))
+    return quaternions * signs[:, None]
+
+
+def catmull_rom(points: np.ndarray, segment: np.ndarray, h: np.ndarray) -> np.ndarray:
+    """Uniform Catmull-Rom spline through `points`, evaluated at local parameter h of each segment"""
+    padded = np.concatenate([points[:1], points, points[-1:]])
+    p0, p1, p2, p3 = (padded[segment + i] for i in range(4))
+    h = h[:, None]
+    return 0.5 * (
+        2 * p1
+        + (p2 - p0) * h
+        + (2 * p0 - 5 * p1 + 4 * p2 - p3) * h ** 2
+        + (3 * p1 - p0 - 3 * p2 + p3) * h ** 3
+    )
+
+
+def squad(quaternions: np.ndarray, segment: np.ndarray, h: np.ndarray) -> np.ndarray:
+    """SQUAD spline through unit `quaternions`, evaluated at local parameter h of each segment"""
+    q = align_hemispheres(quaternions)
+    padded = np.concatenate([q[:1], q, q[-1:]])
+    inverse = quaternion_conjugate(q)
+    # Inner control points s_i = q_i exp(-(log(q_i^-1 q_i+1) + log(q_i^-1 q_i-1)) / 4)
+    tangents = (
+        quaternion_log(quaternion_multiply(inverse, padded[2:]))
+        + quaternion_log(quaternion_multiply(inverse, padded[:-2]))
+    )
+    controls = quaternion_multiply(q, quaternion_exp(-tangents / 4))
+
+    outer = slerp(q[segment], q[segment + 1], h)
+    inner = slerp(controls[segment], controls[segment + 1], h)
+    return slerp(outer, inner, 2 * h * (1 - h))
+
+
+def evaluate_path(positions: np.ndarray, wxyz: np.ndarray, u: np.ndarray, spline: bool) -> Tuple[np.ndarray, np.ndarray]:
+    """Positions and rotations at global path parameters u in [0, 1]"""
+    num_segments = len(positions) - 1
+    scaled = np.clip(u, 0.0, 1.0) * num_segments
+    segment = np.minimum(scaled.astype(np.int64), num_segments - 1)
+    h = scaled - segment
+
+    if spline and len(positions) > 2:
+        return catmull_rom(positions, segment, h), squad(wxyz, segment, h)
+    interp_positions = positions[segment] + h[:, None] * (positions[segment + 1] - positions[segment])
+    return interp_positions, slerp(wxyz[segment], wxyz[segment + 1], h)
+
+
+def constant_speed(positions: np.ndarray, wxyz: np.ndarray, s: np.ndarray, spline: bool, samples_per_segment: int = 256) -> np.ndarray:
+    """Map arc-length fractions s to path parameters u, so equal steps in s cover equal distance"""
+    dense_u = np.linspace(0.0, 1.0, (len(positions) - 1) * samples_per_segment + 1)
+    dense_positions, _ = evaluate_path(positions, wxyz, dense_u, spline)
+    arc_length = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(dense_positions, axis=0), axis=1))])
+    if arc_length[-1] < 1e-9:
+        # The camera only rotates; fall back to the plain parameterization
+        return s
+    return np.interp(s * arc_length[-1], arc_length, dense_u)
+
+
+def interpolate_camera_path(
+    keyframe_positions,
+    keyframe_wxyz,
+    steps: int,
+    ease: bool = True,
+    spline: bool = True,
+    uniform_speed: bool = False,
+    include_start: bool = False,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Interpolate `steps` cameras along the path through the keyframes
+
+    Returns (positions (steps, 3), wxyz (steps, 4), t (steps,)), where t in (0, 1]
+    is the uniform progress along the path. The first keyframe itself is only
+    included when `include_start` is set.
+    """
+    positions = np.asarray(keyframe_positions, dtype=np.float64).reshape(-1, 3)
+    wxyz = align_hemispheres(np.asarray(keyframe_wxyz, dtype=np.float64).reshape(-1, 4))
+    if len(positions) < 2:
+        raise ValueError("A camera path needs at least two keyframes")
+
+    first = 0 if include_start else 1
+    t = np.arange(first, steps + 1) / steps
+    s = smoothstep(t) if ease else t
+    u = constant_speed(positions, wxyz, s, spline) if uniform_speed else s
+    interp_positions, interp_wxyz = evaluate_path(positions, wxyz, u, spline)
+    return interp_positions, interp_wxyz, t
@@ -1,43 +1,32 @@
 import viser
-import torch
 import os
-import imageio
+import sys
 import numpy as np
 from PIL import Image
 
-from typing import Optional, Union, Tuple
-from scipy.spatial.transform import Rotation as R
-from tqdm import tqdm
+from typing import Tuple
 import time
-from pathlib import Path
 from worldgen.utils.splat_utils import SplatFile
-from worldgen import WorldGen
 import open3d as o3d
-import trimesh
 
-def quaternion_slerp(q1, q2, t):
-    """Spherical linear interpolation between quaternions."""
-    q1 = np.array(q1)
-    q2 = np.array(q2)
-
-    q1 = q1 / np.linalg.norm(q1)
-    q2 = q2 / np.linalg.norm(q2)
-    dot = np.sum(q1 * q2)
-
-    if dot < 0.0:
-        q2 = -q2
-        dot = -dot
-
-    dot = min(1.0, max(-1.0, dot))
-    theta = np.arccos(dot)
-    sin_theta = np.sin(theta)
-    if sin_theta < 1e-6:
-        return q1 * (1 - t) + q2 * t
-
-    s1 = np.sin((1 - t) * theta) / sin_theta
-    s2 = np.sin(t * theta) / sin_theta
-
-    return q1 * s1 + q2 * s2
+# Share the scene cache with the API server
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from splat_cache import SplatCache, cache_key, file_digest
+from splat_format import SplatArrays, export_ply
+from backends import create_backend, generation_mode
+from mesh_export import export_glb, to_trimesh
+from scene_summary import summarize_scene
+from camera_path import interpolate_camera_path
+from render_pipeline import STILL_FORMATS, render_camera_path
+
+def create_demo_backend(args):
+    """Generation backend selected on the command line"""
+    if args.backend == "synthetic":
+        return create_backend("synthetic", num_splats=args.synthetic_splats, latency=args.synthetic_latency)
+    # low_vram is detected from the GPU unless forced on
+    return create_backend(
+        "worldgen", resolution=args.resolution, inpaint_bg=args.inpaint_bg, low_vram=args.low_vram or None
+    )
 
 
 class ViserServer:
@@ -45,7 +34,6 @@ class ViserServer:
         self.server = viser.ViserServer()
         self.server.scene.set_up_direction("-y")
         self.server.scene.enable_default_lights(False)
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.return_mesh = False
 
         if args.return_mesh:
@@ -59,15 +47,20 @@ class ViserServer:
             print("\033[93m⚠️  This feature may produce worse results than the default mode ⚠️\033[0m")
             print("\033[93m" + "!" * 70 + "\033[0m")
         
-        mode = "t2s" if args.image is None else "i2s"
-        self.worldgen = WorldGen(mode=mode, 
-                                 inpaint_bg=args.inpaint_bg, 
-                                 resolution=args.resolution,
-                                 device=self.device,
-                                 low_vram=args.low_vram)
+        mode = generation_mode(args.image)
+        self.backend = create_demo_backend(args)
+        self.backend.load(mode)
         self.args = args
         self.frames = []
         self.start_camera = None
+        # (position, wxyz) of each camera path keyframe after the start camera
+        self.keyframes = []
+        self.path_frames = []
+        self.mode = mode
+        # Meshes are not cached, only gaussian splat scenes
+        self.splat_cache = None
+        if args.cache_dir and not args.return_mesh:
+            self.splat_cache = SplatCache(args.cache_dir, max_bytes=args.cache_max_mb * 1024 ** 2)
 
     def add_camera_frustum(
         self,
@@ -93,7 +86,11 @@ class ViserServer:
 
     def add_gs(self, splat: SplatFile):
         if self.args.save_scene:
-            splat.save(os.path.join(self.args.output_dir, "splat.ply"))
+            os.makedirs(self.args.output_dir, exist_ok=True)
+            if isinstance(splat, SplatArrays):
+                export_ply(os.path.join(self.args.output_dir, "splat.ply"), splat)
+            else:
+                splat.save(os.path.join(self.args.output_dir, "splat.ply"))
         self.scene_gs_handle = self.server.scene.add_gaussian_splats(
             "/scene_gs",
             centers=splat.centers,
@@ -103,14 +100,11 @@ class ViserServer:
         )
     
     def add_mesh(self, mesh: o3d.geometry.TriangleMesh):
+        # One conversion, shared by the exported GLB and the viewer
+        trimesh_mesh = to_trimesh(mesh, self.args.target_faces)
         if self.args.save_scene:
-            file_path = os.path.join(self.args.output_dir, "mesh.glb")
-            o3d.io.write_triangle_mesh(file_path, mesh)
-        vertices = np.asarray(mesh.vertices)
-        faces = np.asarray(mesh.triangles)
-        colors = np.asarray(mesh.vertex_colors)
-        trimesh_mesh = trimesh.Trimesh(vertices=vertices, faces=faces)
-        trimesh_mesh.visual.vertex_colors = colors
+            os.makedirs(self.args.output_dir, exist_ok=True)
+            export_glb(trimesh_mesh, os.path.join(self.args.output_dir, "mesh.glb"))
         self.scene_mesh_handle = self.server.scene.add_mesh_trimesh(name="/scene_mesh", mesh=trimesh_mesh)
 
     def add_original_camera(self):
@@ -144,27 +138,35 @@ class ViserServer:
         render_fov_rad = np.deg2rad(render_fov_deg)
 
         print(f"Starting to save novel views ({render_h}x{render_w}, FoV: {render_fov_deg}°)")
-        image_dir = os.path.join(self.args.output_dir, "images")
-        os.makedirs(image_dir, exist_ok=True)
-        os.makedirs(self.args.output_dir, exist_ok=True)
-        
+
         # Render all cameras
-        start_idx = 0
         self.prepare_render_visibility()
-        rgb_video_writer = imageio.get_writer(os.path.join(self.args.output_dir, "rgb.mp4"), fps=30)
-        for i, frame in tqdm(enumerate(self.frames), total=len(self.frames)):
+        cameras = [(frame.wxyz, frame.position) for frame in self.frames]
+
+        def render(camera):
+            wxyz, position = camera
             # Use values from UI for rendering
-            rendered_image = client.get_render(
+            return client.get_render(
                 height=render_h,
                 width=render_w,
-                wxyz=frame.wxyz,
-                position=frame.position,
+                wxyz=wxyz,
+                position=position,
                 fov=render_fov_rad # Use FoV from UI (in radians)
             )
-            imageio.imwrite(f"{image_dir}/{i+start_idx:04d}.png", rendered_image)
-            rgb_video_writer.append_data(rendered_image)
-        rgb_video_writer.close()
-        self.restore_render_visibility()
+
+        try:
+            render_camera_path(
+                render,
+                cameras,
+                self.args.output_dir,
+                still_format=self.still_format_input.value,
+                save_video=self.save_video_input.value,
+                # viser matches render responses to whichever request is waiting,
+                # so a client can only have one render outstanding
+                max_in_flight=1,
+            )
+        finally:
+            self.restore_render_visibility()
 
     def add_interpolated_cameras(self, client):
         current_wxyz = client.camera.wxyz
@@ -196,51 +198,53 @@ class ViserServer:
             self.frames.append(self.start_camera)
             return 
 
-        start_wxyz = self.start_camera.wxyz
-        start_position = self.start_camera.position
-        camera_counter = [0]
-
-        # Create interpolated cameras
-        for i in range(1, steps + 1):
-            # Calculate interpolation factor (0 to 1)
-            t = i / steps
-            
-            # Apply ease-in-out effect (cubic bezier)
-            t_eased = t * t * (3 - 2 * t)  # Smooth step function for ease-in-out
-
-            interp_position = t_eased * current_position + (1 - t_eased) * start_position
-            interp_wxyz = quaternion_slerp(start_wxyz, current_wxyz, t_eased)
-
-            c2w = torch.eye(4, dtype=torch.float64, device=self.device)
-            c2w[:3, :3] = torch.from_numpy(
-                R.from_quat(interp_wxyz, scalar_first=True).as_matrix()
-            )
-            c2w[:3, 3] = torch.tensor(interp_position, device=self.device)
-
-            # Create a new camera frustum at the interpolated position
-            camera_name = f"/{camera_counter[0]}"
-            camera_counter[0] += 1
-
-            # Color gradient from blue to green
-            r = int(0 * (1 - t) + 0 * t)
-            g = int(150 * (1 - t) + 255 * t)
-            b = int(255 * (1 - t) + 0 * t)
-
-            # Add camera frustum
-            frustum = self.server.scene.add_camera_frustum(
-                camera_name,
-                fov=current_fov,
-                aspect=current_aspect,
-                scale=0.2,
-                wxyz=interp_wxyz,
-                position=interp_position,
-                color=(r, g, b),  # Color gradient from blue to green
-            )
-
-            frustum.on_click(create_click_handler(frustum))
-            self.frames.append(frustum)
+        # Every further click adds a keyframe and rebuilds the whole path
+        self.keyframes.append((np.array(current_position), np.array(current_wxyz)))
+        keyframe_positions = [self.start_camera.position] + [k[0] for k in self.keyframes]
+        keyframe_wxyz = [self.start_camera.wxyz] + [k[1] for k in self.keyframes]
+        positions, wxyzs, ts = interpolate_camera_path(
+            keyframe_positions,
+            keyframe_wxyz,
+            steps,
+            spline=self.path_type.value == "Spline",
+            uniform_speed=self.constant_speed.value,
+        )
 
-        print(f"Added camera path with {steps+1} cameras")
+        # Color gradient from blue to green
+        colors = np.stack([np.zeros_like(ts), 150 * (1 - ts) + 255 * ts, 255 * (1 - ts)], axis=1).astype(int)
+
+        # Create all interpolated cameras in a single scene update
+        with self.server.atomic():
+            self.remove_path_frames()
+            for i, (interp_position, interp_wxyz, color) in enumerate(zip(positions, wxyzs, colors)):
+                frustum = self.server.scene.add_camera_frustum(
+                    f"/{i}",
+                    fov=current_fov,
+                    aspect=current_aspect,
+                    scale=0.2,
+                    wxyz=interp_wxyz,
+                    position=interp_position,
+                    color=tuple(int(c) for c in color),
+                )
+                frustum.on_click(create_click_handler(frustum))
+                self.path_frames.append(frustum)
+        self.frames.extend(self.path_frames)
+
+        print(f"Added camera path with {steps+1} cameras through {len(keyframe_positions)} keyframes")
+
+    def remove_path_frames(self):
+        for frame in self.path_frames:
+            frame.remove()
+            self.frames.remove(frame)
+        self.path_frames = []
+
+    def clear_camera_path(self):
+        self.remove_path_frames()
+        if self.start_camera is not None:
+            self.frames.remove(self.start_camera)
+            self.start_camera.remove()
+            self.start_camera = None
+        self.keyframes = []
 
     def create_ui(self, client):
         initial_fov_rad = self.original_camera.fov
@@ -255,7 +259,12 @@ class ViserServer:
             self.interpolation_steps = client.gui.add_slider(
                 "Interpolation Steps", min=1, max=1000, step=1, initial_value=120
             )
+            self.path_type = client.gui.add_dropdown(
+                "Path Type", ("Linear", "Spline"), initial_value="Spline"
+            )
+            self.constant_speed = client.gui.add_checkbox("Constant Speed", initial_value=False)
             self.add_camera_path_button = client.gui.add_button("Generate Camera Path")
+            self.clear_camera_path_button = client.gui.add_button("Clear Camera Path")
 
         with client.gui.add_folder("Render Settings"):
             self.render_fov_input = client.gui.add_number(
@@ -267,6 +276,10 @@ class ViserServer:
             self.render_width_input = client.gui.add_number(
                 "Render Width", initial_value=self.init_w, min=64, max=4096, step=1
             )
+            self.still_format_input = client.gui.add_dropdown(
+                "Still Format", STILL_FORMATS, initial_value="png"
+            )
+            self.save_video_input = client.gui.add_checkbox("Save Video", initial_value=True)
             self.save_button = client.gui.add_button("Save Novel Views")
 
             # Update client camera FoV when the input changes
@@ -274,23 +287,34 @@ class ViserServer:
             def _(value):
                 client.camera.fov = np.deg2rad(self.render_fov_input.value)
 
-    def generate_world(self):
+    def scene_cache_key(self):
+        extra = {}
         if self.args.pano_image is not None:
-            pano_image = Image.open(self.args.pano_image).convert("RGB")
-            pano_image = pano_image.resize((2048, 1024))
-            scene = self.worldgen._generate_world(pano_image, return_mesh=self.return_mesh)
+            extra["pano_image"] = file_digest(self.args.pano_image)
         elif self.args.image is not None:
-            image = Image.open(self.args.image).convert("RGB")
-            scene = self.worldgen.generate_world(self.args.prompt, image, return_mesh=self.return_mesh)
-        else:
-            scene = self.worldgen.generate_world(self.args.prompt, return_mesh=self.return_mesh)
-        return scene
+            extra["image"] = file_digest(self.args.image)
+        return cache_key(self.args.prompt, **self.backend.cache_params(self.mode), **extra)
+
+    def generate_world(self):
+        if self.splat_cache is None:
+            return self._generate_world()
+        key = self.scene_cache_key()
+        scene = self.splat_cache.get(key)
+        if scene is not None:
+            print("Loaded the world from the scene cache")
+            return scene
+        return self.splat_cache.put(key, self._generate_world())
+
+    def _generate_world(self):
+        image = Image.open(self.args.image) if self.args.image is not None else None
+        pano_image = Image.open(self.args.pano_image) if self.args.pano_image is not None else None
+        return self.backend.generate(
+            self.args.prompt, image=image, pano_image=pano_image, return_mesh=self.return_mesh
+        )
 
     def set_bg(self, splat: SplatFile):
-        position = np.linalg.norm(splat.centers, axis=1)
-        indices = np.argsort(position)[-5:]  # Get indices of k largest distances
-        farthest_point_color = splat.rgbs[indices]
-        farthest_point_color = np.mean(farthest_point_color, axis=0)
+        # Mean color of the farthest splats
+        farthest_point_color = np.asarray(summarize_scene(splat)["background_color"])
         bg_img = np.ones((1, 1, 3)) * farthest_point_color
         self.server.scene.set_background_image(bg_img)
 
@@ -330,6 +354,10 @@ class ViserServer:
             def _(_):
                 self.add_interpolated_cameras(client)
 
+            @self.clear_camera_path_button.on_click
+            def _(_):
+                self.clear_camera_path()
+
 
         try:
             while True:
@@ -348,13 +376,27 @@ if __name__ == "__main__":
     parser.add_argument("--pano_image", type=str, default=None, help="Path to input Panorama image")
     parser.add_argument("--inpaint_bg", action="store_true", help="Whether to inpaint the background")
     parser.add_argument("--return_mesh", action="store_true", help="Whether to return the mesh")
+    parser.add_argument("--target_faces", type=int, default=None, help="Decimate meshes to about this many faces")
     parser.add_argument("--save_scene", action="store_true", help="Whether to save the scene")
     parser.add_argument("--low_vram", action="store_true", help="Whether to use low VRAM")
+    parser.add_argument("--backend", type=str, default="worldgen", choices=["worldgen", "synthetic"], help="Generation backend; synthetic builds random scenes on the CPU for testing")
+    parser.add_argument("--synthetic_splats", type=int, default=500000, help="Number of splats in synthetic scenes")
+    parser.add_argument("--synthetic_latency", type=float, default=0.0, help="Minimum seconds a synthetic generation takes")
+    parser.add_argument("--batch", type=str, default=None, help="JSONL/CSV file of prompts to generate headlessly instead of starting the viewer")
+    parser.add_argument("--save_ply", action="store_true", help="In batch mode, also export each scene as PLY")
+    parser.add_argument("--render_flythrough", action="store_true", help="In batch mode, render a flythrough video of each scene (requires gsplat)")
+    parser.add_argument("--flythrough_frames", type=int, default=240, help="Number of frames in each batch flythrough")
+    parser.add_argument("--render_height", type=int, default=1080, help="Height of batch flythrough renders")
+    parser.add_argument("--render_width", type=int, default=1920, help="Width of batch flythrough renders")
+    parser.add_argument("--render_fov", type=float, default=90.0, help="Vertical FoV of batch flythrough renders in degrees")
+    parser.add_argument("--cache_dir", type=str, default="~/.cache/dream-storage/splats", help="Directory of the generated scene cache")
+    parser.add_argument("--cache_max_mb", type=int, default=20480, help="Maximum size of the scene cache in MB")
+    parser.add_argument("--no_cache", dest="cache_dir", action="store_const", const=None, help="Always regenerate instead of using the scene cache")
     args = parser.parse_args()
 
-    if torch.cuda.get_device_properties(0).total_memory / (1024 ** 3) < 24:
-        print("Detected GPU VRAM less than 24GB, setting low_vram to True")
-        args.low_vram = True
-
-    server = ViserServer(args)
-    server.run()
\ No newline at end of file
+    if args.batch is not None:
+        from batch_gen import BatchGenerator
+        BatchGenerator(args, create_demo_backend(args)).run(args.batch)
+    else:
+        server = ViserServer(args)
+        server.run()
\ No newline at end of file
@@ -0,0 +1,148 @@
+"""Pipelined rendering of camera paths to stills and video
+
+Renders are requested ahead of time with a bounded number in flight. Still
+images are encoded by a pool of writer threads, and the video is encoded by
+its own thread. All three stages overlap, and bounded queues apply
+backpressure so a slow encoder never buffers the whole path in memory.
+"""
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Sequence
+
+import imageio
+from tqdm import tqdm
+
+
+STILL_FORMATS = ("png", "jpg", "webp", "none")
+
+
+class VideoEncoder:
+    """Appends frames to a video file on a background thread"""
+
+    def __init__(self, path: str, fps: int = 30, queue_size: int = 16):
+        self.writer = imageio.get_writer(path, fps=fps)
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def append(self, frame):
+        """Queue a frame; blocks while the encoder is `queue_size` frames behind"""
+        self.frames.put(frame)
+
+    def close(self):
+        self.frames.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        try:
+            while True:
+                frame = self.frames.get()
+                if frame is None:
+                    break
+                if self.error is None:
+                    self.writer.append_data(frame)
+        except Exception as e:
+            self.error = e
+            # Keep draining so producers never block on a dead encoder
+            while self.frames.get() is not None:
+                pass
+        finally:
+            self.writer.close()
+
+
+class StillWriter:
+    """Writes numbered still images with a pool of threads"""
+
+    def __init__(self, image_dir: str, still_format: str = "png", num_workers: int = 4, queue_size: int = 16):
+        os.makedirs(image_dir, exist_ok=True)
+        self.image_dir = image_dir
+        self.still_format = still_format
+        self.executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="still-writer")
+        # Bounds the number of frames waiting to be written
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.futures = []
+
+    def write(self, index: int, frame):
+        self.slots.acquire()
+        future = self.executor.submit(imageio.imwrite, f"{self.image_dir}/{index:04d}.{self.still_format}", frame)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for future in self.futures:
+            # Re-raise the first write error, if any
+            future.result()
+
+
+def render_camera_path(
+    render: Callable,
+    cameras: Sequence,
+    output_dir: str,
+    still_format: str = "png",
+    save_video: bool = True,
+    fps: int = 30,
+    max_in_flight: int = 4,
+    num_still_writers: int = 4,
+    queue_size: int = 16,
+    start_idx: int = 0,
+):
+    """Render every camera with `render(camera)` and save stills and/or an mp4
+
+    Frames are written in path order even though renders overlap. `render` is
+    called from up to `max_in_flight` threads at once, so anything it can't
+    serve concurrently (such as a single viser client) needs `max_in_flight=1`;
+    rendering then still overlaps with encoding.
+    """
+    if still_format not in STILL_FORMATS:
+        raise ValueError(f"Unknown still format {still_format}, expected one of {STILL_FORMATS}")
+    os.makedirs(output_dir, exist_ok=True)
+
+    stills: Optional[StillWriter] = None
+    if still_format != "none":
+        stills = StillWriter(
+            os.path.join(output_dir, "images"), still_format, num_still_writers, queue_size
+        )
+    video: Optional[VideoEncoder] = None
+    if save_video:
+        video = VideoEncoder(os.path.join(output_dir, "rgb.mp4"), fps=fps, queue_size=queue_size)
+
+    renderer = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="render")
+    pending = deque()
+    total = len(cameras)
+    cameras = iter(cameras)
+    try:
+        with tqdm(total=total) as progress:
+            # Keep up to max_in_flight renders outstanding, consuming them in order
+            for camera in cameras:
+                pending.append(renderer.submit(render, camera))
+                if len(pending) >= max_in_flight:
+                    break
+            i = 0
+            while pending:
+                frame = pending.popleft().result()
+                next_camera = next(cameras, None)
+                if next_camera is not None:
+                    pending.append(renderer.submit(render, next_camera))
+                if stills is not None:
+                    stills.write(i + start_idx, frame)
+                if video is not None:
+                    video.append(frame)
+                i += 1
+                progress.update(1)
+    finally:
+        for future in pending:
+            future.cancel()
+        renderer.shutdown(wait=True)
+        try:
+            if stills is not None:
+                stills.close()
+        finally:
+            if video is not None:
+                video.close()
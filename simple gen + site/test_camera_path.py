@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from camera_path import interpolate_camera_path, quaternion_slerp, slerp, smoothstep
+
+
+def random_quaternions(n: int, seed: int = 0) -> np.ndarray:
+    q = np.random.default_rng(seed).normal(size=(n, 4))
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+def scalar_slerp(q1s, q2s, ts) -> np.ndarray:
+    return np.stack([quaternion_slerp(q1, q2, t) for q1, q2, t in zip(q1s, q2s, ts)])
+
+
+def test_slerp_matches_scalar():
+    q1, q2 = random_quaternions(500, seed=1), random_quaternions(500, seed=2)
+    t = np.random.default_rng(3).uniform(0, 1, size=500)
+    np.testing.assert_allclose(slerp(q1, q2, t), scalar_slerp(q1, q2, t), atol=1e-12)
+
+
+@pytest.mark.parametrize("t", [0.0, 1.0])
+def test_slerp_endpoints(t):
+    q1, q2 = random_quaternions(50, seed=4), random_quaternions(50, seed=5)
+    ts = np.full(50, t)
+    batched = slerp(q1, q2, ts)
+    np.testing.assert_allclose(batched, scalar_slerp(q1, q2, ts), atol=1e-12)
+    # Endpoints are the keyframes themselves, up to the sign chosen for the short way round
+    target = q1 if t == 0.0 else q2
+    np.testing.assert_allclose(np.abs(np.sum(batched * target, axis=1)), 1.0, atol=1e-12)
+
+
+def test_slerp_antipodal():
+    # q and -q are the same rotation, so the path between them stays put
+    q1 = random_quaternions(20, seed=6)
+    t = np.linspace(0, 1, 20)
+    batched = slerp(q1, -q1, t)
+    np.testing.assert_allclose(batched, scalar_slerp(q1, -q1, t), atol=1e-12)
+    np.testing.assert_allclose(batched, q1, atol=1e-12)
+
+
+def test_slerp_nearly_identical():
+    q1 = random_quaternions(20, seed=7)
+    q2 = q1 + 1e-9 * random_quaternions(20, seed=8)
+    t = np.linspace(0, 1, 20)
+    batched = slerp(q1, q2, t)
+    assert np.all(np.isfinite(batched))
+    np.testing.assert_allclose(batched, scalar_slerp(q1, q2, t), atol=1e-12)
+
+
+def test_two_keyframe_path_matches_scalar_slerp():
+    positions = np.array([[0.0, 0.0, 0.0], [1.0, 2.0, -3.0]])
+    wxyz = random_quaternions(2, seed=9)
+    steps = 30
+    interp_positions, interp_wxyz, t = interpolate_camera_path(positions, wxyz, steps, spline=False)
+
+    s = smoothstep(np.arange(1, steps + 1) / steps)
+    np.testing.assert_allclose(t, np.arange(1, steps + 1) / steps)
+    np.testing.assert_allclose(interp_positions, positions[0] + s[:, None] * (positions[1] - positions[0]), atol=1e-12)
+    expected = np.stack([quaternion_slerp(wxyz[0], wxyz[1], value) for value in s])
+    np.testing.assert_allclose(interp_wxyz, expected, atol=1e-12)
+
+
+@pytest.mark.parametrize("spline", [False, True])
+def test_path_passes_through_keyframes(spline):
+    positions = np.random.default_rng(10).normal(size=(4, 3))
+    wxyz = random_quaternions(4, seed=11)
+    # Without easing, every third step of nine lands on a keyframe
+    interp_positions, interp_wxyz, _ = interpolate_camera_path(
+        positions, wxyz, 9, ease=False, spline=spline, include_start=True
+    )
+    np.testing.assert_allclose(interp_positions[::3], positions, atol=1e-9)
+    np.testing.assert_allclose(np.abs(np.sum(interp_wxyz[::3] * wxyz, axis=1)), 1.0, atol=1e-9)